@@ -0,0 +1,65 @@
+"""Per-(year, month) aggregates for the overview callbacks.
+
+Everything the summary grid, the overview charts and the dealer grids need
+is computed here once, when the data is loaded, with a single grouped pass
+over the frames. The callbacks then only look the month up and assemble
+figures.
+"""
+from typing import NamedTuple
+
+import pandas as pd
+
+from row_model import RankedRows
+
+TOP_DEALERS = 10
+
+
+class MonthAggregate(NamedTuple):
+    summary: dict
+    top_dealers: pd.DataFrame
+    support: pd.DataFrame
+    points: RankedRows
+    data: RankedRows
+
+
+def summary_record(row):
+    """Row of the summary grid from the sums (and mean campaign) of a month."""
+    return {'UIO': row.uio, 'NOVS': row.novs, 'Total amount': row.total,
+            'Claims qty': row.qty, 'M2 amount': row.m2, 'M2 qty': row.m2_qty,
+            'Campaign': row.camp / 100}
+
+
+def _summaries(active):
+    sums = active.groupby(['year', 'month'], sort=False, observed=True).agg(
+        uio=('uio', 'sum'), novs=('novs', 'sum'), total=('total_cost', 'sum'),
+        qty=('claim_qty', 'sum'), m2=('m2_cost', 'sum'), m2_qty=('m2_qty', 'sum'),
+        camp=('campaign', 'mean'))
+    return {key: summary_record(row) for key, row in zip(sums.index, sums.itertuples())}
+
+
+def _supports(active):
+    support = active.groupby(['year', 'month', 'warranty'], observed=True)['total_points'].mean()
+    support = support.reset_index(level='warranty')
+    return {key: frame.reset_index(drop=True)
+            for key, frame in support.groupby(level=[0, 1], sort=False, observed=True)}
+
+
+def _rankings(frame, drop):
+    ranked = frame.sort_values(by='total_points', ascending=False, kind='stable')
+    return {key: group.drop(drop, axis=1).reset_index(drop=True)
+            for key, group in ranked.groupby(['year', 'month'], sort=False, observed=True)}
+
+
+def build_month_aggregates(dash_tab, freeze_rs, tab_top_dealers, tab_top_dealers_data):
+    """Return ``{(year, month): MonthAggregate}`` for every month in the data."""
+    active = dash_tab[~dash_tab['mobis_code'].isin(freeze_rs)]
+    summaries = _summaries(active)
+    supports = _supports(active)
+    points = _rankings(tab_top_dealers, ['year', 'month'])
+    data = _rankings(tab_top_dealers_data, ['year', 'month', 'total_points'])
+    return {key: MonthAggregate(summary=summaries[key],
+                                top_dealers=points[key][:TOP_DEALERS],
+                                support=supports[key],
+                                points=RankedRows(points[key]),
+                                data=RankedRows(data[key]))
+            for key in summaries}
@@ -0,0 +1,155 @@
+"""Outliers among the dealer KPIs, flagged when the data is loaded.
+
+Every KPI that has a regional benchmark (``dm2pu`` and ``dm2pu_reg`` ...)
+gets two robust z-scores per dealer and month:
+
+* ``reg_z`` - the dealer's ratio to its benchmark against the ratios of all
+  dealers that month
+* ``history_z`` - the value against the dealer's own previous
+  ``HISTORY_WINDOW`` months (scored once there are ``MIN_HISTORY`` of them)
+
+Both are modified z-scores, ``0.6745 * (x - median) / MAD``: medians and
+median absolute deviations are not dragged by the outliers they look for.
+A score of ``THRESHOLD`` or more either way raises an alert; a spread of
+zero (every dealer on the benchmark) scores nothing.
+
+The scores are computed on a dealer x month x KPI array of all the rows at
+once (the history window of a month is a slice of it); scoring given months
+only, like an appended one, builds that array from those months and the
+history window before them. The alerts are stored per month next to the
+other aggregates, strongest score first, and the Alerts tab only pages
+through them.
+
+Configuration (environment):
+
+* ``DWES_ALERT_THRESHOLD`` - modified z-score raising an alert, 3.5 by default
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from history import ROLLING_WINDOW
+from row_model import RankedRows
+from schema import MONTHS
+
+KPIS = ['m2_cost', 'parts_cost', 'total_cost', 'dm2pu', 'dcpu', 'cpc', 'rvs', 'campaign']
+
+THRESHOLD = float(os.environ.get('DWES_ALERT_THRESHOLD', 3.5))
+HISTORY_WINDOW = ROLLING_WINDOW
+MIN_HISTORY = 6
+
+NAME_COLUMNS = ['dealer_name', 'dealer_code', 'warranty']
+ALERT_COLUMNS = [*NAME_COLUMNS, 'kpi', 'value', 'benchmark', 'reg_z', 'history_median', 'history_z', 'score']
+
+# Columns of the rows scored: identity, period, the KPIs and their benchmarks.
+ROW_COLUMNS = ['year', 'month', 'dealer_name', 'dealer_code', 'mobis_code', 'warranty',
+               *KPIS, *[kpi + '_reg' for kpi in KPIS]]
+
+
+def _nanmedian(values, axis):
+    """Median along ``axis`` ignoring NaN (``np.nanmedian`` goes through masked arrays there)."""
+    count = np.sum(~np.isnan(values), axis=axis, keepdims=True)
+    if not values.shape[axis]:
+        return np.full(count.shape, np.nan)
+    ordered = np.sort(values, axis=axis)  # NaN sort last
+    low = np.take_along_axis(ordered, np.maximum(count - 1, 0) // 2, axis=axis)
+    high = np.take_along_axis(ordered, count // 2, axis=axis)
+    return np.where(count > 0, (low + high) / 2, np.nan)
+
+
+def _robust_z(values, reference, axis):
+    """Modified z-scores of ``values`` against the median and MAD of ``reference`` along ``axis``."""
+    median = _nanmedian(reference, axis)
+    mad = _nanmedian(np.abs(reference - median), axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(mad > 0, 0.6745 * (values - median) / mad, np.nan)
+    return z, median
+
+
+def _cube(rows, columns, dealers, periods):
+    """``dealer x period x column`` array of ``rows``, NaN where a dealer has no row."""
+    cube = np.full((dealers, periods, len(columns)), np.nan)
+    cube[rows['_dealer'].to_numpy(), rows['_period'].to_numpy()] = rows[columns].to_numpy(dtype='float64')
+    return cube
+
+
+def empty_alerts():
+    """Alerts of a month without any."""
+    return RankedRows(pd.DataFrame({column: pd.Series(dtype=object if column in (*NAME_COLUMNS, 'kpi') else 'float64')
+                                    for column in ALERT_COLUMNS}))
+
+
+def _month_alerts(identity, dealers, values, benchmarks, reg_z, history_median, history_z, threshold):
+    """Alerts of the rows of one month.
+
+    ``identity`` maps the name columns to the values of the rows and
+    ``dealers`` gives their rows in the ``dealer x KPI`` arrays of the month.
+    """
+    flagged = (np.abs(reg_z[dealers]) >= threshold) | (np.abs(history_z[dealers]) >= threshold)
+    row, kpi = np.nonzero(flagged)
+    dealer = dealers[row]
+    scores = {'kpi': np.asarray(KPIS, dtype=object)[kpi],
+              'value': values[dealer, kpi],
+              'benchmark': benchmarks[dealer, kpi],
+              'reg_z': reg_z[dealer, kpi],
+              'history_median': history_median[dealer, kpi],
+              'history_z': history_z[dealer, kpi]}
+    scores['score'] = np.fmax(np.abs(scores['reg_z']), np.abs(scores['history_z']))
+    ranked = np.argsort(-scores['score'], kind='stable')
+    frame = pd.DataFrame({**{name: column[row[ranked]] for name, column in identity.items()},
+                          **{name: column[ranked] for name, column in scores.items()}})
+    return RankedRows(frame[ALERT_COLUMNS])
+
+
+def build_alerts(rows, freeze_rs, keys=None, threshold=THRESHOLD):
+    """``{(year, month): RankedRows}`` of the alerts of the months ``keys`` (all by default).
+
+    ``rows`` are dealer rows with ``ROW_COLUMNS``; scoring a month against
+    the dealers' history needs the ``HISTORY_WINDOW`` months before it.
+    """
+    rows = rows.loc[~rows['mobis_code'].isin(freeze_rs).to_numpy() & rows['dealer_code'].notna().to_numpy(),
+                    ROW_COLUMNS]
+    period = rows['year'].to_numpy(dtype='int64') * 12 + pd.Categorical(rows['month'], categories=MONTHS).codes
+    if keys is not None:
+        # Only the months scored and the history window before them.
+        keys = [(int(year), str(month)) for year, month in keys]
+        scored = [year * 12 + MONTHS.index(month) for year, month in keys]
+        window = (period >= min(scored, default=0) - HISTORY_WINDOW) & (period <= max(scored, default=-1))
+        rows, period = rows[window], period[window]
+    if not len(rows):
+        return {key: empty_alerts() for key in keys or ()}
+    dealers = pd.Categorical(rows['dealer_code'].astype(str))
+    first = int(period.min())
+    rows = rows.assign(_dealer=dealers.codes, _period=period - first)
+    shape = len(dealers.categories), int(period.max()) - first + 1
+    values = _cube(rows, KPIS, *shape)
+    benchmarks = _cube(rows, [kpi + '_reg' for kpi in KPIS], *shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Costs and rates are skewed to the right; their logs are closer to symmetric.
+        ratios = np.log(np.where(benchmarks > 0, values / benchmarks, np.nan))
+        logs = np.log(values)
+    ratios[~np.isfinite(ratios)] = np.nan
+    logs[~np.isfinite(logs)] = np.nan
+    # Each dealer's ratio against those of every dealer in the same month.
+    reg_z, _ = _robust_z(ratios, ratios, axis=0)
+
+    if keys is None:
+        keys = rows[['year', 'month']].drop_duplicates().itertuples(index=False, name=None)
+    identity = {column: rows[column].to_numpy() for column in NAME_COLUMNS}
+    row_dealers, row_periods = rows['_dealer'].to_numpy(), rows['_period'].to_numpy()
+    alerts = {}
+    for year, month in keys:
+        offset = int(year) * 12 + MONTHS.index(str(month)) - first
+        if not 0 <= offset < shape[1]:
+            alerts[(int(year), str(month))] = empty_alerts()
+            continue
+        past = logs[:, max(offset - HISTORY_WINDOW, 0):offset]
+        history_z, history_median = _robust_z(logs[:, offset:offset + 1], past, axis=1)
+        enough = (np.sum(~np.isnan(past), axis=1) >= MIN_HISTORY)
+        month_rows = np.flatnonzero(row_periods == offset)
+        alerts[(int(year), str(month))] = _month_alerts(
+            {name: array[month_rows] for name, array in identity.items()}, row_dealers[month_rows],
+            values[:, offset], benchmarks[:, offset], reg_z[:, offset],
+            np.exp(history_median[:, 0]), np.where(enough, history_z[:, 0], np.nan), threshold)
+    return alerts
@@ -1,223 +1,549 @@
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px 
 import dash
 import dash_bootstrap_components as dbc
 import dash_ag_grid as dag
 
-from dash import html, dash_table
+from dash import Patch, ctx, html
 from dash import dcc
-from dash.dependencies import Output, Input 
+from dash.dependencies import ClientsideFunction, Output, Input, State, MATCH
 from dash.exceptions import PreventUpdate
-from unicodedata import lookup
-from dash.dash_table.Format import Format, Group
-
-master_file = '../data/dwcc_master_git_model.xlsx'
-
-jan_dcc = pd.read_excel(master_file, sheet_name='jan')
-feb_dcc = pd.read_excel(master_file, sheet_name='feb')
-mar_dcc = pd.read_excel(master_file, sheet_name='mar')
-apr_dcc = pd.read_excel(master_file, sheet_name='apr')
-sub_dcc = pd.read_excel(master_file, sheet_name='total')
-
-month_list = [jan_dcc, feb_dcc, mar_dcc, apr_dcc, sub_dcc]
-dash_tab = pd.concat(month_list).reset_index(drop=True)
-freeze = dash_tab.query('dealer_name.str.contains("Freeze")')
-freeze_rs = list(freeze['mobis_code'].unique())
-
-tab_top_dealers =\
-dash_tab.query('mobis_code != @freeze_rs').filter(items=['year', 'month', 'dealer_name', 'dealer_code', 'warranty',
-                                        'dm2pu_p', 'dcpu_p', 'cpc_p',
-                                        'rvs_p', 'campaign_p', 'courtesy_car_p', 'trp_2_p',
-                                        'sws_p', 'dowt_p', 'total_points'])
-
-pivot = tab_top_dealers.query('month == "January"').pivot_table(
-    index=['warranty'], values='total_points',
-    aggfunc='sum'
-).reset_index()
-
-tab_top_dealers_data =\
-dash_tab.query('mobis_code != @freeze_rs').filter(items=['year', 'month', 'dealer_name', 'dealer_code', 'warranty',
-    'uio', 'm2_cost', 'm2_qty', 'parts_cost', 'claim_qty', 'total_cost', 'novs', 'dm2pu', 'dcpu', 'cpc',
-    'rvs', 'campaign', 'courtesy_car', 'sws', 'sws_ratio', 'trp_2', 'dowt', 'total_points'])
+from flask import abort, jsonify, request, send_file
+from flask_compress import Compress
+from werkzeug.datastructures import MultiDict
+
+import figures
+from anomalies import empty_alerts
+from background import SharedJobManager
+from data_store import DataStore
+from export import FORMATS, Exporter, export_name
+from figure_cache import FigureCache
+from metrics import instrument, instrument_job, record_startup, register as register_metrics, stage
+from row_model import number_filters
+from schema import MONTHS, empty_frame
+from sources import open_source
+
+# Derived frames are column projections of dash_tab; with copy-on-write they
+# share its buffers instead of holding copies.
+pd.set_option('mode.copy_on_write', True)
+
+master_file = os.environ.get('DWES_MASTER_FILE', '../data/dwcc_master_git_model.xlsx')
+# A workbook, a directory of monthly Parquet files or sqlite:///path (see sources).
+data_source = open_source(os.environ.get('DWES_DATA_SOURCE', master_file))
 
 indicator_columns = ['m2_cost', 'parts_cost', 'total_cost', 'dm2pu', 'dcpu', 'cpc',
                      'rvs', 'campaign']
 indicator_columns_other = ['uio', 'm2_qty', 'claim_qty', 'novs', 'courtesy_car', 'sws', 'sws_ratio', 'trp_2']
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME, dbc.icons.BOOTSTRAP])
-server = app.server
-app.layout = html.Div([
-    dbc.Col([
-        html.Br(),
-        html.H1('DWES'),
-        html.H2('Dealer Warranty Evaluation System')
-    ]
-    ),
+# Seconds between checks of the workbook for new or edited month sheets.
+reload_interval = float(os.environ.get('DWES_RELOAD_INTERVAL', 30))
+
+# 'lazy' loads the data on first use (a page, a callback or /ready) in each
+# worker. 'preload' loads it while this module is imported: under gunicorn
+# --preload that happens once in the master and the forked workers share the
+# frames' pages copy-on-write.
+load_mode = os.environ.get('DWES_LOAD', 'lazy')
+
+data_store = DataStore(data_source,
+                       ['total_points', *indicator_columns, *[kpi + '_reg' for kpi in indicator_columns],
+                        *indicator_columns_other])
+# Entries are keyed on the version of the loaded data; with lazy loading the first key loads it.
+figure_cache = FigureCache.from_env(version=lambda: data_store.current.version)
+data_store.on_swap(lambda snapshot: record_startup('data_loaded'))
+if load_mode == 'preload':
+    data_store.load()
+data_store.watch(reload_interval)
+exporter = Exporter.from_env(data_store.cache_dir)
+
+
+def export_request(args):
+    """(format, filters) of the query ``args`` of an /export link."""
+    return args.get('format', 'xlsx'), {'year': args.get('year', type=int), 'month': args.get('month'),
+                                        'tab': args.get('tab'), 'dealer': args.getlist('dealer') or None,
+                                        'view': args.get('view')}
+
+
+def export_still_prepared(result):
+    """False for a stored result of prepare_export whose file was pruned since."""
+    href = result[0] if isinstance(result, (list, tuple)) and result else None
+    if not isinstance(href, str):
+        return True
+    fmt, filters = export_request(MultiDict(parse_qsl(urlsplit(href).query)))
+    return exporter.prepared(data_store.current, fmt=fmt, **filters) is not None
+
+
+# Background jobs are keyed on the data version too, so a reload never
+# serves a result computed from the previous workbook.
+job_manager = SharedJobManager.from_env(data_store.cache_dir, cache_by=[lambda: data_store.current.version],
+                                        reusable=export_still_prepared)
+
+
+def year_options(snapshot):
+    return [{'label': year, 'value': year} for year in snapshot.years()]
+
+
+def month_options(snapshot, year):
+    """Months of ``year`` that have data, in calendar order."""
+    months = {key_month for key_year, key_month in snapshot.month_aggregates if key_year == year}
+    return [{'label': month, 'value': month} for month in MONTHS if month in months]
+
+
+def dealer_options(snapshot):
+    return [{'label': dealer, 'value': dealer} for dealer in snapshot.dealers()]
+
+
+view_options = [{'label': ' Month ', 'value': 'month'}, {'label': ' Year to date ', 'value': 'ytd'},
+                {'label': ' Year over year ', 'value': 'yoy'}, {'label': ' Rolling 12 months ', 'value': 'rolling'}]
+
+
+def period_aggregates(snapshot, view):
+    """Aggregates behind the grids: year to date or the month itself."""
+    return snapshot.ytd_aggregates if view == 'ytd' else snapshot.month_aggregates
+
+
+def overview_frames(snapshot, year, month, view):
+    """(top dealers, support) frames of the overview charts, None if the period is unknown."""
+    if view in ('yoy', 'rolling'):
+        comparison = snapshot.comparisons.get((year, month))
+        if comparison is None:
+            return None
+        if view == 'yoy':
+            return comparison.top_yoy, comparison.support_yoy
+        return comparison.top_rolling, comparison.support_rolling
+    agg = period_aggregates(snapshot, view).get((year, month))
+    return None if agg is None else (agg.top_dealers, agg.support)
+
+
+def view_title(year, month, view):
+    return {'ytd': f'in {year} to {month}', 'yoy': f'in {month} {year} vs {year - 1}',
+            'rolling': f'over the 12 months to {month} {year}'}.get(view, f'in {month}')
+
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME, dbc.icons.BOOTSTRAP],
+                suppress_callback_exceptions=True, background_callback_manager=job_manager)
+# Export jobs run in processes of their own; their timings are spooled next to the jobs.
+server = register_metrics(app.server, spool_dir=os.path.join(job_manager.handle.directory, 'metrics'))
+# Responses from DWES_COMPRESS_MIN_SIZE bytes up go out Brotli or gzip encoded,
+# smaller ones are not worth the CPU. Registered after the metrics hook so it
+# runs first: the recorded payload sizes are the bytes on the wire.
+server.config.update(COMPRESS_ALGORITHM=['br', 'gzip'],
+                     COMPRESS_MIN_SIZE=int(os.environ.get('DWES_COMPRESS_MIN_SIZE', 1024)),
+                     COMPRESS_BR_LEVEL=int(os.environ.get('DWES_COMPRESS_BR_LEVEL', 4)),
+                     COMPRESS_LEVEL=int(os.environ.get('DWES_COMPRESS_GZIP_LEVEL', 6)))
+Compress(server)
+
+
+@server.route('/cache-stats')
+def cache_stats():
+    return jsonify(figure_cache.stats())
+
+
+@server.route('/ready')
+def ready():
+    """Readiness probe: 503 (and loading started) until the data is loaded.
+
+    Reads the load state only, so it answers at once while a load runs.
+    """
+    if not data_store.loaded:
+        data_store.load_in_background()
+        return jsonify(status='loading'), 503
+    return jsonify(status='ready', version=data_store.current.version, load_seconds=data_store.load_seconds)
+
+
+def answer_probe_first():
+    if request.path == '/ready':
+        return ready()
+
+
+# Dash's first-request setup builds the layout, which loads the data; the
+# probe is answered before it runs so that it never waits for the load.
+server.before_request_funcs.setdefault(None, []).insert(0, answer_probe_first)
+
+
+@server.before_request
+def start_watching():
+    # Polling starts with the first request this process serves, so a
+    # gunicorn --preload master, which serves none, never reloads.
+    data_store.serving()
+
+
+@server.route('/export')
+@instrument('export')
+def export_view():
+    fmt, filters = export_request(request.args)
+    if fmt not in FORMATS:
+        abort(400)
+    # Exports are written by the background job (prepare_export), never in
+    # the request: a file pruned since, or a link from an older data
+    # version, has to be exported again.
+    path = exporter.prepared(data_store.current, fmt=fmt, **filters)
+    if path is not None:
+        try:
+            return send_file(path, mimetype=FORMATS[fmt], as_attachment=True,
+                             download_name=export_name(fmt=fmt, **filters))
+        except FileNotFoundError:
+            pass  # pruned between the check and the open
+    abort(404, 'This export is not prepared (any more); export it again from the dashboard.')
+
+
+def serve_layout():
+    # Built per page load, so the options and defaults follow the loaded data.
+    snapshot = data_store.current
+    latest_year, latest_month = snapshot.latest()
+    return html.Div([
+        dbc.Col([
+            html.Br(),
+            html.H1('DWES'),
+            html.H2('Dealer Warranty Evaluation System')
+        ]
+        ),
+
+        dcc.Interval(id='data_poll', interval=max(reload_interval, 1) * 1000, disabled=reload_interval <= 0),
+        dcc.Store(id='data_version', data=snapshot.version),
     
     
     
-    html.Br(),
-    dbc.Row([
-        dbc.Col([
-            dbc.Label('Year of report:'),
-            dcc.Dropdown(id='year_dropdown', optionHeight=40,
-                         value=2024,
-                         options=[{'label': year, 'value': year}
-                                  for year in dash_tab['year'].unique()])
-            ], lg=6),
+        html.Br(),
+        dbc.Row([
+            dbc.Col([
+                dbc.Label('Year of report:'),
+                dcc.Dropdown(id='year_dropdown', optionHeight=40,
+                             value=latest_year,
+                             options=year_options(snapshot))
+                ], lg=6),
         
-        dbc.Col([
-            dbc.Label('Month of report:'),
-            dcc.Dropdown(id='month_dropdown',
-                         value='January',
-                         options=[{'label': month, 'value': str(month)}
-                                  for month in dash_tab['month'].unique()]),
-    ], lg=6)
-    ]
-    ),
+            dbc.Col([
+                dbc.Label('Month of report:'),
+                dcc.Dropdown(id='month_dropdown',
+                             value=latest_month,
+                             options=month_options(snapshot, latest_year)),
+        ], lg=6)
+        ]
+        ),
+
+        dcc.RadioItems(id='view_mode', inline=True, value='month', options=view_options),
         
-    html.Br(),
+        html.Br(),
 
     
-       html.Div(id='grid-callback-example'),
+           html.Div(id='grid-callback-example'),
 
   
 
        
         
-    dbc.Row([
-       dbc.Col([
-            dcc.Graph(id='dealer_chart')
-        ], lg=6),
+        dbc.Row([
+           dbc.Col([
+                dcc.Graph(id='dealer_chart')
+            ], lg=6),
        
-       dbc.Col([
-            dcc.Graph(id='support_chart')
-        ], lg=6),
+           dbc.Col([
+                dcc.Graph(id='support_chart')
+            ], lg=6),
        
-   ]),
-    
-    html.Button('To excel', id='btn_xlsx'),
-    dcc.Download(id='download-dataframe-xlsx'),
+       ]),
     
-    dbc.Tabs(
-    [
-        dbc.Tab(label='Penalty points by KPI', tab_id='tab_1',
-                className='custom-tabs', active_tab_class_name='custom-tab--selected'),
-        dbc.Tab(label='Warranty data', tab_id='tab_2',
-                className='custom-tabs', active_tab_class_name='custom-tab--selected'),
-        dbc.Tab(label='KPI description', tab_id='tab_3',
-                className='custom-tabs', active_tab_class_name='custom-tab--selected'),
-    ], id='tabs'),
+        html.Button('Export', id='btn_export'),
+        html.Button('Cancel', id='btn_cancel_export', style={'display': 'none'}),
+        dcc.RadioItems(id='export_format', inline=True, value='xlsx',
+                       options=[{'label': ' Excel ', 'value': 'xlsx'}, {'label': ' CSV ', 'value': 'csv'},
+                                {'label': ' Parquet ', 'value': 'parquet'}]),
+        dcc.Checklist(id='export_dealer_only', inline=True, value=[],
+                      options=[{'label': ' Selected dealers only', 'value': 'dealer'}]),
+        dbc.Progress(id='export_progress', value=0, style={'display': 'none'}),
+        html.A(id='export_link'),
     
-    html.Div(id='content'),
+        dbc.Tabs(
+        [
+            dbc.Tab(label='Penalty points by KPI', tab_id='tab_1',
+                    className='custom-tabs', active_tab_class_name='custom-tab--selected'),
+            dbc.Tab(label='Warranty data', tab_id='tab_2',
+                    className='custom-tabs', active_tab_class_name='custom-tab--selected'),
+            dbc.Tab(label='Alerts', tab_id='tab_4',
+                    className='custom-tabs', active_tab_class_name='custom-tab--selected'),
+            dbc.Tab(label='KPI description', tab_id='tab_3',
+                    className='custom-tabs', active_tab_class_name='custom-tab--selected'),
+        ], id='tabs'),
     
+        html.Div(id='content'),
     
     
     
     
-    html.Br(),
     
-    dbc.Row([
-        dbc.Col([
-            dbc.Label('Dealer code:'),
-            dcc.Dropdown(id='code_dropdown',
-                         value='DNW001',
-                         options=[{'label': dealer, 'value': dealer}
-                                  for dealer in dash_tab['dealer_code'].sort_values().unique()])
-            ], lg=4),
+        html.Br(),
     
-        dbc.Col([
-            dbc.Label('KPI indicator:'),
-            dcc.Dropdown(id='indicator_dropdown', optionHeight=40,
-                         value='total_cost',
-                         options=[{'label': indicator, 'value': indicator}
-                                  for indicator in indicator_columns])
-            ], lg=4),
+        dbc.Row([
+            dbc.Col([
+                dbc.Label('Dealer codes:'),
+                dcc.Dropdown(id='code_dropdown', multi=True,
+                             value=['DNW001'],
+                             options=dealer_options(snapshot))
+                ], lg=4),
+    
+            dbc.Col([
+                dbc.Label('KPI indicator:'),
+                dcc.Dropdown(id='indicator_dropdown', optionHeight=40,
+                             value='total_cost',
+                             options=[{'label': indicator, 'value': indicator}
+                                      for indicator in indicator_columns])
+                ], lg=4),
         
-        dbc.Col([
-            dbc.Label('Dealer indicator:'),
-            dcc.Dropdown(id='dealer_indicator_dropdown', optionHeight=40,
-                         value='uio',
-                         options=[{'label': indicator, 'value': indicator}
-                                  for indicator in indicator_columns_other])
-            ], lg=4)
-        ]),
+            dbc.Col([
+                dbc.Label('Dealer indicator:'),
+                dcc.Dropdown(id='dealer_indicator_dropdown', optionHeight=40,
+                             value='uio',
+                             options=[{'label': indicator, 'value': indicator}
+                                      for indicator in indicator_columns_other])
+                ], lg=4)
+            ]),
     
-    html.Br(),
-    dbc.Row([
-       dbc.Col([
-            dcc.Graph(id='dealer_chart_points')
-        ], lg=4),
+        html.Br(),
+        dbc.Row([
+           dbc.Col([
+                dcc.Graph(id='dealer_chart_points')
+            ], lg=4),
        
-       dbc.Col([
-            dcc.Graph(id='kpi_chart')
-        ], lg=4),
+           dbc.Col([
+                dcc.Graph(id='kpi_chart')
+            ], lg=4),
         
-        dbc.Col([
-            dcc.Graph(id='other_chart')
-        ], lg=4),
+            dbc.Col([
+                dcc.Graph(id='other_chart')
+            ], lg=4),
        
-   ]),
+       ]),
      
+    ])
+
+
+app.layout = serve_layout
+
+columnDefs_main = [
+    {'field': 'UIO', 'headerName': 'UIO', 
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'NOVS', 'headerName': 'NOVS',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'Total amount', 'headerName': 'TOTAL AMOUNT (RUB)',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
+    "cellStyle": {'textAlign': 'center'}},                                       
+    {'field': 'Claims qty', 'headerName': 'CLAIM QUANTITY',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'M2 amount', 'headerName': 'M2 AMOUNT (RUB)',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'M2 qty', 'headerName': 'M2 QUANTITY',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'Campaign', 'headerName': 'CAMPAIGN',
+        'valueFormatter': {'function': "d3.format('.0%')(params.value)"}, 'width': 200,
+    "cellStyle": {'textAlign': 'center'}}
+    ]
+
+columnDefs = [
+    {'field': 'dealer_name', 'headerName': 'Dealer name', 'width': 200},
+    {'field': 'dealer_code', 'headerName': 'Code', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'warranty', 'headerName': 'Support', 'width': 110,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'dm2pu_p', 'headerName': 'DM2PU', 'width': 100, "cellStyle": {'textAlign': 'center'},
+    'headerTooltip': 'Dealer M2 cost per unit'},
+    {'field': 'dcpu_p', 'headerName': 'DCPU', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'cpc_p', 'headerName': 'CPC', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'rvs_p', 'headerName': 'RVS', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'campaign_p', 'headerName': 'SC', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'courtesy_car_p', 'headerName': 'CC', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'trp_2_p', 'headerName': 'TRP 2', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'sws_p', 'headerName': 'SWS', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'dowt_p', 'headerName': 'DWC', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}},
+    {'field': 'total_points', 'headerName': 'Total points', 'width': 100,
+                "cellStyle": {'textAlign': 'center'}}
+    ]
+
+columnDefs_ = [
+    {'field': 'dealer_name', 'headerName': 'Dealer name', 'width': 200},
+    {'field': 'dealer_code', 'headerName': 'Code', 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'warranty', 'headerName': 'Support', 'width': 110,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'uio', 'headerName': 'UIO', 
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'm2_cost', 'headerName': 'M2 cost',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'm2_qty', 'headerName': 'M2 qty',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},                                       
+    {'field': 'parts_cost', 'headerName': 'Parts cost',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'claim_qty', 'headerName': 'Claim qty',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'total_cost', 'headerName': 'Total cost',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'novs', 'headerName': 'NOVS',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'dm2pu', 'headerName': 'DM2PU',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'dcpu', 'headerName': 'DCPU',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'cpc', 'headerName': 'CPC',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'rvs', 'headerName': 'RVS',
+        'valueFormatter': {'function': "d3.format(',.2f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'campaign', 'headerName': 'SC',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'courtesy_car', 'headerName': 'CC',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'sws', 'headerName': 'SWS qty',
+         'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'sws_ratio', 'headerName': 'SWS ratio',
+         'valueFormatter': {'function': "d3.format(',.0f')(params.value)"},'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'trp_2', 'headerName': 'TRP 2',
+        'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'dowt', 'headerName': 'DWC', 'width': 120,
+    "cellStyle": {'textAlign': 'center'}}
+    ]
+
+# KPI outliers of the month (see anomalies), strongest first.
+columnDefs_alerts = [
+    {'field': 'dealer_name', 'headerName': 'Dealer name', 'width': 200},
+    {'field': 'dealer_code', 'headerName': 'Code', 'width': 100,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'warranty', 'headerName': 'Support', 'width': 110,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'kpi', 'headerName': 'KPI', 'width': 110,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'value', 'headerName': 'Value',
+        'valueFormatter': {'function': "d3.format(',.2f')(params.value)"}, 'width': 120,
+    "cellStyle": {'textAlign': 'center'}},
+    {'field': 'benchmark', 'headerName': 'Region',
+        'valueFormatter': {'function': "d3.format(',.2f')(params.value)"}, 'width': 120,
+    "cellStyle": {'textAlign': 'center'},
+    'headerTooltip': 'Regional benchmark of the KPI'},
+    {'field': 'reg_z', 'headerName': 'Score vs region',
+        'valueFormatter': {'function': "d3.format('.1f')(params.value)"}, 'width': 120,
+    "cellStyle": {'textAlign': 'center'},
+    'headerTooltip': 'Robust z-score of the ratio to the benchmark among all dealers'},
+    {'field': 'history_median', 'headerName': 'Usual value',
+        'valueFormatter': {'function': "d3.format(',.2f')(params.value)"}, 'width': 120,
+    "cellStyle": {'textAlign': 'center'},
+    'headerTooltip': 'Median of the dealer over the previous 12 months'},
+    {'field': 'history_z', 'headerName': 'Score vs history',
+        'valueFormatter': {'function': "d3.format('.1f')(params.value)"}, 'width': 120,
+    "cellStyle": {'textAlign': 'center'},
+    'headerTooltip': 'Robust z-score against the previous 12 months of the dealer'},
+    {'field': 'score', 'headerName': 'Score',
+        'valueFormatter': {'function': "d3.format('.1f')(params.value)"}, 'width': 100,
+    "cellStyle": {'textAlign': 'center'}}
+    ]
+
+# The dealer grids page, sort and filter on the server (see dealer_rows), so
+# numeric columns need AgGrid's number filter instead of the text one.
+columnDefs = number_filters(columnDefs, empty_frame())
+columnDefs_ = number_filters(columnDefs_, empty_frame())
+columnDefs_alerts = number_filters(columnDefs_alerts, empty_alerts().frame)
+
+dealer_grid_options = {'animateRows': False, 'pagination': True,
+                       'paginationPageSize': 50, 'cacheBlockSize': 50, 'maxBlocksInCache': 10}
+
+kpi_description = html.Div([
+    dcc.Markdown("""
+## KPI description: 
+
+#### Numeric KPI's
+* **DM2PU** dealer cost M2 per unit: DM2PU = M2(sublet cost)/ dealer UIO
+* **DCPU** dealer parts cost per unit: DCPU = claimed parts/ dealer UIO
+* **CPC** cost pet unit: CPC = Total warranty cost / claims qty
+* **RVS** ratio of vehicle serviced: RVS = claims qty/ NOWS
+* **Courtesy car** dealer courtesy car utilization
+* **Service campaign** dealer recall and service campaign results
+* **SWS** - dealer smart warranty system usage
+* **TRP** - dealer technician sertification result
+
+#### Category KPI's
+* **DWC** - dealer warranty certification
+""")
 ])
 
-@app.callback(Output('grid-callback-example', 'children'),
-              Output('dealer_chart', 'figure'),
-              Output('support_chart', 'figure'),              
-#              Output('table_dealers_output', 'children'),
-#              Output('table_dealers_data_output', 'children'),
-              Output('content', 'children'),
+
+@app.callback(Output('year_dropdown', 'options'),
+              Output('code_dropdown', 'options'),
+              Output('data_version', 'data'),
+              Input('data_poll', 'n_intervals'),
+              State('data_version', 'data'))
+def refresh_options(n_intervals, version):
+    snapshot = data_store.current
+    if snapshot.version == version:
+        raise PreventUpdate
+    return year_options(snapshot), dealer_options(snapshot), snapshot.version
+
+
+@app.callback(Output('month_dropdown', 'options'),
+              Output('month_dropdown', 'value'),
               Input('year_dropdown', 'value'),
-              Input('month_dropdown', 'value'),
-              Input('tabs', 'active_tab')
-             )
+              Input('data_version', 'data'),
+              State('month_dropdown', 'value'),
+              prevent_initial_call=True)
+def month_choices(year, version, month):
+    # Only the months of the selected year can be picked; a month the year
+    # does not have moves to its latest one.
+    options = month_options(data_store.current, year)
+    months = [option['value'] for option in options]
+    return options, month if month in months else (months[-1] if months else None)
 
 
+def selected_dealers(value):
+    """Dealer codes picked in ``code_dropdown``: a list, or a single code."""
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
 
-def plot_dealers_by_points(year, month, active_tab):
-    sum_tab = dash_tab.query('year == @year and month == @month and mobis_code != @freeze_rs')
-    uio = sum_tab['uio'].sum()
-    novs = sum_tab['novs'].sum()
-    total = sum_tab['total_cost'].sum()
-    qty = sum_tab['claim_qty'].sum()
-    m2 = sum_tab['m2_cost'].sum()
-    m2_qty = sum_tab['m2_qty'].sum()
-    camp = sum_tab['campaign'].mean()/100
-    data = {'UIO': [uio], 'NOVS': [novs], 'Total amount': [total],
-            'Claims qty': [qty], 'M2 amount': [m2], 'M2 qty': [m2_qty], 'Campaign': [camp]}
-    df_tab = pd.DataFrame(data)
-    
-    
-    columnDefs_main = [
-        {'field': 'UIO', 'headerName': 'UIO', 
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'NOVS', 'headerName': 'NOVS',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'Total amount', 'headerName': 'TOTAL AMOUNT (RUB)',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
-        "cellStyle": {'textAlign': 'center'}},                                       
-        {'field': 'Claims qty', 'headerName': 'CLAIM QUANTITY',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'M2 amount', 'headerName': 'M2 AMOUNT (RUB)',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'M2 qty', 'headerName': 'M2 QUANTITY',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 200,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'Campaign', 'headerName': 'CAMPAIGN',
-            'valueFormatter': {'function': "d3.format('.0%')(params.value)"}, 'width': 200,
-        "cellStyle": {'textAlign': 'center'}}
-        ]
-    
 
-    
-    
+def highlight_colors(top_dealers, dealers):
+    dealers = set(selected_dealers(dealers))
+    return ['orange' if code in dealers else 'lightsteelblue' for code in top_dealers['dealer_code']]
+
+
+@app.callback(Output('grid-callback-example', 'children'),
+              Input('year_dropdown', 'value'),
+              Input('month_dropdown', 'value'),
+              Input('view_mode', 'value'))
+@instrument('summary_grid')
+def summary_grid(year, month, view):
+    with stage('aggregate'):
+        agg = period_aggregates(data_store.current, view).get((year, month))
+    if agg is None:
+        raise PreventUpdate
+
     table_main = dag.AgGrid(
-        rowData=df_tab.to_dict('records'),
+        rowData=[agg.summary],
         columnDefs=columnDefs_main,
         defaultColDef={
                        'headerClass': 'center-aligned-header',
@@ -233,205 +559,149 @@ def plot_dealers_by_points(year, month, active_tab):
         style={"height": 110, "width": 'auto'}
 
         )
+    return table_main
 
-    
-    
-    
-    
-    month_df =\
-    tab_top_dealers.query('year == @year and month == @month').sort_values(by='total_points', ascending=False)[:10]
-    fig1 = px.bar(                 
-    x=month_df['total_points'],
-    y=month_df['dealer_name'],
-    text=month_df['total_points'],
-    height=400,
-#    width=700,
-    title=f'Top 10 dealers by penalty points in {month}',
-    orientation='h',
-#    color=month_df['total_points'],
-    color_discrete_sequence=['lightsteelblue']
-    
-)
-    fig1.update_layout(yaxis={'categoryorder': 'total ascending'})
-    fig1.layout.xaxis.title = 'Total points'
-    fig1.layout.yaxis.title = None
-    fig1.update_coloraxes(showscale=False)
-    
-    
-    month_support =\
-    dash_tab.query('year == @year and month == @month and mobis_code != @freeze_rs').pivot_table(
-        index=['warranty'], values='total_points', aggfunc='mean').reset_index()
-    
-    fig2 = px.bar(                 
-    x=month_support['total_points'],
-    y=month_support['warranty'],
-    text=month_support['total_points'],
-    height=400,
-#    width=700,
-    text_auto='.1f',
-    title=f'Top penalty points by support in {month}',
-    orientation='h',
-    color=month_support['warranty'],
-    color_discrete_sequence=px.colors.qualitative.Pastel1
-    
-)
-    fig2.update_layout(yaxis={'categoryorder':'total ascending'}, showlegend=False)
-    fig2.layout.xaxis.title = 'Total points'
-    fig2.layout.yaxis.title = None
-    fig2.update_coloraxes(showscale=False)
-    
-    
-# table of points
-
-    table_month = tab_top_dealers.query('year == @year and month == @month').sort_values(by='total_points',
-                                                                      ascending=False)[:200]
-    table_month = table_month.drop(['year', 'month'], axis=1)
-    
-    
-    columnDefs = [
-        {'field': 'dealer_name', 'headerName': 'Dealer name', 'width': 200},
-        {'field': 'dealer_code', 'headerName': 'Code', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'warranty', 'headerName': 'Support', 'width': 110,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'dm2pu_p', 'headerName': 'DM2PU', 'width': 100, "cellStyle": {'textAlign': 'center'},
-        'headerTooltip': 'Dealer M2 cost per unit'},
-        {'field': 'dcpu_p', 'headerName': 'DCPU', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'cpc_p', 'headerName': 'CPC', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'rvs_p', 'headerName': 'RVS', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'campaign_p', 'headerName': 'SC', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'courtesy_car_p', 'headerName': 'CC', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'trp_2_p', 'headerName': 'TRP 2', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'sws_p', 'headerName': 'SWS', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'dowt_p', 'headerName': 'DWC', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}},
-        {'field': 'total_points', 'headerName': 'Total points', 'width': 100,
-                    "cellStyle": {'textAlign': 'center'}}
-        ]
-    table = dag.AgGrid(
-        rowData=table_month.to_dict('records'),
-        columnDefs=columnDefs,
-        defaultColDef={'filter': True,
-                       "headerClass": 'center-aligned-header',
-                       'wrapHeaderText': True,
-                       'autoHeaderHeight': True,
-                       'cellStyle': {'fontSize': '13px'}},
-        dashGridOptions={'animateRows': False, 'pagination':True},
-        className='ag-theme-alpine'
 
-        )
-
-# table of data
-
-    table_month_data = tab_top_dealers_data.query('year == @year and month == @month').sort_values(by='total_points',
-                                                                      ascending=False)[:200]
-    table_month_data = table_month_data.drop(['year', 'month', 'total_points'], axis=1)
-  
-    
-    
-    columnDefs_ = [
-        {'field': 'dealer_name', 'headerName': 'Dealer name', 'width': 200},
-        {'field': 'dealer_code', 'headerName': 'Code', 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'warranty', 'headerName': 'Support', 'width': 110,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'uio', 'headerName': 'UIO', 
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'm2_cost', 'headerName': 'M2 cost',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'm2_qty', 'headerName': 'M2 qty',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},                                       
-        {'field': 'parts_cost', 'headerName': 'Parts cost',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'claim_qty', 'headerName': 'Claim qty',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'total_cost', 'headerName': 'Total cost',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'novs', 'headerName': 'NOVS',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'dm2pu', 'headerName': 'DM2PU',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'dcpu', 'headerName': 'DCPU',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'cpc', 'headerName': 'CPC',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'rvs', 'headerName': 'RVS',
-            'valueFormatter': {'function': "d3.format(',.2f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'campaign', 'headerName': 'SC',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'courtesy_car', 'headerName': 'CC',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'sws', 'headerName': 'SWS qty',
-             'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'sws_ratio', 'headerName': 'SWS ratio',
-             'valueFormatter': {'function': "d3.format(',.0f')(params.value)"},'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'trp_2', 'headerName': 'TRP 2',
-            'valueFormatter': {'function': "d3.format(',.0f')(params.value)"}, 'width': 100,
-        "cellStyle": {'textAlign': 'center'}},
-        {'field': 'dowt', 'headerName': 'DWC', 'width': 120,
-        "cellStyle": {'textAlign': 'center'}}
-        ]
-    
+@app.callback(Output('dealer_chart', 'figure'),
+              Output('support_chart', 'figure'),
+              Input('year_dropdown', 'value'),
+              Input('month_dropdown', 'value'),
+              Input('view_mode', 'value'),
+              State('code_dropdown', 'value'))
+@instrument('overview_charts')
+@figure_cache.memoize('overview_charts')
+def overview_charts(year, month, view, dealers):
+    with stage('aggregate'):
+        frames = overview_frames(data_store.current, year, month, view)
+    if frames is None:
+        raise PreventUpdate
 
-        
-    table_data = dag.AgGrid(
-        rowData=table_month_data.to_dict('records'),
-        columnDefs=columnDefs_,
-        defaultColDef={'filter': True,
-                       "headerClass": 'center-aligned-header',
-                       'wrapHeaderText': True,
-                       'autoHeaderHeight': True,
-                       'cellStyle': {'fontSize': '13px'}},
-        dashGridOptions={'animateRows': False, 'pagination':True},
-        className='ag-theme-alpine')
+    with stage('figure'):
+        month_df, month_support = frames
+        title = view_title(year, month, view)
+        dealer_colors = highlight_colors(month_df, dealers)
+        if view == 'yoy':
+            # Current and previous year side by side; the current bars stay trace 0.
+            fig1 = figures.ranking(f'Top 10 dealers by penalty points {title}', month_df['dealer_name'],
+                                   [(str(year), month_df['total_points'], dealer_colors),
+                                    (str(year - 1), month_df['previous'], figures.PAIR_COLORS[1])],
+                                   category_order=month_df['dealer_name'][::-1])
+            fig2 = figures.ranking(f'Top penalty points by support {title}', month_support['warranty'],
+                                   [(str(year), month_support['total_points'], figures.PAIR_COLORS[0]),
+                                    (str(year - 1), month_support['previous'], figures.PAIR_COLORS[1])],
+                                   text_format='.1f')
+        else:
+            fig1 = figures.ranking(f'Top 10 dealers by penalty points {title}', month_df['dealer_name'],
+                                   [('', month_df['total_points'], dealer_colors)], text_format='')
+            support_colors = [figures.SUPPORT_COLORS[i % len(figures.SUPPORT_COLORS)]
+                              for i in range(len(month_support))]
+            fig2 = figures.ranking(f'Top penalty points by support {title}', month_support['warranty'],
+                                   [('', month_support['total_points'], support_colors)], text_format='.1f')
+
+    return fig1, fig2
+
+
+@app.callback(Output('dealer_chart', 'figure', allow_duplicate=True),
+              Input('code_dropdown', 'value'),
+              State('year_dropdown', 'value'),
+              State('month_dropdown', 'value'),
+              State('view_mode', 'value'),
+              prevent_initial_call=True)
+@instrument('highlight_dealer')
+def highlight_dealer(dealers, year, month, view):
+    # Only the bar colours change: send them instead of the whole figure.
+    frames = overview_frames(data_store.current, year, month, view)
+    if frames is None:
+        raise PreventUpdate
+    figure = Patch()
+    figure['data'][0]['marker']['color'] = highlight_colors(frames[0], dealers)
+    return figure
 
 
+@app.callback(Output('content', 'children'),
+              Input('year_dropdown', 'value'),
+              Input('month_dropdown', 'value'),
+              Input('tabs', 'active_tab'),
+              Input('view_mode', 'value'))
+@instrument('tab_content')
+def tab_content(year, month, active_tab, view):
+    if active_tab not in ('tab_1', 'tab_2', 'tab_4'):
+        return kpi_description
+    # The comparison views change the charts only; their grids list the month.
+    # Alerts are scored per month.
+    view = 'ytd' if view == 'ytd' and active_tab != 'tab_4' else 'month'
+    if (year, month) not in period_aggregates(data_store.current, view):
+        raise PreventUpdate
 
-    if active_tab == 'tab_1':
-        return table_main, fig1, fig2, table
-    elif active_tab == 'tab_2':
-        return table_main, fig1, fig2, table_data
-    elif active_tab == 'tab_3':
-        return table_main, fig1, fig2, html.Div([
-            dcc.Markdown("""
-## KPI description: 
+    if active_tab == 'tab_4':
+        content = dag.AgGrid(
+            id={'type': 'dealer_rows', 'tab': active_tab, 'year': year, 'month': month, 'view': view},
+            rowModelType='infinite',
+            columnDefs=columnDefs_alerts,
+            defaultColDef={'filter': True,
+                           "headerClass": 'center-aligned-header',
+                           'wrapHeaderText': True,
+                           'autoHeaderHeight': True,
+                           'cellStyle': {'fontSize': '13px'}},
+            dashGridOptions=dealer_grid_options,
+            className='ag-theme-alpine')
+    elif active_tab == 'tab_1':
+        content = dag.AgGrid(
+            id={'type': 'dealer_rows', 'tab': active_tab, 'year': year, 'month': month, 'view': view},
+            rowModelType='infinite',
+            columnDefs=columnDefs,
+            defaultColDef={'filter': True,
+                           "headerClass": 'center-aligned-header',
+                           'wrapHeaderText': True,
+                           'autoHeaderHeight': True,
+                           'cellStyle': {'fontSize': '13px'}},
+            dashGridOptions=dealer_grid_options,
+            className='ag-theme-alpine')
+    else:
+        content = dag.AgGrid(
+            id={'type': 'dealer_rows', 'tab': active_tab, 'year': year, 'month': month, 'view': view},
+            rowModelType='infinite',
+            columnDefs=columnDefs_,
+            defaultColDef={'filter': True,
+                           "headerClass": 'center-aligned-header',
+                           'wrapHeaderText': True,
+                           'autoHeaderHeight': True,
+                           'cellStyle': {'fontSize': '13px'}},
+            dashGridOptions=dealer_grid_options,
+            className='ag-theme-alpine')
+
+    # Pages arrive column-oriented in the store and are handed to the grid as rows in the browser.
+    page = dcc.Store(id={'type': 'dealer_page', 'tab': active_tab, 'year': year, 'month': month, 'view': view})
+    return html.Div([content, page])
+
+
+@app.callback(Output({'type': 'dealer_page', 'tab': MATCH, 'year': MATCH, 'month': MATCH, 'view': MATCH}, 'data'),
+              Input({'type': 'dealer_rows', 'tab': MATCH, 'year': MATCH, 'month': MATCH, 'view': MATCH},
+                    'getRowsRequest'))
+@instrument('dealer_rows')
+def dealer_rows(request):
+    # The grid id carries its period and view, so a new month mounts a fresh grid.
+    grid = ctx.triggered_id
+    if not request or grid is None:
+        raise PreventUpdate
+    snapshot, key = data_store.current, (grid['year'], grid['month'])
+    if grid['tab'] == 'tab_4':
+        # Scored when the data was loaded.
+        rows = snapshot.alerts.get(key)
+    else:
+        agg = period_aggregates(snapshot, grid['view']).get(key)
+        rows = None if agg is None else agg.points if grid['tab'] == 'tab_1' else agg.data
+    if rows is None:
+        raise PreventUpdate
+    with stage('filter'):
+        return rows.page(request)
 
-#### Numeric KPI's
-* **DM2PU** dealer cost M2 per unit: DM2PU = M2(sublet cost)/ dealer UIO
-* **DCPU** dealer parts cost per unit: DCPU = claimed parts/ dealer UIO
-* **CPC** cost pet unit: CPC = Total warranty cost / claims qty
-* **RVS** ratio of vehicle serviced: RVS = claims qty/ NOWS
-* **Courtesy car** dealer courtesy car utilization
-* **Service campaign** dealer recall and service campaign results
-* **SWS** - dealer smart warranty system usage
-* **TRP** - dealer technician sertification result
 
-#### Category KPI's
-* **DWC** - dealer warranty certification
-""")
-        ])
+app.clientside_callback(
+    ClientsideFunction(namespace='grid_pages', function_name='rows'),
+    Output({'type': 'dealer_rows', 'tab': MATCH, 'year': MATCH, 'month': MATCH, 'view': MATCH}, 'getRowsResponse'),
+    Input({'type': 'dealer_page', 'tab': MATCH, 'year': MATCH, 'month': MATCH, 'view': MATCH}, 'data'),
+    prevent_initial_call=True)
 
 
 @app.callback(Output('dealer_chart_points', 'figure'),
@@ -441,81 +711,65 @@ def plot_dealers_by_points(year, month, active_tab):
               Input('indicator_dropdown', 'value'),
               Input('dealer_indicator_dropdown', 'value')
              )
-def display_bar(dealer, indicator_kpi, indicator_other):
-    if (not dealer) or (not indicator_kpi) or (not indicator_other):
+@instrument('display_bar')
+@figure_cache.memoize('display_bar')
+def display_bar(dealers, indicator_kpi, indicator_other):
+    snapshot = data_store.current
+    dealers = [dealer for dealer in selected_dealers(dealers) if dealer in snapshot.dealer_index]
+    if (not dealers) or (not indicator_kpi) or (not indicator_other):
         raise PreventUpdate
-    df = dash_tab.query('dealer_code == @dealer and mobis_code != @freeze_rs')
-    fig1 = px.bar(df,
-                x='month',
-                y=df['total_points'],
-                title=str(dealer) + ' total points',
-                text_auto=',.0f',
-                height=350,
-                color_discrete_sequence=['orange']
-                 )
-    fig1.layout.xaxis.title = None
-    fig1.layout.yaxis.title = 'Total points'
-    
-    if indicator_kpi == 'rvs':
-        fig2 = px.bar(df,
-                x='month',
-                y=[indicator_kpi, indicator_kpi + '_reg'],
-                barmode='group',
-                title=str(dealer) + ' ' + indicator_kpi + ' trend',
-                text_auto=',.2f',
-                height=350,
-                color_discrete_sequence=['orange', 'lightsteelblue']
-                 )
-        fig2.layout.xaxis.title = None
-        fig2.layout.yaxis.title = indicator_kpi
-        fig2.update_layout(
-        legend=dict(
-            orientation='h',
-            yanchor='bottom',
-            y=1.02
-        ),
-        legend_title_text='KPI'
-        )
-    else:
-        fig2 = px.bar(df,
-                x='month',
-                y=[indicator_kpi, indicator_kpi + '_reg'],
-                barmode='group',
-                title=str(dealer) + ' ' + indicator_kpi + ' trend',
-                text_auto=',.0f',
-                height=350,
-                color_discrete_sequence=['orange', 'lightsteelblue']
-                 )
-        fig2.layout.xaxis.title = None
-        fig2.layout.yaxis.title = indicator_kpi
-        fig2.update_layout(
-        legend=dict(
-            orientation='h',
-            yanchor='bottom',
-            y=1.02
-        ),
-        legend_title_text='KPI'
-        )    
-    
-    fig3 = px.bar(df,
-                x='month',
-                y=indicator_other,
-                title=str(dealer) + ' ' + indicator_other + ' trend',
-                text_auto=',.0f',
-                height=350,
-                color_discrete_sequence=['lightsteelblue']
-                 )
-    fig3.layout.xaxis.title = None
-    fig3.layout.yaxis.title = indicator_other
-                  
-                
+    with stage('filter'):
+        # One lookup for all the dealers; the group averages were computed on load.
+        series = snapshot.dealer_index.series(dealers)
+        groups = series['warranty'].dropna().astype(str).unique().tolist()
+        averages = snapshot.group_averages.series(groups)
+    with stage('figure'):
+        name = dealers[0] if len(dealers) == 1 else f'{len(dealers)} dealers'
+        fig1 = figures.kpi_trend(series, averages, 'total_points', f'{name} total points', 'Total points')
+        fig2 = figures.kpi_trend(series, averages, indicator_kpi, f'{name} {indicator_kpi} trend', indicator_kpi,
+                                 benchmark=indicator_kpi + '_reg',
+                                 text_format=',.2f' if indicator_kpi == 'rvs' else ',.0f')
+        fig3 = figures.kpi_trend(series, averages, indicator_other, f'{name} {indicator_other} trend',
+                                 indicator_other)
+
     return fig1, fig2, fig3
 
-@app.callback(Output('download-dataframe-xlsx', 'data'),
-              Input('btn_xlsx', 'n_clicks'),
+@app.callback(Output('export_link', 'href'),
+              Output('export_link', 'children'),
+              Input('btn_export', 'n_clicks'),
+              State('year_dropdown', 'value'),
+              State('month_dropdown', 'value'),
+              State('tabs', 'active_tab'),
+              State('code_dropdown', 'value'),
+              State('export_dealer_only', 'value'),
+              State('export_format', 'value'),
+              State('view_mode', 'value'),
+              background=True,
+              # Identical exports share a job whoever clicked how often.
+              cache_args_to_ignore=[0],
+              running=[(Output('btn_export', 'disabled'), True, False),
+                       (Output('btn_cancel_export', 'style'), {'display': 'inline-block'}, {'display': 'none'}),
+                       (Output('export_progress', 'style'), {'display': 'flex'}, {'display': 'none'})],
+              cancel=[Input('btn_cancel_export', 'n_clicks')],
+              progress=[Output('export_progress', 'value'), Output('export_progress', 'label')],
               prevent_initial_call=True)
-def func(n_clicks):
-    return dcc.send_data_frame(dash_tab.to_excel, 'mydf.xlsx', sheet_name="Sheet_name_1")
+@instrument_job('prepare_export')
+def prepare_export(set_progress, n_clicks, year, month, active_tab, dealers, dealer_only, fmt, view):
+    def progress(done, total):
+        percent = round(100 * done / total) if total else 100
+        set_progress((percent, f'{percent}%'))
+
+    # The grids of the dealer tabs list the year to date in that view (see tab_content).
+    filters = {'year': year, 'month': month, 'tab': active_tab,
+               'dealer': (selected_dealers(dealers) or None) if dealer_only else None,
+               'view': 'ytd' if view == 'ytd' and active_tab in ('tab_1', 'tab_2') else None}
+    set_progress((0, ''))
+    exporter.export(data_store.current, fmt=fmt, progress=progress, **filters)
+    query = urlencode({key: value for key, value in {**filters, 'format': fmt}.items() if value is not None},
+                      doseq=True)
+    return f"{app.get_relative_path('/export')}?{query}", f'Download {export_name(fmt=fmt, **filters)}'
+
+record_startup('imported')
 
 if __name__ == '__main__':
     app.run_server(debug=False)
@@ -0,0 +1,21 @@
+// Dealer grid pages come column-oriented from the server (see row_model.RankedRows.page);
+// AgGrid wants one object per row.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    grid_pages: {
+        rows: function (page) {
+            if (!page) {
+                return window.dash_clientside.no_update;
+            }
+            const rowData = [];
+            const length = page.columns.length ? page.columns[0].length : 0;
+            for (let i = 0; i < length; i++) {
+                const row = {};
+                page.fields.forEach(function (field, j) {
+                    row[field] = page.columns[j][i];
+                });
+                rowData.push(row);
+            }
+            return {rowData: rowData, rowCount: page.rowCount};
+        }
+    }
+});
@@ -0,0 +1,75 @@
+"""Job manager for the background callbacks.
+
+Long jobs (exports of the full history, all-dealer views) run in processes
+forked from the worker by Dash's ``DiskcacheManager``; state lives in a
+diskcache directory on local disk, so no broker is needed and every gunicorn
+worker on the host sees every job.
+
+On top of Dash's manager, identical jobs (same callback, inputs and data
+version) share one process: a request for a job that is already running
+attaches to it instead of starting a second one, and a client cancelling
+only stops the process once no other client waits on it. Finished results
+are kept for ``expire`` seconds and answer repeated requests at once, unless
+``reusable(result)`` says otherwise (the file an export result links to may
+be pruned before then); the job then runs again.
+
+Configuration (environment):
+
+* ``DWES_JOBS_DIR`` - diskcache directory, ``<cache dir>/jobs`` by default
+* ``DWES_JOB_RESULT_TTL`` - seconds a finished result is kept, 600 by default
+"""
+import os
+
+import diskcache
+from dash import DiskcacheManager
+
+
+class SharedJobManager(DiskcacheManager):
+    def __init__(self, cache=None, cache_by=None, expire=None, reusable=None):
+        super().__init__(cache, cache_by=cache_by, expire=expire)
+        self.reusable = reusable
+
+    @classmethod
+    def from_env(cls, cache_dir, cache_by=None, reusable=None):
+        directory = os.environ.get('DWES_JOBS_DIR') or os.path.join(cache_dir, 'jobs')
+        return cls(diskcache.Cache(directory), cache_by=cache_by,
+                   expire=float(os.environ.get('DWES_JOB_RESULT_TTL', 600)), reusable=reusable)
+
+    def result_ready(self, key):
+        result = self.handle.get(key)
+        if result is None:
+            return False
+        if self.reusable is None or self.reusable(result):
+            return True
+        self.clear_cache_entry(key)
+        return False
+
+    def call_job_fn(self, key, job_fn, args, context):
+        if self.result_ready(key):
+            # Finished before: the first poll reads the stored result, no process needed.
+            return 0
+        with diskcache.Lock(self.handle, f'{key}-lock', expire=60):
+            job = self.handle.get(f'{key}-job')
+            if job is not None and self.job_running(job):
+                self.handle.incr(f'{key}-watchers', default=1)
+                return job
+            job = super().call_job_fn(key, job_fn, args, context)
+            self.handle.set(f'{key}-job', job, expire=self.expire)
+            self.handle.set(f'{key}-watchers', 1, expire=self.expire)
+            self.handle.set(f'job-{job}', key, expire=self.expire)
+            return job
+
+    def job_running(self, job):
+        # Job 0 stands for a stored result; the renderer then polls without a job id.
+        return bool(job) and super().job_running(job)
+
+    def terminate_job(self, job):
+        if not job:
+            return
+        key = self.handle.get(f'job-{job}')
+        if key is not None:
+            with diskcache.Lock(self.handle, f'{key}-lock', expire=60):
+                if self.handle.decr(f'{key}-watchers', default=1) > 0:
+                    # Another client still waits on this process.
+                    return
+        super().terminate_job(job)
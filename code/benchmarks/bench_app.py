@@ -0,0 +1,287 @@
+"""Baseline cost of dashboard interactions on a synthetic master workbook.
+
+    python benchmarks/bench_app.py --dealers 2000 --years 3 --clients 8 --output baseline.json
+
+Generates (once) a workbook shaped like ``dwcc_master_git_model.xlsx``,
+measures ``import app_test`` and the first page load in a fresh interpreter
+(lazy loading with a cold and a warm sheet cache, then ``DWES_LOAD=preload``),
+times the overview callbacks (the tab content per tab, Alerts included),
+the grid pages (dealer and alert rows, within the rows a month has) and
+``display_bar`` (one dealer, and ``COMPARED_DEALERS`` compared) in process,
+then serves the Flask ``server`` on a local port and drives it through
+``/_dash-update-component`` with concurrent clients.
+An interaction (a new month, a tab switch, a dealer pick, a comparison of
+``COMPARED_DEALERS`` dealers) posts every
+callback it fires; its latency and bytes are the totals of those requests,
+sent with ``Accept-Encoding: br, gzip`` like a browser, so bytes are those on
+the wire.
+Latencies are reported as p50/p95, responses by their size in bytes, memory
+as RSS.
+
+The figure cache is off unless ``--figure-cache`` is given, so the numbers
+are those of the callbacks and not of cache lookups. ``--sqlite`` imports the
+workbook into a SQLite database next to it and serves from there.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
+
+from benchmarks.synthetic import write_workbook  # noqa: E402
+
+COMPARED_DEALERS = 20
+
+_STARTUP_PROBE = '''
+import json, time
+started = time.perf_counter()
+import app_test
+imported = time.perf_counter() - started
+response = app_test.server.test_client().get('/_dash-layout')
+assert response.status_code == 200, response.status
+first_response = time.perf_counter() - started
+from benchmarks.bench_app import rss_mb
+print(json.dumps({'import_seconds': imported, 'first_response_seconds': first_response, 'rss_mb': rss_mb()}))
+'''
+
+
+def rss_mb():
+    """Current resident set size of this process in MB."""
+    with open('/proc/self/status') as fh:
+        for line in fh:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def at(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {'n': len(ordered), 'p50_ms': at(0.5) * 1000, 'p95_ms': at(0.95) * 1000,
+            'max_ms': ordered[-1] * 1000, 'mean_ms': sum(ordered) / len(ordered) * 1000}
+
+
+def measure_startup(env, cold):
+    if cold:
+        shutil.rmtree(os.path.join(os.path.dirname(env['DWES_MASTER_FILE']), 'cache'), ignore_errors=True)
+    out = subprocess.run([sys.executable, '-c', _STARTUP_PROBE], cwd=CODE_DIR, env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def time_calls(func, argument_sets):
+    from plotly.io.json import to_json_plotly
+    from dash.exceptions import PreventUpdate
+
+    timings, sizes = [], []
+    for args in argument_sets:
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except PreventUpdate:
+            continue
+        timings.append(time.perf_counter() - started)
+        sizes.append(len(to_json_plotly(result)))
+    return dict(percentiles(timings), mean_bytes=sum(sizes) / max(len(sizes), 1))
+
+
+def update_payload(app, callback, values, state=()):
+    """Body of a ``/_dash-update-component`` request for the callback named ``callback``."""
+    for key, entry in app.callback_map.items():
+        if getattr(entry.get('callback'), '__name__', None) == callback:
+            break
+    else:
+        raise KeyError(callback)
+    outputs = entry['output'] if isinstance(entry['output'], list) else [entry['output']]
+    specs = [{'id': output.component_id, 'property': output.component_property} for output in outputs]
+    inputs = [dict(spec, value=value) for spec, value in zip(entry['inputs'], values)]
+    return {'output': key, 'outputs': specs if isinstance(entry['output'], list) else specs[0],
+            'inputs': inputs, 'state': [dict(spec, value=value) for spec, value in zip(entry['state'], state)],
+            'changedPropIds': [f"{spec['id']}.{spec['property']}" for spec in inputs]}
+
+
+def serve(server):
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    httpd = make_server('127.0.0.1', 0, server, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f'http://127.0.0.1:{httpd.server_port}'
+
+
+def post(url, body):
+    data = json.dumps(body).encode()
+    request = urllib.request.Request(url + '/_dash-update-component', data=data,
+                                     headers={'Content-Type': 'application/json', 'Accept-Encoding': 'br, gzip'})
+    with urllib.request.urlopen(request) as response:
+        return len(response.read())
+
+
+def interact(url, bodies):
+    started = time.perf_counter()
+    size = sum(post(url, body) for body in bodies)
+    return time.perf_counter() - started, size
+
+
+def load_test(url, interactions, clients):
+    # A few sequential interactions first to warm up the connection handling.
+    for bodies in interactions[:10]:
+        interact(url, bodies)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(lambda bodies: interact(url, bodies), interactions))
+    wall = time.perf_counter() - started
+    timings, sizes = zip(*results)
+    return dict(percentiles(timings), clients=clients, interactions_per_s=len(interactions) / wall,
+                requests=sum(len(bodies) for bodies in interactions), mean_bytes=sum(sizes) / len(sizes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dealers', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--workbook', help='synthetic workbook path (generated if missing)')
+    parser.add_argument('--calls', type=int, default=50, help='direct calls per callback and tab')
+    parser.add_argument('--requests', type=int, default=200, help='interactions per HTTP scenario')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--url', help='drive an already running server instead of a local one')
+    parser.add_argument('--figure-cache', action='store_true', help='keep the figure cache enabled')
+    parser.add_argument('--sqlite', action='store_true', help='query a SQLite copy of the workbook')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    workbook = os.path.abspath(args.workbook or os.path.join(
+        CODE_DIR, 'benchmarks', 'data', f'model_{args.dealers}x{args.years}.xlsx'))
+    started = time.perf_counter()
+    write_workbook(workbook, args.dealers, args.years)
+    print(f'workbook {workbook} ready in {time.perf_counter() - started:.1f} s', flush=True)
+
+    env = dict(os.environ, DWES_MASTER_FILE=workbook, DWES_RELOAD_INTERVAL='0')
+    if args.sqlite:
+        from sources import import_source, open_source
+
+        database = os.path.splitext(workbook)[0] + '.db'
+        if not os.path.exists(database):
+            import_source(open_source(workbook), database)
+        env['DWES_DATA_SOURCE'] = 'sqlite:///' + database
+    if not args.figure_cache:
+        env['DWES_FIGURE_CACHE_SIZE'] = '0'
+    results = {'dealers': args.dealers, 'years': args.years, 'source': env.get('DWES_DATA_SOURCE', workbook),
+               'startup_cold': measure_startup(env, cold=True),
+               'startup_warm': measure_startup(env, cold=False),
+               'startup_preload': measure_startup(dict(env, DWES_LOAD='preload'), cold=False)}
+    for name in ('startup_cold', 'startup_warm', 'startup_preload'):
+        stats = results[name]
+        print(f'{name:36s} import {stats["import_seconds"]:6.2f} s  first response '
+              f'{stats["first_response_seconds"]:6.2f} s  {stats["rss_mb"]:.0f} MB', flush=True)
+
+    os.environ.update(env)
+    os.chdir(CODE_DIR)
+    import app_test
+
+    snapshot = app_test.data_store.current
+    rng = random.Random(0)
+    periods = list(snapshot.month_aggregates)
+    dealers = snapshot.dealers()
+    kpis, others = app_test.indicator_columns, app_test.indicator_columns_other
+
+    def dealer_args(count=1):
+        return rng.sample(dealers, count), rng.choice(kpis), rng.choice(others)
+
+    callbacks = {
+        'summary_grid': time_calls(app_test.summary_grid, [(*rng.choice(periods), 'month')
+                                                           for _ in range(args.calls)]),
+    }
+    for view in ('month', 'ytd', 'yoy', 'rolling'):
+        callbacks[f'overview_charts[{view}]'] = time_calls(
+            app_test.overview_charts, [(*rng.choice(periods), view, rng.choice(dealers)) for _ in range(args.calls)])
+    for tab in ('tab_1', 'tab_2', 'tab_4', 'tab_3'):
+        callbacks[f'tab_content[{tab}]'] = time_calls(
+            app_test.tab_content, [(*rng.choice(periods), tab, 'month') for _ in range(args.calls)])
+    callbacks['highlight_dealer'] = time_calls(
+        app_test.highlight_dealer, [(rng.choice(dealers), *rng.choice(periods), 'month')
+                                    for _ in range(args.calls)])
+    callbacks['display_bar'] = time_calls(app_test.display_bar, [dealer_args() for _ in range(args.calls)])
+    callbacks[f'display_bar[{COMPARED_DEALERS} dealers]'] = time_calls(
+        app_test.display_bar, [dealer_args(COMPARED_DEALERS) for _ in range(args.calls)])
+    # dealer_rows reads its grid from the callback context; time the page it
+    # answers with, starting within the rows the month has.
+    def page_args(rows_of):
+        period = rng.choice(periods)
+        return rows_of(period), rng.randrange(0, max(len(rows_of(period)), 1), 100)
+
+    def page(rows, start):
+        return rows.page({'startRow': start, 'endRow': start + 100})
+
+    callbacks['dealer_rows[page]'] = time_calls(
+        page, [page_args(lambda period: snapshot.month_aggregates[period].points) for _ in range(args.calls)])
+    callbacks['dealer_rows[alerts page]'] = time_calls(
+        page, [page_args(lambda period: snapshot.alerts[period]) for _ in range(args.calls)])
+    results['callbacks'] = callbacks
+    results['rss_mb'] = rss_mb()
+    for name, stats in callbacks.items():
+        print(f'{name:36s} p50 {stats["p50_ms"]:8.1f} ms  p95 {stats["p95_ms"]:8.1f} ms  '
+              f'{stats["mean_bytes"] / 1e3:8.1f} kB', flush=True)
+
+    httpd = None
+    url = args.url
+    if url is None:
+        httpd, url = serve(app_test.server)
+    app = app_test.app
+
+    def month_change():
+        period, dealer, tab = rng.choice(periods), rng.choice(dealers), rng.choice(['tab_1', 'tab_2'])
+        return [update_payload(app, 'summary_grid', (*period, 'month')),
+                update_payload(app, 'overview_charts', (*period, 'month'), [dealer]),
+                update_payload(app, 'tab_content', (*period, tab, 'month'))]
+
+    def tab_switch():
+        return [update_payload(app, 'tab_content',
+                               (*rng.choice(periods), rng.choice(['tab_1', 'tab_2', 'tab_4', 'tab_3']), 'month'))]
+
+    def dealer_pick():
+        picked, kpi, other = dealer_args()
+        return [update_payload(app, 'display_bar', (picked, kpi, other)),
+                update_payload(app, 'highlight_dealer', [picked], (*rng.choice(periods), 'month'))]
+
+    def dealer_compare():
+        picked, kpi, other = dealer_args(COMPARED_DEALERS)
+        return [update_payload(app, 'display_bar', (picked, kpi, other)),
+                update_payload(app, 'highlight_dealer', [picked], (*rng.choice(periods), 'month'))]
+
+    scenarios = {name: [make() for _ in range(args.requests)]
+                 for name, make in (('month', month_change), ('tab', tab_switch), ('dealer', dealer_pick),
+                                    ('compare', dealer_compare))}
+    results['http'] = {}
+    for name, bodies in scenarios.items():
+        stats = load_test(url, bodies, args.clients)
+        results['http'][name] = stats
+        print(f'http {name:31s} p50 {stats["p50_ms"]:8.1f} ms  p95 {stats["p95_ms"]:8.1f} ms  '
+              f'{stats["mean_bytes"] / 1e3:8.1f} kB  {stats["interactions_per_s"]:.1f} interactions/s '
+              f'({args.clients} clients)', flush=True)
+    if httpd is not None:
+        httpd.shutdown()
+    results['rss_mb_after_load'] = rss_mb()
+    print(f'rss {results["rss_mb"]:.0f} MB after callbacks, {results["rss_mb_after_load"]:.0f} MB after load test')
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Time ``kpi_engine.compute_kpis`` on a synthetic batch.
+
+    python benchmarks/bench_kpi_engine.py --dealers 10000 --months 36
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import raw_inputs  # noqa: E402
+from kpi_engine import compute_kpis  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dealers', type=int, default=10_000)
+    parser.add_argument('--months', type=int, default=36)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pd.set_option('mode.copy_on_write', True)
+    frame = raw_inputs(args.dealers, args.months)
+    compute_kpis(frame.head(1000))
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        compute_kpis(frame)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(f'{len(frame)} rows ({args.dealers} dealers x {args.months} months): '
+          f'best {best * 1000:.1f} ms, median {sorted(timings)[len(timings) // 2] * 1000:.1f} ms, '
+          f'{len(frame) / best / 1e6:.2f} M rows/s')
+
+
+if __name__ == '__main__':
+    main()
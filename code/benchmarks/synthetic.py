@@ -0,0 +1,96 @@
+"""Synthetic dealer model rows shaped like the master workbook sheets."""
+import os
+
+import numpy as np
+import pandas as pd
+
+from kpi_engine import compute_kpis
+from schema import MONTHS
+
+REGIONS = ['north_west', 'spb', 'south', 'center', 'moscow', 'volga', 'ural', 'siberia', 'far_east']
+WARRANTY_GROUPS = ['RP', 'DVS', 'KAG', 'AVF']
+MANAGERS = ['VVT', 'SMC', 'AKP', 'NRV']
+
+# Column order of the sheets of dwcc_master_git_model.xlsx.
+WORKBOOK_COLUMNS = [
+    'year', 'month', 'dealer_name', 'mobis_code', 'dealer_code', 'city', 'region', 'holding', 'manager',
+    'warranty', 'uio', 'm2_cost', 'm2_qty', 'parts_cost', 'claim_qty', 'total_cost', 'novs', 'dm2pu', 'dcpu',
+    'cpc', 'rvs', 'm2_cost_reg', 'parts_cost_reg', 'total_cost_reg', 'dm2pu_reg', 'dcpu_reg', 'cpc_reg',
+    'rvs_reg', 'campaign', 'campaign_reg', 'courtesy_car', 'sws', 'sws_ratio', 'trp_2', 'dowt', 'dm2pu_p',
+    'dcpu_p', 'cpc_p', 'rvs_p', 'campaign_p', 'courtesy_car_p', 'trp_2_p', 'sws_p', 'dowt_p', 'total_points']
+
+# The total sheet sums the flows over the year and keeps the latest state.
+_YEAR_SUMS = ['m2_cost', 'm2_qty', 'parts_cost', 'claim_qty', 'total_cost', 'novs', 'sws']
+_YEAR_LAST = ['uio', 'campaign', 'courtesy_car', 'trp_2', 'dowt']
+
+
+def raw_inputs(dealers=10_000, months=36, start_year=2022, seed=0):
+    """Raw per-dealer inputs (no KPI columns), ``dealers`` rows per month."""
+    rng = np.random.default_rng(seed)
+    codes = np.array([f'D{number:05d}' for number in range(dealers)])
+    region = rng.choice(REGIONS, dealers)
+    warranty = rng.choice(WARRANTY_GROUPS, dealers)
+    uio = rng.integers(0, 20_000, dealers)
+    rows = dealers * months
+
+    period = np.repeat(np.arange(months), dealers)
+    claim_qty = rng.integers(1, 130, rows).astype('float64')
+    frame = pd.DataFrame({
+        'year': start_year + period // 12,
+        'month': np.array(MONTHS)[period % 12],
+        'dealer_name': np.char.add('Dealer_', np.tile(codes, months)),
+        'mobis_code': np.char.add('RS', np.tile(codes, months)),
+        'dealer_code': np.tile(codes, months),
+        'region': np.tile(region, months),
+        'warranty': np.tile(warranty, months),
+        'uio': np.tile(uio, months),
+        'm2_cost': rng.lognormal(11, 1, rows).round(2),
+        'm2_qty': rng.integers(1, 20, rows).astype('float64'),
+        'parts_cost': rng.lognormal(12, 0.8, rows).round(2),
+        'claim_qty': claim_qty,
+        'total_cost': rng.lognormal(13, 0.8, rows).round(2),
+        'novs': np.maximum(1, claim_qty - rng.integers(0, 8, rows)),
+        'campaign': rng.uniform(0, 100, rows),
+        'courtesy_car': np.where(rng.random(rows) < 0.7, 0.0, rng.uniform(0, 100, rows)),
+        'sws': np.where(rng.random(rows) < 0.3, np.nan, rng.integers(2, 48, rows)),
+        'trp_2': rng.choice([0.0, 50.0, 75.0, 100.0], rows),
+        'dowt': rng.choice(['Certified', 'Not Certified'], rows, p=[0.8, 0.2]),
+    })
+    return frame
+
+
+def model_sheets(dealers=2000, years=3, start_year=2022, seed=0):
+    """Sheets of a master workbook: one per month and a total sheet per year."""
+    frame = compute_kpis(raw_inputs(dealers, years * 12, start_year, seed))
+    frame = frame.assign(city='City_' + frame['dealer_code'], holding='No holding',
+                         manager=np.array(MANAGERS)[frame['dealer_code'].str[1:].astype(int) % len(MANAGERS)])
+    sheets = {}
+    for (year, month), rows in frame.groupby(['year', 'month'], sort=False):
+        sheets[f'{month[:3].lower()}_{year}'] = rows[WORKBOOK_COLUMNS]
+    for year, rows in frame.groupby('year'):
+        keys = ['dealer_name', 'mobis_code', 'dealer_code', 'city', 'region', 'holding', 'manager', 'warranty']
+        grouped = rows.groupby(keys, sort=False)
+        total = grouped[_YEAR_SUMS].sum(min_count=1).join(grouped[_YEAR_LAST].last()).reset_index()
+        total = compute_kpis(total.assign(year=year, month='Accumulative'))
+        sheets[f'total_{year}'] = total[WORKBOOK_COLUMNS]
+    return sheets
+
+
+def write_workbook(path, dealers=2000, years=3, seed=0):
+    """Write a synthetic master workbook to ``path`` (reused if it exists)."""
+    if os.path.exists(path):
+        return path
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for name, sheet in model_sheets(dealers, years, seed=seed).items():
+        worksheet = workbook.create_sheet(title=name)
+        worksheet.append(WORKBOOK_COLUMNS)
+        values = sheet.astype(object).where(sheet.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            worksheet.append(row)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    workbook.save(tmp)
+    os.replace(tmp, path)
+    return path
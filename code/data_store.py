@@ -0,0 +1,414 @@
+"""Versioned, hot reloadable view of the dealer data.
+
+Everything the callbacks read is bundled in an immutable ``Snapshot``. A
+reload builds a new snapshot next to the current one and swaps the reference
+in a single assignment, so a callback that grabbed ``store.current`` keeps a
+consistent view until it returns.
+
+Rows are read through a source (see ``sources``). A file source is loaded
+into memory; a queryable one (SQLite) gets a ``query_snapshot.QuerySnapshot``
+that answers the same lookups with indexed queries.
+
+A background thread polls the source, started by the first request a process
+serves (a gunicorn --preload master serves none). When a month sheet is appended only
+that sheet is parsed and only its rows are appended to the derived frames;
+any other change (an edited sheet, a dealer newly marked as freeze, a month
+older than the loaded ones) rebuilds the snapshot, reading the unchanged
+sheets back from the source. Snapshots keep the names and fingerprints of
+the sheets, not the sheets.
+
+Only real months are stored: the 'total' sheets are skipped and the year to
+date, year-over-year and rolling views are derived (see ``history``). The
+KPI outliers of every month are flagged while loading too (see ``anomalies``).
+"""
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import psutil
+
+from aggregates import build_month_aggregates
+from anomalies import ALERT_COLUMNS, build_alerts
+from dealer_index import DealerIndex, GroupAverages
+from history import History, build_comparisons, build_year_to_date, is_total_sheet
+from kpi_engine import compute_kpis, needs_kpis
+from schema import MONTHS, apply_schema, concat, footprint, memory_usage
+
+logger = logging.getLogger(__name__)
+
+# Projections behind the dealer grids.
+POINTS_COLUMNS = ['year', 'month', 'dealer_name', 'dealer_code', 'warranty',
+                  'dm2pu_p', 'dcpu_p', 'cpc_p',
+                  'rvs_p', 'campaign_p', 'courtesy_car_p', 'trp_2_p',
+                  'sws_p', 'dowt_p', 'total_points']
+
+DATA_COLUMNS = ['year', 'month', 'dealer_name', 'dealer_code', 'warranty',
+                'uio', 'm2_cost', 'm2_qty', 'parts_cost', 'claim_qty', 'total_cost', 'novs', 'dm2pu', 'dcpu', 'cpc',
+                'rvs', 'campaign', 'courtesy_car', 'sws', 'sws_ratio', 'trp_2', 'dowt', 'total_points']
+
+
+class Snapshot(NamedTuple):
+    version: str
+    fingerprints: dict
+    month_names: list
+    dash_tab: pd.DataFrame
+    freeze_rs: list
+    tab_top_dealers: pd.DataFrame
+    tab_top_dealers_data: pd.DataFrame
+    month_aggregates: dict
+    dealer_index: DealerIndex
+    group_averages: GroupAverages
+    history: History
+    comparisons: dict
+    ytd_aggregates: dict
+    ytd_inputs: dict
+    alerts: dict
+
+    def years(self):
+        return sorted(self.dash_tab['year'].unique().tolist())
+
+    def months(self):
+        return [str(month) for month in self.dash_tab['month'].dropna().unique().sort_values()]
+
+    def dealers(self):
+        return sorted(self.dash_tab['dealer_code'].dropna().unique().tolist())
+
+    def latest(self):
+        """(year, month) of the most recent month loaded."""
+        return latest_period(self.month_aggregates)
+
+    def export_rows(self, tab=None, year=None, month=None, dealer=None, view=None, chunk_size=5000):
+        """``(columns, row count, chunks)`` of the rows behind ``tab`` matching the filters."""
+        if view == 'ytd' and tab in ('tab_1', 'tab_2'):
+            return year_to_date_export_rows(self, tab, year, month, dealer, chunk_size)
+        if tab == 'tab_4':
+            return alert_export_rows(self, year, month, dealer, chunk_size)
+        if tab == 'tab_1':
+            frame, columns = self.tab_top_dealers, POINTS_COLUMNS
+        elif tab == 'tab_2':
+            frame, columns = self.tab_top_dealers_data, DATA_COLUMNS
+        else:
+            frame, columns = self.dash_tab, list(self.dash_tab.columns)
+        mask = np.ones(len(frame), dtype=bool)
+        if year is not None:
+            mask &= (frame['year'] == year).to_numpy()
+        if month:
+            mask &= (frame['month'] == month).to_numpy()
+        if dealer:
+            mask &= frame['dealer_code'].isin([dealer] if isinstance(dealer, str) else dealer).to_numpy()
+        return _chunked(frame, columns, np.flatnonzero(mask), chunk_size)
+
+
+def _chunked(frame, columns, rows, chunk_size):
+    columns = [column for column in columns if column in frame.columns]
+    chunks = (frame.iloc[rows[start:start + chunk_size]][columns] for start in range(0, len(rows), chunk_size))
+    return columns, len(rows), chunks
+
+
+def _period_export_rows(frame, columns, year, month, dealer, chunk_size):
+    # Rows ranked for one period leave the period out; the file names it.
+    frame = frame.assign(year=year, month=month)
+    mask = np.ones(len(frame), dtype=bool)
+    if dealer:
+        mask &= frame['dealer_code'].isin([dealer] if isinstance(dealer, str) else dealer).to_numpy()
+    return _chunked(frame, columns, np.flatnonzero(mask), chunk_size)
+
+
+def year_to_date_export_rows(snapshot, tab, year, month, dealer=None, chunk_size=5000):
+    """``export_rows`` of the year-to-date grids: the rows of ``snapshot.ytd_aggregates``.
+
+    ``year`` and ``month`` of the rows are the year and the last month included.
+    """
+    columns = POINTS_COLUMNS if tab == 'tab_1' else DATA_COLUMNS
+    agg = snapshot.ytd_aggregates.get((year, month))
+    if agg is None:
+        return columns, 0, iter(())
+    return _period_export_rows((agg.points if tab == 'tab_1' else agg.data).frame, columns, year, month, dealer,
+                               chunk_size)
+
+
+def alert_export_rows(snapshot, year, month, dealer=None, chunk_size=5000):
+    """``export_rows`` of the Alerts tab: the alerts of the month, strongest first."""
+    columns = ['year', 'month', *ALERT_COLUMNS]
+    alerts = snapshot.alerts.get((year, month))
+    if alerts is None:
+        return columns, 0, iter(())
+    return _period_export_rows(alerts.frame, columns, year, month, dealer, chunk_size)
+
+
+def snapshot_memory(snapshot):
+    """``{field: bytes}`` of the buffers held by ``snapshot``; shared ones count for the first field."""
+    seen = {}
+    return {field: footprint(getattr(snapshot, field), seen) for field in snapshot._fields}
+
+
+def latest_period(periods):
+    """Most recent (year, month) of ``periods``, (None, None) if there is none."""
+    return max(periods, key=lambda key: (key[0], MONTHS.index(key[1])), default=(None, None))
+
+
+def freeze_codes(frame):
+    freeze = frame.loc[frame['dealer_name'].str.contains('Freeze', na=False), 'mobis_code']
+    return list(freeze.unique())
+
+
+def derive_frames(rows, freeze_rs):
+    frozen = rows['mobis_code'].isin(freeze_rs).to_numpy()
+    # With copy-on-write the column projections below share the buffers of
+    # ``rows``; only a real row filter has to copy.
+    active = rows[~frozen] if frozen.any() else rows
+    return active.filter(items=POINTS_COLUMNS), active.filter(items=DATA_COLUMNS)
+
+
+def _monthly(sheets):
+    return [sheet for sheet in sheets if not is_total_sheet(sheet)]
+
+
+def _month_names(sheets):
+    """Names of the month sheets of ``{name: sheet}``, in workbook order."""
+    return [name for name, sheet in sheets.items() if not is_total_sheet(sheet)]
+
+
+def build_snapshot(manifest, sheets, dealer_columns):
+    dash_tab = concat(_monthly(sheets.values()))
+    freeze_rs = freeze_codes(dash_tab)
+    tab_top_dealers, tab_top_dealers_data = derive_frames(dash_tab, freeze_rs)
+    month_aggregates = build_month_aggregates(dash_tab, freeze_rs, tab_top_dealers, tab_top_dealers_data)
+    history = History.build(tab_top_dealers)
+    ytd_inputs = {}
+    return Snapshot(version=manifest['sha256'], fingerprints=manifest['sheets'], month_names=_month_names(sheets),
+                    dash_tab=dash_tab, freeze_rs=freeze_rs,
+                    tab_top_dealers=tab_top_dealers, tab_top_dealers_data=tab_top_dealers_data,
+                    month_aggregates=month_aggregates,
+                    dealer_index=DealerIndex(dash_tab, freeze_rs, dealer_columns),
+                    group_averages=GroupAverages.build(dash_tab, freeze_rs, dealer_columns),
+                    history=history,
+                    comparisons=build_comparisons(month_aggregates, month_aggregates, history),
+                    ytd_aggregates=build_year_to_date(dash_tab, freeze_rs, derive_frames, ytd_inputs),
+                    ytd_inputs=ytd_inputs,
+                    alerts=build_alerts(dash_tab, freeze_rs))
+
+
+def append_sheets(previous, manifest, new_sheets, dealer_columns):
+    """``previous`` extended with the month sheets ``{name: sheet}`` of ``new_sheets``.
+
+    Returns None when the snapshot has to be built from all the sheets again.
+    """
+    dash_tab = concat([previous.dash_tab, *new_sheets.values()])
+    new_rows = dash_tab.iloc[len(previous.dash_tab):]
+    added = [code for code in freeze_codes(new_rows) if code not in previous.freeze_rs]
+    freeze_rs = previous.freeze_rs
+    new_points, new_data = derive_frames(new_rows, freeze_rs)
+    history = previous.history.extend(new_points)
+    if added or history is None:
+        # A newly frozen dealer disappears from every month, not just the new
+        # one; an older month changes the running totals of the later ones.
+        return None
+    tab_top_dealers = pd.concat([previous.tab_top_dealers, new_points])
+    tab_top_dealers_data = pd.concat([previous.tab_top_dealers_data, new_data])
+    new_aggregates = build_month_aggregates(new_rows, freeze_rs, new_points, new_data)
+    month_aggregates = {**previous.month_aggregates, **new_aggregates}
+    ytd_inputs = dict(previous.ytd_inputs)
+    return Snapshot(version=manifest['sha256'], fingerprints=manifest['sheets'],
+                    month_names=previous.month_names + list(new_sheets),
+                    dash_tab=dash_tab, freeze_rs=freeze_rs,
+                    tab_top_dealers=tab_top_dealers, tab_top_dealers_data=tab_top_dealers_data,
+                    month_aggregates=month_aggregates,
+                    dealer_index=DealerIndex(dash_tab, freeze_rs, dealer_columns),
+                    group_averages=GroupAverages.build(dash_tab, freeze_rs, dealer_columns),
+                    history=history,
+                    comparisons={**previous.comparisons,
+                                 **build_comparisons(new_aggregates, month_aggregates, history)},
+                    ytd_aggregates={**previous.ytd_aggregates,
+                                    **build_year_to_date(new_rows, freeze_rs, derive_frames, ytd_inputs)},
+                    ytd_inputs=ytd_inputs,
+                    # The new months are scored against the history of the loaded ones.
+                    alerts={**previous.alerts, **build_alerts(dash_tab, freeze_rs, new_aggregates)})
+
+
+class DataStore:
+    def __init__(self, source, dealer_columns):
+        self.source = source
+        self.cache_dir = source.cache_dir
+        self.dealer_columns = dealer_columns
+        self.load_seconds = None
+        self._current = None
+        # Held for a whole load or reload.
+        self._lock = threading.Lock()
+        # Loads running or waiting; the readiness probe reads it instead of waiting on the load.
+        self._loads = 0
+        # Guards ``_loads`` and starting the loader and watcher threads, never held for long.
+        self._threads_lock = threading.Lock()
+        self._listeners = []
+        self._interval = 0
+        self._watcher = None
+        self._watcher_pid = None
+        self._loader = None
+
+    @property
+    def current(self):
+        """The published snapshot; the first access loads the data."""
+        snapshot = self._current
+        return snapshot if snapshot is not None else self.load()
+
+    @property
+    def loaded(self):
+        return self._current is not None
+
+    @property
+    def loading(self):
+        return self._loads > 0
+
+    def on_swap(self, listener):
+        """Call ``listener(snapshot)`` whenever a new snapshot is published."""
+        self._listeners.append(listener)
+
+    def _publish(self, snapshot):
+        self._current = snapshot
+        for listener in self._listeners:
+            listener(snapshot)
+
+    def _query_snapshot(self, manifest):
+        # query_snapshot builds on the projections of this module.
+        from query_snapshot import QuerySnapshot
+
+        return QuerySnapshot(self.source, manifest, self.dealer_columns)
+
+    def _read(self, name):
+        raw = self.source.read(name)
+        if needs_kpis(raw):
+            # A sheet of raw inputs: derive the KPI, benchmark and point columns here.
+            raw = compute_kpis(raw)
+        return raw, apply_schema(raw)
+
+    def load(self):
+        """Load the data unless it is loaded already and return the snapshot."""
+        if self._current is not None:
+            return self._current
+        with self._threads_lock:
+            self._loads += 1
+        try:
+            return self._load()
+        finally:
+            with self._threads_lock:
+                self._loads -= 1
+
+    def _load(self):
+        with self._lock:
+            if self._current is not None:
+                # Loaded by another thread while this one waited.
+                return self._current
+            started = time.perf_counter()
+            manifest = self.source.manifest()
+            if self.source.queryable:
+                self._publish(self._query_snapshot(manifest))
+                self.load_seconds = time.perf_counter() - started
+                logger.info('querying %s, %d months', self.source, len(manifest['sheets']))
+                return self._current
+            rss, raw_size, sheets = psutil.Process().memory_info().rss, 0, {}
+            for name in manifest['sheets']:
+                raw, sheets[name] = self._read(name)
+                raw_size += memory_usage([raw])
+            snapshot = build_snapshot(manifest, sheets, self.dealer_columns)
+            memory = snapshot_memory(snapshot)
+            logger.info('the snapshot of %d rows holds %.2f MB (%s; %.2f MB as parsed from the workbook); '
+                        'the load added %.1f MB of resident memory to this process',
+                        len(snapshot.dash_tab), sum(memory.values()) / 1e6,
+                        ', '.join(f'{field} {size / 1e6:.2f}' for field, size in memory.items() if size),
+                        raw_size / 1e6, (psutil.Process().memory_info().rss - rss) / 1e6)
+            self._publish(snapshot)
+            self.load_seconds = time.perf_counter() - started
+        return self._current
+
+    def load_in_background(self):
+        """Start loading in a daemon thread, unless loaded or loading already.
+
+        Never waits for a load running in another thread.
+        """
+        with self._threads_lock:
+            if self._current is not None or self._loads or (self._loader is not None and self._loader.is_alive()):
+                return
+            self._loader = threading.Thread(target=self._load_logged, daemon=True, name='data-loader')
+            self._loader.start()
+
+    def _load_logged(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception('loading %s failed', self.source)
+
+    def refresh(self):
+        """Pick up changes of the source; return True if a new snapshot was published.
+
+        Nothing to do before the first load, which reads the source as it is then.
+        """
+        if self._current is None:
+            return False
+        with self._lock:
+            previous = self._current
+            manifest = self.source.manifest()
+            if manifest['sha256'] == previous.version:
+                return False
+            if self.source.queryable:
+                # Nothing is held but lookups: a new version starts them afresh.
+                self._publish(self._query_snapshot(manifest))
+                logger.info('published data version %s', manifest['sha256'][:12])
+                return True
+            changed = {name for name, fingerprint in manifest['sheets'].items()
+                       if previous.fingerprints.get(name) != fingerprint}
+            read = {name: self._read(name)[1] for name in manifest['sheets'] if name in changed}
+            # The 'total' sheets are not loaded: a month inserted before them, with
+            # the totals saved again, is still an append.
+            old_names = previous.month_names
+            names = [name for name in manifest['sheets']
+                     if (name in read and not is_total_sheet(read[name])) or (name not in read and name in old_names)]
+            snapshot = None
+            if names[:len(old_names)] == old_names and not changed.intersection(old_names):
+                snapshot = append_sheets(previous, manifest, {name: read[name] for name in names[len(old_names):]},
+                                         self.dealer_columns)
+            if snapshot is None:
+                # The unchanged sheets are read back from the source (the Feather cache for a workbook).
+                sheets = {name: read[name] if name in read else self._read(name)[1] for name in manifest['sheets']}
+                snapshot = build_snapshot(manifest, sheets, self.dealer_columns)
+            self._publish(snapshot)
+            logger.info('published data version %s (sheets changed: %s)',
+                        manifest['sha256'][:12], ', '.join(sorted(changed)) or 'none')
+            return True
+
+    def _watch(self, interval):
+        last = None
+        while True:
+            time.sleep(interval)
+            try:
+                stat = self.source.stat()
+                if stat != last:
+                    self.refresh()
+                    # Only now: a failed refresh (a half written workbook) is retried next time.
+                    last = stat
+            except Exception:
+                logger.exception('reloading %s failed', self.source)
+
+    def watch(self, interval):
+        """Poll the source every ``interval`` seconds once this process serves requests.
+
+        The polling thread is started by ``serving``. Under gunicorn --preload
+        the master imports the app but only the forked workers serve, and
+        threads do not survive a fork anyway.
+        """
+        self._interval = interval
+
+    def serving(self):
+        """Start the watcher of this process, unless it runs already."""
+        if self._interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._threads_lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(self._interval,), daemon=True,
+                                             name='source-watcher')
+            self._watcher.start()
+            self._watcher_pid = os.getpid()
@@ -0,0 +1,76 @@
+"""Dealer-indexed time series for the dealer charts.
+
+Rows of the active (non freeze) dealers are sorted once by dealer code so
+that every dealer owns a contiguous block of rows. A lookup is then a dict
+access plus a positional slice instead of a scan over the whole frame, and
+the rows of several dealers are one positional take of their blocks.
+
+``GroupAverages`` holds the monthly averages of the same columns per support
+group (``warranty``), computed once and kept in group blocks the same way,
+which the dealers are compared against.
+"""
+import numpy as np
+import pandas as pd
+
+
+def with_period_labels(frame):
+    """``frame`` with the bar labels of the dealer charts, which span years ('Jan 2024')."""
+    return frame.assign(period=frame['month'].astype(str).str[:3] + ' ' + frame['year'].astype(str))
+
+
+def take_blocks(frame, blocks):
+    """Rows of the ``blocks`` (slices) of ``frame``, in one positional take."""
+    if not blocks:
+        return frame.iloc[:0]
+    return frame.iloc[np.concatenate([np.arange(block.start, block.stop) for block in blocks])]
+
+
+class DealerIndex:
+    def __init__(self, dash_tab, freeze_rs, columns):
+        active = dash_tab.loc[~dash_tab['mobis_code'].isin(freeze_rs),
+                              ['dealer_code', 'warranty', 'year', 'month', *columns]]
+        codes = pd.Categorical(active['dealer_code']).remove_unused_categories()
+        known = codes.codes >= 0
+        active = active[known]
+        # Dealer blocks, each in calendar order (month is an ordered categorical).
+        order = np.lexsort((pd.Categorical(active['month']).codes, active['year'].to_numpy(), codes.codes[known]))
+        self.frame = with_period_labels(active.iloc[order].reset_index(drop=True))
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes.codes[known], minlength=len(codes.categories)))])
+        self._slices = {code: slice(start, stop)
+                        for code, start, stop in zip(codes.categories, bounds[:-1], bounds[1:])}
+
+    def __contains__(self, dealer):
+        return dealer in self._slices
+
+    def __getitem__(self, dealer):
+        """Rows of ``dealer`` in calendar order."""
+        return self.frame.iloc[self._slices[dealer]]
+
+    def series(self, dealers):
+        """Rows of the known ``dealers``, dealer by dealer in the order given, each in calendar order."""
+        return take_blocks(self.frame, [self._slices[dealer] for dealer in dealers if dealer in self._slices])
+
+    def dealers(self):
+        return list(self._slices)
+
+
+class GroupAverages:
+    """Averages of the dealer columns per support group and month, in calendar order."""
+
+    def __init__(self, frame):
+        # Sorted by group: each one owns a contiguous block of rows.
+        self.frame = frame
+        groups = frame['warranty'].astype(str).to_numpy()
+        starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]])) if len(groups) else []
+        bounds = [*starts, len(groups)]
+        self._slices = {groups[start]: slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])}
+
+    @classmethod
+    def build(cls, dash_tab, freeze_rs, columns):
+        active = dash_tab.loc[~dash_tab['mobis_code'].isin(freeze_rs), ['warranty', 'year', 'month', *columns]]
+        means = active.groupby(['warranty', 'year', 'month'], observed=True)[columns].mean().reset_index()
+        return cls(with_period_labels(means))
+
+    def series(self, groups):
+        """Monthly averages of ``groups``, group by group."""
+        return take_blocks(self.frame, [self._slices[group] for group in groups if group in self._slices])
@@ -0,0 +1,169 @@
+"""Streaming export of the filtered dashboard view.
+
+The rows matching the user's filters are written in fixed size chunks to a
+temporary file (write-only openpyxl workbook, CSV or Parquet) by a
+background job, and then served from disk; the download route only serves
+files that are written already. Finished files are kept by filter key and data version, so
+repeated downloads of the same view are a plain file transfer. A lock per
+file makes concurrent requests for the same view wait for one writer.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+from metrics import stage
+
+FORMATS = {'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+           'csv': 'text/csv',
+           'parquet': 'application/vnd.apache.parquet'}
+
+
+def _counted(chunks, total, progress=None):
+    done = 0
+    for chunk in chunks:
+        yield chunk
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    with open(f'{path}.lock', 'w') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _write_xlsx(chunks, columns, path, sheet_name):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name[:31])
+    sheet.append(columns)
+    for chunk in chunks:
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
+
+
+def _write_csv(chunks, columns, path, sheet_name):
+    with open(path, 'w', newline='') as fh:
+        fh.write(','.join(columns) + '\n')
+        for chunk in chunks:
+            chunk.to_csv(fh, header=False, index=False)
+
+
+def _write_parquet(chunks, columns, path, sheet_name):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({column: [] for column in columns}), path)
+
+
+_WRITERS = {'xlsx': _write_xlsx, 'csv': _write_csv, 'parquet': _write_parquet}
+
+
+def _dealer_codes(dealer):
+    """A dealer filter as a list of codes (None for all dealers)."""
+    if not dealer:
+        return None
+    return [dealer] if isinstance(dealer, str) else list(dealer)
+
+
+def export_name(year=None, month=None, tab=None, dealer=None, view=None, fmt='xlsx'):
+    dealer = _dealer_codes(dealer)
+    parts = ['dwes', *[str(part) for part in (year, month, view) if part],
+             *(['-'.join(dealer)] if dealer else []), tab or 'all']
+    return '_'.join(parts).replace(' ', '_') + '.' + fmt
+
+
+class Exporter:
+    def __init__(self, directory, max_files=32, chunk_size=5000):
+        self.directory = directory
+        self.max_files = max_files
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, cache_dir):
+        return cls(os.environ.get('DWES_EXPORT_DIR') or os.path.join(cache_dir, 'exports'),
+                   max_files=int(os.environ.get('DWES_EXPORT_CACHE_SIZE', 32)))
+
+    def path_for(self, snapshot, year=None, month=None, tab=None, dealer=None, view=None, fmt='xlsx'):
+        key = json.dumps([snapshot.version, year, month, tab, dealer, view], default=str)
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.' + fmt)
+
+    def prepared(self, snapshot, year=None, month=None, tab=None, dealer=None, view=None, fmt='xlsx'):
+        """Path of the finished export of the filtered view, None if it is not written (yet)."""
+        path = self.path_for(snapshot, year, month, tab, _dealer_codes(dealer), view, fmt)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    def export(self, snapshot, year=None, month=None, tab=None, dealer=None, view=None, fmt='xlsx',
+               progress=None):
+        """Return the path of the export of the filtered view, writing it if needed.
+
+        ``dealer`` is a dealer code or a list of them and ``view`` 'ytd' for the
+        year-to-date grids; ``progress(rows_written, rows)`` is called after
+        every chunk.
+        """
+        if fmt not in _WRITERS:
+            raise ValueError(f'unknown export format {fmt!r}')
+        prepared = self.prepared(snapshot, year, month, tab, dealer, view, fmt)
+        if prepared is not None:
+            return prepared
+        dealer = _dealer_codes(dealer)
+        path = self.path_for(snapshot, year, month, tab, dealer, view, fmt)
+        with _file_lock(path):
+            # Another request may have written the same view while we waited.
+            if os.path.exists(path):
+                return path
+            self._write(snapshot, path, year, month, tab, dealer, view, fmt, progress)
+        self._prune()
+        return path
+
+    def _write(self, snapshot, path, year, month, tab, dealer, view, fmt, progress):
+        with stage('filter'):
+            columns, total, chunks = snapshot.export_rows(tab, year, month, dealer, view, self.chunk_size)
+        sheet_name = ' '.join(str(part) for part in (month, year) if part) or 'dealers'
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with stage('write'):
+                _WRITERS[fmt](_counted(chunks, total, progress), columns, tmp, sheet_name)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _prune(self):
+        with os.scandir(self.directory) as it:
+            files = [entry for entry in it if not entry.name.endswith(('.tmp', '.lock'))]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.max_files]:
+            for stale in (entry.path, f'{entry.path}.lock'):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
@@ -0,0 +1,197 @@
+"""Bounded memoisation of callback results.
+
+Callback outputs (figures and grid components) are stored as serialised JSON
+keyed on the callback name, the data version and the input values. The
+version is asked for with every key, so it is that of the data the callback
+is about to read (with lazy loading, the first key loads it). Every
+worker keeps a small in-process LRU; an optional directory backend is shared
+by all gunicorn workers on the host.
+
+Configuration (environment):
+
+* ``DWES_FIGURE_CACHE_SIZE`` - entries per layer, ``0`` disables the cache
+* ``DWES_FIGURE_CACHE_TTL`` - seconds an entry stays valid, ``0`` for no limit
+* ``DWES_FIGURE_CACHE_DIR`` - directory of the shared backend
+"""
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from plotly.io.json import to_json_plotly
+
+from metrics import stage
+
+
+class MemoryBackend:
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            stored, payload = item
+            if self.ttl and time.monotonic() - stored > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return payload
+
+    def set(self, key, payload):
+        with self._lock:
+            self._items[key] = (time.monotonic(), payload)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FileSystemBackend:
+    """One file per entry; shared by every process pointing at ``directory``."""
+
+    def __init__(self, directory, maxsize, ttl=None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as fh:
+                payload = fh.read()
+        except OSError:
+            return None
+        # Touch the entry so that pruning evicts the least recently used files.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def set(self, key, payload):
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as fh:
+            fh.write(payload)
+        os.replace(tmp, path)
+        self._prune()
+
+    def _entries(self):
+        with os.scandir(self.directory) as it:
+            return [entry for entry in it if entry.name.endswith('.json')]
+
+    def _prune(self):
+        entries = self._entries()
+        if len(entries) <= self.maxsize:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.maxsize]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class FigureCache:
+    def __init__(self, maxsize=256, ttl=None, directory=None, version=None):
+        self.enabled = maxsize > 0
+        # ``version()`` returns the version of the data the callbacks read.
+        self.version = version or (lambda: '')
+        self.last_version = None
+        self.local = MemoryBackend(maxsize, ttl)
+        self.shared = FileSystemBackend(directory, maxsize, ttl) if directory and self.enabled else None
+        self.hits = self.shared_hits = self.misses = 0
+
+    @classmethod
+    def from_env(cls, version=None):
+        return cls(maxsize=int(os.environ.get('DWES_FIGURE_CACHE_SIZE', 256)),
+                   ttl=float(os.environ.get('DWES_FIGURE_CACHE_TTL', 0)) or None,
+                   directory=os.environ.get('DWES_FIGURE_CACHE_DIR') or None,
+                   version=version)
+
+    def key(self, name, args):
+        self.last_version = self.version()
+        raw = json.dumps([name, self.last_version, args], default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key):
+        payload = self.local.get(key)
+        if payload is not None:
+            self.hits += 1
+            return payload
+        if self.shared is not None:
+            payload = self.shared.get(key)
+            if payload is not None:
+                self.shared_hits += 1
+                self.local.set(key, payload)
+                return payload
+        self.misses += 1
+        return None
+
+    def set(self, key, payload):
+        self.local.set(key, payload)
+        if self.shared is not None:
+            self.shared.set(key, payload)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def memoize(self, name):
+        """Cache the serialised output of a callback named ``name``."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                if not self.enabled:
+                    return func(*args)
+                key = self.key(name, args)
+                payload = self.get(key)
+                if payload is None:
+                    # PreventUpdate and errors propagate and are never cached.
+                    result = func(*args)
+                    with stage('cache_store'):
+                        payload = to_json_plotly(result)
+                        self.set(key, payload)
+                return json.loads(payload)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                'hit_ratio': (self.hits + self.shared_hits) / lookups if lookups else None,
+                'entries': len(self.local),
+                'shared_entries': len(self.shared) if self.shared is not None else None,
+                'maxsize': self.local.maxsize, 'ttl': self.local.ttl, 'version': self.last_version}
@@ -0,0 +1,244 @@
+"""Bar charts of the dashboard, built without plotly.express.
+
+``px.bar`` turns its arguments into a long DataFrame, groups it per colour
+and validates every trace and layout property on the way, for charts whose
+shape never changes. Here each chart type has a skeleton instead: its layout
+and trace defaults are validated once, through ``go.Layout`` / ``go.Bar``,
+and kept as plain dicts. A figure is a shallow copy of the skeleton whose
+trace arrays are the NumPy columns of the frame, handed over as they are;
+Dash serialises the dict like it would the ``go.Figure``.
+
+* ``ranking`` - horizontal bars of the overview (top dealers, support)
+* ``kpi_trend`` - an indicator of one or more dealers month by month next
+  to the averages of their support groups: grouped bars, or a panel per
+  dealer past ``GROUPED_DEALERS`` dealers
+
+Trace 0 always carries the first series, so patches addressing
+``data[0]`` (the dealer highlight) keep working.
+
+Numeric trace arrays are sent as typed arrays (``{'dtype', 'bdata'}``, the
+base64 of the raw values) when the plotly.js that ``dcc.Graph`` loads reads
+them (2.28 and later); older bundles get plain lists.
+
+Configuration (environment):
+
+* ``DWES_TYPED_ARRAYS`` - ``1`` or ``0`` to force typed arrays on or off,
+  e.g. with a newer plotly.js in ``assets``; detected from Dash by default
+"""
+import base64
+import functools
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from plotly.colors import qualitative
+
+from schema import MONTHS
+
+# Support groups by order of appearance, like px's colour sequence.
+SUPPORT_COLORS = qualitative.Pastel1
+# Current year (or the dealer's value) against last year (or the regional value).
+PAIR_COLORS = ['lightsteelblue', 'gainsboro']
+TREND_COLORS = ['orange', 'lightsteelblue']
+DEALER_COLORS = ['orange', *qualitative.Set2]
+# One line style per support group average.
+AVERAGE_DASHES = ['dot', 'dash', 'dashdot', 'longdash']
+
+# Dealers compared as grouped bars in one chart; more get a panel each.
+GROUPED_DEALERS = 4
+FACET_COLUMNS = 2
+FACET_ROW_HEIGHT = 180
+
+_SKELETONS = {
+    'ranking': {'height': 400, 'barmode': 'group',
+                'xaxis': {'title': {'text': 'Total points'}},
+                'legend': {'tracegroupgap': 0}},
+    'kpi_trend': {'height': 350, 'barmode': 'group',
+                  'legend': {'orientation': 'h', 'yanchor': 'bottom', 'y': 1.02}},
+}
+
+_TRACES = {
+    'ranking': {'type': 'bar', 'orientation': 'h', 'textposition': 'auto'},
+    'kpi_trend': {'type': 'bar', 'orientation': 'v', 'textposition': 'auto'},
+}
+
+_AVERAGE_TRACE = {'type': 'scatter', 'mode': 'lines+markers', 'line': {'color': 'dimgray', 'width': 2},
+                  'marker': {'size': 5}}
+
+
+@functools.lru_cache(maxsize=None)
+def skeleton(kind):
+    """``(layout, trace)`` dicts of a chart type, validated on first use."""
+    # Loading the default template takes a while; only the first figure pays for it.
+    import plotly.graph_objects as go
+
+    layout = go.Layout(template=go.Figure().layout.template, **_SKELETONS[kind]).to_plotly_json()
+    return layout, go.Bar(_TRACES[kind]).to_plotly_json()
+
+
+@functools.lru_cache(maxsize=None)
+def _average_trace():
+    import plotly.graph_objects as go
+
+    return go.Scatter(_AVERAGE_TRACE).to_plotly_json()
+
+
+def _figure(kind, traces, **layout):
+    base_layout, base_trace = skeleton(kind)
+    return {'data': [{**base_trace, **trace} for trace in traces], 'layout': {**base_layout, **layout}}
+
+
+# plotly.js has no 64-bit integer arrays; those go as float64.
+_DTYPES = {'float64': 'f8', 'float32': 'f4', 'int32': 'i4', 'int16': 'i2', 'int8': 'i1',
+           'uint32': 'u4', 'uint16': 'u2', 'uint8': 'u1'}
+
+
+def _bundled_plotly_js():
+    """Version of the plotly.js bundled with ``dcc.Graph``, from its banner."""
+    import dash.dcc
+
+    try:
+        with open(os.path.join(os.path.dirname(dash.dcc.__file__), 'plotly.min.js')) as fh:
+            banner = fh.read(200)
+    except OSError:
+        return None
+    found = re.search(r'plotly\.js v(\d+)\.(\d+)', banner)
+    return tuple(int(part) for part in found.groups()) if found else None
+
+
+@functools.lru_cache(maxsize=None)
+def typed_arrays():
+    setting = os.environ.get('DWES_TYPED_ARRAYS')
+    if setting is not None:
+        return setting == '1'
+    version = _bundled_plotly_js()
+    return version is not None and version >= (2, 28)
+
+
+def _values(column):
+    values = column.to_numpy() if hasattr(column, 'to_numpy') else np.asarray(column)
+    if values.dtype.kind not in 'iuf' or not typed_arrays():
+        return values
+    if values.dtype.name not in _DTYPES:
+        values = values.astype('float64')
+    return {'dtype': _DTYPES[values.dtype.name],
+            'bdata': base64.b64encode(np.ascontiguousarray(values).tobytes()).decode('ascii')}
+
+
+def ranking(title, labels, bars, text_format=None, category_order='total ascending'):
+    """Horizontal bars of ``labels``, one trace per ``(name, values, color)`` in ``bars``.
+
+    ``color`` is a colour or one colour per label; bars are labelled with
+    their value in ``text_format`` ('' as is, None for no labels).
+    ``category_order`` is ``'total ascending'`` or the labels from bottom to top.
+    """
+    labels = _values(labels)
+    traces = []
+    for name, values, color in bars:
+        trace = {'name': name, 'x': _values(values), 'y': labels, 'marker': {'color': color}}
+        if text_format is not None:
+            trace['texttemplate'] = f'%{{x:{text_format}}}' if text_format else '%{x}'
+        traces.append(trace)
+    if isinstance(category_order, str):
+        yaxis = {'categoryorder': category_order}
+    else:
+        yaxis = {'categoryorder': 'array', 'categoryarray': _values(category_order)}
+    return _figure('ranking', traces, title={'text': title}, yaxis=yaxis, showlegend=len(bars) > 1)
+
+
+def _calendar(*frames):
+    """Period labels of ``frames`` in calendar order."""
+    # A few dozen labels; sorting them beats sorting the rows.
+    order = {}
+    for frame in frames:
+        for period, year, month in zip(frame['period'].to_numpy(), frame['year'].to_numpy(),
+                                       frame['month'].to_numpy()):
+            if period not in order:
+                order[period] = (int(year), MONTHS.index(str(month)))
+    return sorted(order, key=order.get)
+
+
+def _positions(column):
+    """``{value: row positions}`` of the values of ``column`` in order of appearance."""
+    codes, values = pd.factorize(column.to_numpy().astype(str), sort=False)
+    ends = np.cumsum(np.bincount(codes, minlength=len(values)))[:-1]
+    return dict(zip(values, np.split(np.argsort(codes, kind='stable'), ends)))
+
+
+def _facet_layout(names):
+    """Axes, titles and height of a panel per name, ``FACET_COLUMNS`` to a row."""
+    rows = -(-len(names) // FACET_COLUMNS)
+    gap_x, gap_y = 0.08, 0.3 / rows
+    width, height = (1 - gap_x * (FACET_COLUMNS - 1)) / FACET_COLUMNS, (1 - gap_y * (rows - 1)) / rows
+    layout = {'height': 120 + FACET_ROW_HEIGHT * rows, 'annotations': []}
+    for panel, name in enumerate(names):
+        row, column = divmod(panel, FACET_COLUMNS)
+        suffix = str(panel + 1) if panel else ''
+        left, top = column * (width + gap_x), 1 - row * (height + gap_y)
+        layout[f'xaxis{suffix}'] = {'domain': [left, left + width], 'anchor': f'y{suffix}', 'type': 'category'}
+        layout[f'yaxis{suffix}'] = {'domain': [top - height, top], 'anchor': f'x{suffix}',
+                                    **({'matches': 'y'} if panel else {})}
+        layout['annotations'].append({'text': name, 'showarrow': False, 'xref': 'paper', 'yref': 'paper',
+                                      'x': left + width / 2, 'y': top, 'xanchor': 'center', 'yanchor': 'bottom'})
+    return layout
+
+
+def kpi_trend(series, averages, column, title, y_title, benchmark=None, text_format=',.0f'):
+    """``column`` of the dealers in ``series`` per ``period`` against their support group averages.
+
+    ``series`` holds the rows of the dealers (``DealerIndex.series``) and
+    ``averages`` the monthly averages of their groups (``GroupAverages``).
+    A single dealer also gets the ``benchmark`` column (its regional value)
+    and its bars labelled.
+    """
+    dealer_rows = _positions(series['dealer_code'])
+    group_rows = _positions(averages['warranty'])
+    dealers = list(dealer_rows)
+    warranty = series['warranty'].to_numpy()
+    dealer_groups = {dealer: str(warranty[rows[-1]]) for dealer, rows in dealer_rows.items()}
+    dashes = {group: AVERAGE_DASHES[i % len(AVERAGE_DASHES)]
+              for i, group in enumerate(dict.fromkeys(dealer_groups.values()))}
+    layout, bar = skeleton('kpi_trend')
+    average = _average_trace()
+    periods, values = series['period'].to_numpy(), series[column].to_numpy()
+    average_periods, average_values = averages['period'].to_numpy(), averages[column].to_numpy()
+
+    def bars(dealer, color, **trace):
+        rows = dealer_rows[dealer]
+        return {**bar, 'name': dealer, 'x': periods[rows], 'y': _values(values[rows]),
+                'marker': {'color': color}, **trace}
+
+    def average_line(group, **trace):
+        rows = group_rows.get(group, np.empty(0, dtype='int64'))
+        return {**average, 'name': f'{group} average', 'legendgroup': group,
+                'x': average_periods[rows], 'y': _values(average_values[rows]),
+                'line': {**average['line'], 'dash': dashes[group]}, **trace}
+
+    colors = [DEALER_COLORS[i % len(DEALER_COLORS)] for i in range(len(dealers))]
+    figure_layout = {**layout, 'title': {'text': title}}
+    xaxis = {'type': 'category', 'categoryorder': 'array', 'categoryarray': _calendar(series, averages)}
+    if len(dealers) <= GROUPED_DEALERS:
+        traces = [bars(dealer, color) for dealer, color in zip(dealers, colors)]
+        if len(dealers) == 1:
+            traces[0]['texttemplate'] = f'%{{y:{text_format}}}'
+            if benchmark is not None:
+                traces.append(bars(dealers[0], TREND_COLORS[1], name=benchmark,
+                                   y=_values(series[benchmark].to_numpy()[dealer_rows[dealers[0]]])))
+        traces += [average_line(group) for group in dashes]
+        figure_layout.update(xaxis=xaxis, yaxis={'title': {'text': y_title}})
+        return {'data': traces, 'layout': figure_layout}
+    traces, shown = [], set()
+    for panel, (dealer, color) in enumerate(zip(dealers, colors)):
+        axes = {'xaxis': f'x{panel + 1}' if panel else 'x', 'yaxis': f'y{panel + 1}' if panel else 'y'}
+        group = dealer_groups[dealer]
+        traces.append(bars(dealer, color, showlegend=False, **axes))
+        traces.append(average_line(group, showlegend=group not in shown, **axes))
+        shown.add(group)
+    facets = _facet_layout(dealers)
+    for key, axis in facets.items():
+        if key.startswith('xaxis'):
+            axis.update(xaxis)
+    facets['yaxis']['title'] = {'text': y_title}
+    figure_layout.update(facets)
+    return {'data': traces, 'layout': figure_layout}
@@ -0,0 +1,167 @@
+"""Multi-year views derived from the monthly rows.
+
+The store only holds real months. The 'total' sheets of the workbook (rows of
+the 'Accumulative' pseudo month) are left out; year-to-date figures are
+derived from the monthly inputs instead, by accumulating them per dealer and
+running the KPI engine on the result, so they follow the same rules as any
+month and exist for every month of every year.
+
+Everything is computed per (year, month) when the data is loaded. A month
+appended later only adds its own entries: its year-to-date inputs extend
+those of the previous month, and the rolling sums come from running totals
+of the penalty points, one column per month.
+"""
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from aggregates import TOP_DEALERS, build_month_aggregates
+from kpi_engine import compute_kpis
+from schema import MONTHS, apply_schema, concat
+
+# Year to date, flows add up and states keep their latest value.
+YEAR_SUMS = ['m2_cost', 'm2_qty', 'parts_cost', 'claim_qty', 'total_cost', 'novs', 'sws']
+YEAR_LAST = ['uio', 'campaign', 'courtesy_car', 'trp_2', 'dowt', 'dealer_name', 'mobis_code', 'region', 'warranty']
+
+ROLLING_WINDOW = 12
+
+
+def is_total_sheet(frame):
+    return len(frame) > 0 and bool((frame['month'] == 'Accumulative').all())
+
+
+def period_id(year, month):
+    return int(year) * 12 + MONTHS.index(month)
+
+
+def accumulate(previous, rows):
+    """Year-to-date inputs per dealer: ``previous`` (or None) and then ``rows``."""
+    rows = rows[['dealer_code', *YEAR_SUMS, *YEAR_LAST]].astype({column: 'float64' for column in YEAR_SUMS})
+    combined = rows if previous is None else concat([previous, rows])
+    totals = combined.groupby('dealer_code', sort=False, observed=True)[YEAR_SUMS].sum(min_count=1)
+    # GroupBy.last runs in Python for categoricals; keep each dealer's last non-null value by hand.
+    for column in YEAR_LAST:
+        present = combined[combined[column].notna().to_numpy()].drop_duplicates('dealer_code', keep='last')
+        totals[column] = pd.Series(present[column].array, index=present['dealer_code'].array).reindex(totals.index)
+    return totals.reset_index()
+
+
+def year_to_date_rows(inputs, year, month):
+    """Dealer rows of the year to date through ``month``, scored like a month."""
+    rows = compute_kpis(inputs.assign(year=year, month=month))
+    return apply_schema(rows)
+
+
+class History:
+    """Running totals of the penalty points of every dealer, month by month."""
+
+    def __init__(self, codes, period_ids, cumulative):
+        self.codes = codes
+        self.period_ids = period_ids
+        self.cumulative = cumulative
+        self._rows = {code: row for row, code in enumerate(codes)}
+
+    @classmethod
+    def build(cls, points):
+        return cls([], np.empty(0, dtype='int64'), np.zeros((0, 0))).extend(points)
+
+    def extend(self, points):
+        """History with the months of ``points`` added, or None if they are not later months."""
+        ids = (points['year'].to_numpy(dtype='int64') * 12
+               + pd.Categorical(points['month'], categories=MONTHS).codes)
+        new_ids = np.unique(ids)
+        if len(self.period_ids) and len(new_ids) and new_ids[0] <= self.period_ids[-1]:
+            return None
+        dealer_codes = points['dealer_code'].astype(str).to_numpy()
+        codes = self.codes + [code for code in pd.unique(dealer_codes) if code not in self._rows]
+        rows = {code: row for row, code in enumerate(codes)}
+        monthly = np.zeros((len(codes), len(new_ids)))
+        np.add.at(monthly, (np.array([rows[code] for code in dealer_codes], dtype='int64'),
+                            np.searchsorted(new_ids, ids)),
+                  np.nan_to_num(points['total_points'].to_numpy(dtype='float64')))
+        last = np.zeros(len(codes))
+        if self.cumulative.shape[1]:
+            last[:len(self.codes)] = self.cumulative[:, -1]
+        cumulative = np.zeros((len(codes), len(self.period_ids) + len(new_ids)))
+        cumulative[:len(self.codes), :len(self.period_ids)] = self.cumulative
+        cumulative[:, len(self.period_ids):] = last[:, None] + monthly.cumsum(axis=1)
+        return History(codes, np.concatenate([self.period_ids, new_ids]), cumulative)
+
+    def rolling(self, year, month, codes, window=ROLLING_WINDOW):
+        """Points of ``codes`` summed over the ``window`` months ending with ``month``."""
+        current = period_id(year, month)
+        column = np.searchsorted(self.period_ids, current)
+        before = np.searchsorted(self.period_ids, current - window, side='right') - 1
+        sums = self.cumulative[:, column] - (self.cumulative[:, before] if before >= 0 else 0)
+        return sums[[self._rows[code] for code in codes]]
+
+
+class Comparison(NamedTuple):
+    top_yoy: pd.DataFrame
+    support_yoy: pd.DataFrame
+    top_rolling: pd.DataFrame
+    support_rolling: pd.DataFrame
+
+
+def year_over_year(agg, previous_points, previous_support):
+    """Top dealers and support of ``agg`` next to last year's points.
+
+    ``previous_points`` maps dealer codes and ``previous_support`` warranty
+    groups to their points a year earlier (None if that month is unknown).
+    """
+    top = agg.top_dealers[['dealer_name', 'dealer_code', 'total_points']]
+    support = agg.support[['warranty', 'total_points']]
+    if previous_points is None:
+        return top.assign(previous=np.nan), support.assign(previous=np.nan)
+    return (top.assign(previous=top['dealer_code'].astype(str).map(previous_points).to_numpy()),
+            support.assign(previous=support['warranty'].astype(str).map(previous_support).to_numpy()))
+
+
+def rank_rolling(frame, sums, top=TOP_DEALERS):
+    """Top dealers and support of the dealers in ``frame`` by their rolling ``sums``."""
+    ranked = frame[['dealer_name', 'dealer_code', 'warranty']].assign(total_points=sums)
+    leaders = ranked.sort_values('total_points', ascending=False, kind='stable')[:top]
+    support = ranked.groupby('warranty', observed=True)['total_points'].mean().reset_index()
+    return leaders[['dealer_name', 'dealer_code', 'total_points']].reset_index(drop=True), support
+
+
+def _previous(previous):
+    if previous is None:
+        return None, None
+    frame = previous.points.frame
+    return (pd.Series(frame['total_points'].to_numpy(), index=frame['dealer_code'].astype(str)),
+            pd.Series(previous.support['total_points'].to_numpy(), index=previous.support['warranty'].astype(str)))
+
+
+def build_comparisons(keys, month_aggregates, history):
+    """``{(year, month): Comparison}`` for ``keys``; earlier months must be in ``month_aggregates``."""
+    comparisons = {}
+    for year, month in keys:
+        agg = month_aggregates[(year, month)]
+        top_yoy, support_yoy = year_over_year(agg, *_previous(month_aggregates.get((year - 1, month))))
+        codes = agg.points.frame['dealer_code'].astype(str).tolist()
+        top_rolling, support_rolling = rank_rolling(agg.points.frame, history.rolling(year, month, codes))
+        comparisons[(year, month)] = Comparison(top_yoy, support_yoy, top_rolling, support_rolling)
+    return comparisons
+
+
+def build_year_to_date(rows, freeze_rs, derive, inputs=None):
+    """Year-to-date aggregates of the months in ``rows``, in calendar order.
+
+    ``inputs`` maps a year to the accumulated inputs of its latest month and
+    is updated in place; returns ``{(year, month): MonthAggregate}``.
+    """
+    inputs = {} if inputs is None else inputs
+    aggregates = {}
+    periods = rows[['year', 'month']].drop_duplicates()
+    order = np.argsort(periods['year'].to_numpy(dtype='int64') * 12
+                       + pd.Categorical(periods['month'], categories=MONTHS).codes)
+    for year, month in periods.iloc[order].itertuples(index=False, name=None):
+        month = str(month)
+        month_rows = rows[(rows['year'] == year).to_numpy() & (rows['month'] == month).to_numpy()]
+        inputs[year] = accumulate(inputs.get(year), month_rows)
+        ytd = year_to_date_rows(inputs[year], year, month)
+        points, data = derive(ytd, freeze_rs)
+        aggregates.update(build_month_aggregates(ytd, freeze_rs, points, data))
+    return aggregates
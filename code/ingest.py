@@ -0,0 +1,221 @@
+"""Columnar on-disk cache of the master workbook.
+
+The workbook is parsed with openpyxl once and every sheet is written as an
+uncompressed Feather (Arrow IPC) file, so gunicorn workers read Feather
+instead of each repeating the Excel parse. The frames built from it are the
+worker's own memory, not pages of the cache: the schema casts and the
+concatenation of the sheets copy every column (the load logs how much
+resident memory it added).
+
+The manifest keeps a fingerprint per sheet taken from the xlsx container
+itself (the CRC of the sheet part and a hash of the shared strings it can
+reference), so when the workbook changes only new or edited sheets are
+parsed again.
+
+Run ``python ingest.py [workbook]`` to build the cache ahead of a deploy.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import posixpath
+import sys
+import zipfile
+from contextlib import contextmanager
+from xml.etree import ElementTree
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+MANIFEST = 'manifest.json'
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def cache_dir_for(workbook):
+    return os.path.join(os.path.dirname(os.path.abspath(workbook)), 'cache')
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _strings_sha(strings):
+    return hashlib.sha256('\x00'.join(strings).encode()).hexdigest()
+
+
+def _sheet_parts(zf):
+    """Return ``{sheet name: zip member}`` in workbook order."""
+    rels = ElementTree.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(f'{_PKG_NS}Relationship')}
+    workbook = ElementTree.fromstring(zf.read('xl/workbook.xml'))
+    parts = {}
+    for sheet in workbook.iter(f'{_MAIN_NS}sheet'):
+        target = targets[sheet.get(f'{_REL_NS}id')]
+        parts[sheet.get('name')] = (target.lstrip('/') if target.startswith('/')
+                                    else posixpath.normpath(posixpath.join('xl', target)))
+    return parts
+
+
+def _shared_strings(zf):
+    try:
+        root = ElementTree.fromstring(zf.read('xl/sharedStrings.xml'))
+    except KeyError:
+        return []
+    return [''.join(t.text or '' for t in si.iter(f'{_MAIN_NS}t')) for si in root.iter(f'{_MAIN_NS}si')]
+
+
+def sheet_fingerprints(workbook, previous=None):
+    """Fingerprint every sheet of ``workbook``.
+
+    Excel appends new shared strings to the end of the table, so a sheet whose
+    part is byte-identical and whose shared strings prefix is unchanged keeps
+    its ``previous`` fingerprint and does not need to be parsed again.
+    """
+    previous = previous or {}
+    with zipfile.ZipFile(workbook) as zf:
+        parts = _sheet_parts(zf)
+        strings = _shared_strings(zf)
+        crcs = {name: zf.getinfo(part).CRC for name, part in parts.items()}
+    current = {'crc': None, 'strings': len(strings), 'strings_sha': _strings_sha(strings)}
+    fingerprints = {}
+    for name, crc in crcs.items():
+        old = previous.get(name)
+        if (old is not None and old['crc'] == crc
+                and _strings_sha(strings[:old['strings']]) == old['strings_sha']):
+            fingerprints[name] = old
+        else:
+            fingerprints[name] = dict(current, crc=crc)
+    return fingerprints
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    # Manifests written before per-sheet fingerprints listed bare names.
+    return manifest if isinstance(manifest.get('sheets'), dict) else None
+
+
+def _write_atomic(path, write):
+    # Several workers may race to build the cache; readers must never see a
+    # half written file, so everything goes through a rename.
+    tmp = f'{path}.{os.getpid()}.tmp'
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_manifest(cache_dir, manifest):
+    def write(tmp):
+        with open(tmp, 'w') as fh:
+            json.dump(manifest, fh, indent=1)
+    _write_atomic(os.path.join(cache_dir, MANIFEST), write)
+
+
+@contextmanager
+def _build_lock(cache_dir):
+    with open(os.path.join(cache_dir, '.lock'), 'w') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _feather_path(cache_dir, name):
+    return os.path.join(cache_dir, f'{name}.feather')
+
+
+def _is_fresh(manifest, workbook, cache_dir):
+    if manifest is None:
+        return False
+    for name in manifest['sheets']:
+        if not os.path.exists(_feather_path(cache_dir, name)):
+            return False
+    stat = os.stat(workbook)
+    if manifest['mtime_ns'] == stat.st_mtime_ns and manifest['size'] == stat.st_size:
+        return True
+    # The file was touched (copied, checked out again ...) - only the content
+    # hash decides whether the sheets have to be parsed again.
+    if manifest['sha256'] != file_sha256(workbook):
+        return False
+    manifest['mtime_ns'], manifest['size'] = stat.st_mtime_ns, stat.st_size
+    _write_manifest(cache_dir, manifest)
+    return True
+
+
+def ensure_cache(workbook, cache_dir=None):
+    """Bring the cache in line with ``workbook`` and return its manifest.
+
+    Only sheets whose fingerprint changed (or which have no Feather file yet)
+    are parsed; cached files of sheets removed from the workbook are deleted.
+    """
+    cache_dir = cache_dir or cache_dir_for(workbook)
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = _read_manifest(cache_dir)
+    if _is_fresh(manifest, workbook, cache_dir):
+        return manifest
+    with _build_lock(cache_dir):
+        # Another worker may have finished the same rebuild while we waited.
+        manifest = _read_manifest(cache_dir)
+        if _is_fresh(manifest, workbook, cache_dir):
+            return manifest
+        old_sheets = manifest['sheets'] if manifest else {}
+        stat = os.stat(workbook)
+        sha256 = file_sha256(workbook)
+        sheets = sheet_fingerprints(workbook, old_sheets)
+        stale = [name for name, fingerprint in sheets.items()
+                 if old_sheets.get(name) != fingerprint
+                 or not os.path.exists(_feather_path(cache_dir, name))]
+        if stale:
+            for name, frame in pd.read_excel(workbook, sheet_name=stale).items():
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                _write_atomic(_feather_path(cache_dir, name),
+                              lambda tmp: feather.write_feather(table, tmp, compression='uncompressed'))
+        for name in set(old_sheets) - set(sheets):
+            try:
+                os.remove(_feather_path(cache_dir, name))
+            except OSError:
+                pass
+        manifest = {'workbook': os.path.abspath(workbook), 'mtime_ns': stat.st_mtime_ns,
+                    'size': stat.st_size, 'sha256': sha256, 'sheets': sheets}
+        _write_manifest(cache_dir, manifest)
+    return manifest
+
+
+def build_cache(workbook, cache_dir=None):
+    """Parse every sheet of ``workbook`` again and store it as Feather."""
+    cache_dir = cache_dir or cache_dir_for(workbook)
+    try:
+        os.remove(os.path.join(cache_dir, MANIFEST))
+    except OSError:
+        pass
+    return ensure_cache(workbook, cache_dir)
+
+
+def read_sheet(cache_dir, name):
+    # Mapped rather than read into a buffer first; to_pandas copies the columns out.
+    table = feather.read_table(_feather_path(cache_dir, name), memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def load_sheets(workbook, cache_dir=None):
+    """Return ``{sheet name: DataFrame}`` for ``workbook`` from the cache."""
+    cache_dir = cache_dir or cache_dir_for(workbook)
+    manifest = ensure_cache(workbook, cache_dir)
+    return {name: read_sheet(cache_dir, name) for name in manifest['sheets']}
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else '../data/dwcc_master_git_model.xlsx'
+    manifest = build_cache(path)
+    print(f"cached {len(manifest['sheets'])} sheets of {path} in {cache_dir_for(path)}")
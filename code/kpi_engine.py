@@ -0,0 +1,155 @@
+"""Vectorised KPI and penalty point computation from raw dealer inputs.
+
+Reproduces the offline spreadsheet step (see the ``tab_3`` description):
+
+* per dealer: DM2PU = M2 cost / UIO, DCPU = parts cost / UIO,
+  CPC = total cost / claims, RVS = claims / NOVS (rounded to 2 places like
+  Python's ``round``, see ``_round2``),
+  SWS ratio = SWS claims / claims * 100;
+* ``_reg`` benchmarks per (year, month, region): the same ratios over the
+  region's sums, the regional mean of the cost columns and of the campaign
+  result;
+* penalty points: 5 for a per-unit KPI above its regional benchmark, 20 for a
+  campaign result below the regional one, a courtesy car utilisation below
+  ``COURTESY_CAR_MIN`` or a TRP 2 result of at most ``TRP_2_MIN``, 10 for an
+  SWS ratio below ``SWS_RATIO_MIN`` or a dealer that is not certified.
+
+Every group statistic is a ``np.bincount`` over integer group codes, so the
+whole batch (all dealers and months at once) is a handful of array passes.
+"""
+import numpy as np
+import pandas as pd
+
+RAW_COLUMNS = ['uio', 'm2_cost', 'm2_qty', 'parts_cost', 'claim_qty', 'total_cost', 'novs',
+               'campaign', 'courtesy_car', 'sws', 'trp_2', 'dowt']
+
+KPI_COLUMNS = ['dm2pu', 'dcpu', 'cpc', 'rvs', 'sws_ratio',
+               'm2_cost_reg', 'parts_cost_reg', 'total_cost_reg',
+               'dm2pu_reg', 'dcpu_reg', 'cpc_reg', 'rvs_reg', 'campaign_reg',
+               'dm2pu_p', 'dcpu_p', 'cpc_p', 'rvs_p', 'campaign_p', 'courtesy_car_p',
+               'trp_2_p', 'sws_p', 'dowt_p', 'total_points']
+
+BENCHMARK_KEYS = ['year', 'month', 'region']
+
+# Not from a rulebook: fitted to the shipped workbook (all months), where
+# the penalised courtesy car results go up to 26.09 and the others start at
+# 28, TRP 2 results of 75 are penalised and of 76 are not, and SWS ratios go
+# up to 14.81 with a penalty and start at 15.19 without. Any cutoff in those
+# gaps reproduces the points; these are the round numbers in them.
+COURTESY_CAR_MIN = 27
+TRP_2_MIN = 75
+SWS_RATIO_MIN = 15
+
+
+def needs_kpis(frame):
+    """True for a sheet of raw inputs without the computed columns."""
+    return set(RAW_COLUMNS) <= set(frame.columns) and 'total_points' not in frame.columns
+
+
+def _divide(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return numerator / denominator
+
+
+def _round2(values):
+    """``values`` rounded to 2 places like the workbook, i.e. Python's ``round``.
+
+    ``np.round`` scales by 100 first, which turns 43 / 40 (stored just below
+    1.075) into an exact half and rounds it up to 1.08; the workbook has
+    1.07. Only values that close to a half are rounded again one by one.
+    """
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    with np.errstate(invalid='ignore'):
+        near_half = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    rounded[near_half] = [round(value, 2) for value in values[near_half].tolist()]
+    return rounded
+
+
+class _Groups:
+    """Sums and means over integer group codes, skipping NaN like pandas."""
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.size = codes.max() + 1 if len(codes) else 0
+
+    def sum(self, values):
+        return np.bincount(self.codes, weights=np.nan_to_num(values, nan=0.0), minlength=self.size)
+
+    def count(self, values):
+        return np.bincount(self.codes, weights=~np.isnan(values), minlength=self.size)
+
+    def mean(self, values):
+        return _divide(self.sum(values), self.count(values))
+
+    def broadcast(self, per_group):
+        return per_group[self.codes]
+
+
+def _group_codes(frame, keys):
+    codes = np.zeros(len(frame), dtype='int64')
+    for key in keys:
+        key_codes, uniques = pd.factorize(frame[key], use_na_sentinel=False)
+        codes = codes * len(uniques) + key_codes
+    return pd.factorize(codes)[0]
+
+
+def _column(frame, name):
+    return frame[name].to_numpy(dtype='float64', na_value=np.nan)
+
+
+def compute_kpis(frame, keys=BENCHMARK_KEYS):
+    """Return ``frame`` with every KPI, benchmark and point column (re)computed."""
+    uio, m2_cost, parts_cost = _column(frame, 'uio'), _column(frame, 'm2_cost'), _column(frame, 'parts_cost')
+    claim_qty, total_cost, novs = _column(frame, 'claim_qty'), _column(frame, 'total_cost'), _column(frame, 'novs')
+    campaign, courtesy_car = _column(frame, 'campaign'), _column(frame, 'courtesy_car')
+    sws, trp_2 = _column(frame, 'sws'), _column(frame, 'trp_2')
+
+    groups = _Groups(_group_codes(frame, keys))
+    uio_reg, claim_reg = groups.sum(uio), groups.sum(claim_qty)
+
+    out = {
+        'dm2pu': _divide(m2_cost, uio),
+        'dcpu': _divide(parts_cost, uio),
+        'cpc': _divide(total_cost, claim_qty),
+        'rvs': _round2(_divide(claim_qty, novs)),
+        'sws_ratio': _divide(sws, claim_qty) * 100,
+        'm2_cost_reg': groups.broadcast(groups.mean(m2_cost)),
+        'parts_cost_reg': groups.broadcast(groups.mean(parts_cost)),
+        'total_cost_reg': groups.broadcast(groups.mean(total_cost)),
+        'dm2pu_reg': groups.broadcast(_divide(groups.sum(m2_cost), uio_reg)),
+        'dcpu_reg': groups.broadcast(_divide(groups.sum(parts_cost), uio_reg)),
+        'cpc_reg': groups.broadcast(_divide(groups.sum(total_cost), claim_reg)),
+        'rvs_reg': groups.broadcast(_round2(_divide(claim_reg, groups.sum(novs)))),
+        'campaign_reg': groups.broadcast(groups.mean(campaign)),
+    }
+
+    # Comparisons with NaN are False, which is what the spreadsheet's IFs do
+    # with empty cells: a missing DM2PU is no penalty, a missing RVS is one.
+    with np.errstate(invalid='ignore'):
+        out['dm2pu_p'] = np.where(out['dm2pu'] > out['dm2pu_reg'], 5, 0)
+        out['dcpu_p'] = np.where(out['dcpu'] > out['dcpu_reg'], 5, 0)
+        out['cpc_p'] = np.where(out['cpc'] > out['cpc_reg'], 5, 0)
+        out['rvs_p'] = np.where(out['rvs'] <= out['rvs_reg'], 0, 5)
+        out['campaign_p'] = np.where(campaign >= out['campaign_reg'], 0, 20)
+        out['courtesy_car_p'] = np.where(courtesy_car >= COURTESY_CAR_MIN, 0, 20)
+        out['trp_2_p'] = np.where(trp_2 > TRP_2_MIN, 0, 20)
+        out['sws_p'] = np.where(out['sws_ratio'] >= SWS_RATIO_MIN, 0, 10)
+    out['dowt_p'] = np.where(frame['dowt'].astype(object).to_numpy() == 'Certified', 0, 10)
+    out['total_points'] = sum(out[column] for column in KPI_COLUMNS if column.endswith('_p'))
+
+    result = frame.drop(columns=[column for column in KPI_COLUMNS if column in frame.columns])
+    return pd.concat([result, pd.DataFrame({column: out[column] for column in KPI_COLUMNS}, index=frame.index)], axis=1)
+
+
+def validate_kpis(frame, rtol=1e-9):
+    """Names of the KPI columns of ``frame`` the engine does not reproduce."""
+    computed = compute_kpis(frame)
+    mismatched = []
+    for column in KPI_COLUMNS:
+        if column not in frame.columns:
+            continue
+        expected, actual = _column(frame, column), _column(computed, column)
+        if not np.allclose(expected, actual, rtol=rtol, atol=1e-9, equal_nan=True):
+            mismatched.append(column)
+    return mismatched
@@ -0,0 +1,289 @@
+"""Hot path instrumentation of the dashboard callbacks.
+
+``instrument(name)`` wraps a callback and ``stage(name)`` marks a step inside
+it; both feed Prometheus histograms that ``register(server)`` exposes on
+``/metrics``. Dash serialises a callback's result after it returns, so the
+``serialise`` stage and the payload size are taken in an ``after_request``
+hook on ``/_dash-update-component`` (after compression: the size sent).
+
+Configuration (environment):
+
+* ``DWES_PROFILE_SLOW_MS`` - enables the sampling profiler; requests slower
+  than this many milliseconds dump their stacks
+* ``DWES_PROFILE_INTERVAL_MS`` - sampling interval, 5 ms by default
+* ``DWES_PROFILE_DIR`` - directory of the dumps, ``profiles`` by default
+* ``PROMETHEUS_MULTIPROC_DIR`` - aggregate the metrics of all gunicorn
+  workers (see the prometheus-client multiprocess docs)
+
+Dumps are in the collapsed stack format (``frame;frame;frame count``) read by
+flamegraph.pl, speedscope and inferno.
+
+``record_startup(milestone)`` stores the seconds from process start to a
+startup milestone (imported, data loaded, first response) once per process.
+
+``instrument_job(name)`` instruments the body of a background callback,
+which runs in a process forked for the job. In multiprocess mode that
+process writes its samples next to the workers'; otherwise its run time and
+stages are spooled to ``register``'s ``spool_dir`` and added to the metrics
+of the worker that serves ``/metrics`` next.
+"""
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import psutil
+from dash.exceptions import PreventUpdate
+from flask import Response, g, has_request_context
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+_SECONDS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+_BYTES = tuple(2 ** power for power in range(10, 26, 2))
+
+CALLBACK_SECONDS = Histogram('dwes_callback_seconds', 'Callback run time, serialisation excluded',
+                             ['callback', 'outcome'], buckets=_SECONDS)
+STAGE_SECONDS = Histogram('dwes_callback_stage_seconds', 'Time spent in a stage of a callback',
+                          ['callback', 'stage'], buckets=_SECONDS)
+PAYLOAD_BYTES = Histogram('dwes_callback_payload_bytes', 'Size of the response of a callback',
+                          ['callback'], buckets=_BYTES)
+STARTUP_SECONDS = Gauge('dwes_startup_seconds', 'Seconds from process start to a startup milestone',
+                        ['milestone'], multiprocess_mode='max')
+
+_local = threading.local()
+_milestones = set()
+
+# Observations of a job process waiting to be spooled (None outside of one).
+_pending = None
+_spool_dir = None
+_SPOOLED = {'callback': CALLBACK_SECONDS, 'stage': STAGE_SECONDS}
+
+
+def _observe(kind, labels, seconds):
+    if _pending is not None:
+        _pending.append((kind, labels, seconds))
+    else:
+        _SPOOLED[kind].labels(*labels).observe(seconds)
+
+
+class _StackSampler:
+    """Samples the stack of one thread until stopped."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='dwes-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+
+class Profiler:
+    def __init__(self, slow_ms=None, interval_ms=5, directory='profiles'):
+        self.slow_ms = slow_ms
+        self.interval = interval_ms / 1000
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls):
+        slow_ms = os.environ.get('DWES_PROFILE_SLOW_MS')
+        return cls(slow_ms=float(slow_ms) if slow_ms else None,
+                   interval_ms=float(os.environ.get('DWES_PROFILE_INTERVAL_MS', 5)),
+                   directory=os.environ.get('DWES_PROFILE_DIR', 'profiles'))
+
+    @property
+    def enabled(self):
+        return self.slow_ms is not None
+
+    def start(self):
+        return _StackSampler(threading.get_ident(), self.interval) if self.enabled else None
+
+    def finish(self, sampler, name, elapsed):
+        if sampler is None:
+            return
+        stacks = sampler.stop()
+        if elapsed * 1000 < self.slow_ms or not stacks:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{name}-{time.strftime("%Y%m%dT%H%M%S")}-{elapsed * 1000:.0f}ms.folded')
+        with open(path, 'w') as fh:
+            for stack, count in stacks.most_common():
+                fh.write(f'{stack} {count}\n')
+        logger.warning('%s took %.0f ms, stacks written to %s', name, elapsed * 1000, path)
+
+
+profiler = Profiler.from_env()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a stage of the instrumented callback running in this thread."""
+    callback = getattr(_local, 'callback', None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if callback is not None:
+            _observe('stage', (callback, name), time.perf_counter() - started)
+
+
+def instrument(name):
+    """Record the run time, stages and payload size of a callback."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            _local.callback = name
+            sampler = profiler.start()
+            started = time.perf_counter()
+            outcome = 'ok'
+            try:
+                return func(*args, **kwargs)
+            except PreventUpdate:
+                outcome = 'prevented'
+                raise
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                _local.callback = None
+                _observe('callback', (name, outcome), time.perf_counter() - started)
+                if has_request_context():
+                    # Serialisation happens after we return; after_request finishes the record.
+                    g.dwes_callback = (name, started, time.perf_counter(), sampler)
+                else:
+                    profiler.finish(sampler, name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def _write_spool(records):
+    os.makedirs(_spool_dir, exist_ok=True)
+    path = os.path.join(_spool_dir, f'{os.getpid()}-{time.time_ns()}.json')
+    with open(f'{path}.tmp', 'w') as fh:
+        json.dump(records, fh)
+    os.replace(f'{path}.tmp', path)
+
+
+def replay_spool():
+    """Add the spooled observations of finished jobs to the metrics of this process."""
+    if _spool_dir is None or not os.path.isdir(_spool_dir):
+        return
+    for name in os.listdir(_spool_dir):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(_spool_dir, name)
+        claimed = f'{path}.{os.getpid()}.replay'
+        try:
+            # Renamed first: another worker serving /metrics at once skips the file.
+            os.rename(path, claimed)
+        except OSError:
+            continue
+        try:
+            with open(claimed) as fh:
+                records = json.load(fh)
+        except (OSError, ValueError):
+            records = []
+        finally:
+            os.remove(claimed)
+        for kind, labels, seconds in records:
+            _SPOOLED[kind].labels(*labels).observe(seconds)
+
+
+def instrument_job(name):
+    """``instrument`` for the body of a background callback (a forked job process)."""
+    def decorator(func):
+        timed = instrument(name)(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global _pending
+            if 'PROMETHEUS_MULTIPROC_DIR' in os.environ or _spool_dir is None:
+                return timed(*args, **kwargs)
+            # This process ends with the job: its registry is never scraped.
+            _pending = []
+            try:
+                return timed(*args, **kwargs)
+            finally:
+                records, _pending = _pending, None
+                try:
+                    _write_spool(records)
+                except OSError:
+                    logger.exception('spooling the metrics of %s failed', name)
+        return wrapper
+    return decorator
+
+
+def record_startup(milestone):
+    """Record the time since the process started, the first time ``milestone`` is reached."""
+    if milestone in _milestones:
+        return
+    _milestones.add(milestone)
+    seconds = time.time() - psutil.Process().create_time()
+    STARTUP_SECONDS.labels(milestone).set(seconds)
+    logger.info('%s %.2f s after process start', milestone.replace('_', ' '), seconds)
+
+
+def _after_request(response):
+    record_startup('first_response')
+    record = g.pop('dwes_callback', None)
+    if record is None:
+        return response
+    name, started, returned, sampler = record
+    now = time.perf_counter()
+    STAGE_SECONDS.labels(name, 'serialise').observe(now - returned)
+    # Files (the exports) are streamed and only announce their length.
+    size = response.content_length if response.direct_passthrough else len(response.get_data())
+    if size is not None:
+        PAYLOAD_BYTES.labels(name).observe(size)
+    profiler.finish(sampler, name, now - started)
+    return response
+
+
+def _registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def register(server, spool_dir=None):
+    """Serve ``/metrics`` and record the serialisation stage of Dash callbacks.
+
+    ``spool_dir`` takes the observations of background jobs (see
+    ``instrument_job``); it must be shared by the workers of the host.
+    """
+    global _spool_dir
+    _spool_dir = spool_dir
+    server.after_request(_after_request)
+
+    @server.route('/metrics')
+    def metrics():
+        replay_spool()
+        return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+    return server
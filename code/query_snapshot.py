@@ -0,0 +1,308 @@
+"""Snapshot of a queryable source (see ``sources.SQLiteSource``).
+
+It answers the lookups the callbacks make on ``data_store.Snapshot`` - month,
+year to date and comparison aggregates, dealer series, export rows - but
+loads nothing up front. Each lookup runs indexed queries for the period or
+dealer asked for:
+
+* month summary, support averages and top dealers are ``GROUP BY`` /
+  ``ORDER BY ... LIMIT`` queries on the ``(period, total_points)`` index; the
+  rows of a month are only fetched when a grid pages through them
+* year to date sums the months of the year per dealer in the database
+* rolling sums and last year's points are aggregated per dealer over the
+  window, then ranked in memory like the in-memory view does
+* a dealer's series is a range scan of the ``(dealer_code, period)`` index;
+  the dealers compared at once are read in one query
+* the support group averages are one ``GROUP BY`` over the table, run on
+  first use
+* the alerts of a month score its rows and those of the history window before
+  it, read with the ``(period, total_points)`` index
+
+The results of the last lookups are kept per snapshot, so memory is bounded
+by that cache and not by the length of the history.
+
+Configuration (environment):
+
+* ``DWES_QUERY_CACHE_SIZE`` - periods (and dealers) kept per lookup, 64 by default
+"""
+import os
+import threading
+from collections.abc import Mapping
+
+import pandas as pd
+
+from aggregates import TOP_DEALERS, MonthAggregate, build_month_aggregates, summary_record
+from anomalies import HISTORY_WINDOW, ROW_COLUMNS, build_alerts
+from data_store import (DATA_COLUMNS, POINTS_COLUMNS, alert_export_rows, derive_frames, latest_period,
+                        year_to_date_export_rows)
+from dealer_index import GroupAverages, with_period_labels
+from figure_cache import MemoryBackend
+from history import (ROLLING_WINDOW, YEAR_LAST, YEAR_SUMS, Comparison, period_id, rank_rolling, year_over_year,
+                     year_to_date_rows)
+from row_model import RankedRows
+from schema import MONTHS, SCHEMA, apply_schema, empty_frame
+from sources import TABLE
+
+_RANKED = 'ORDER BY total_points DESC, rowid'
+
+
+class _Lookups(Mapping):
+    """Read-only mapping over known keys whose values are computed on first use."""
+
+    def __init__(self, keys, compute, size):
+        self._keys = list(keys)
+        self._known = set(self._keys)
+        self._compute = compute
+        self._cache = MemoryBackend(size)
+
+    def __getitem__(self, key):
+        if key not in self._known:
+            raise KeyError(key)
+        value = self._cache.get(key)
+        if value is None:
+            value = self._compute(*key)
+            self._cache.set(key, value)
+        return value
+
+    def __contains__(self, key):
+        return key in self._known
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class QueriedRows(RankedRows):
+    """Ranked rows of one month, queried when a grid first asks for a page."""
+
+    def __init__(self, query):
+        self._query = query
+        self._frame = None
+        super().__init__(None)
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            with self._lock:
+                if self._frame is None:
+                    self._frame = self._query()
+        return self._frame
+
+    @frame.setter
+    def frame(self, frame):
+        self._frame = frame
+
+
+class DealerSeries:
+    """``DealerIndex`` lookalike: a dealer's rows come from the dealer index of the table."""
+
+    def __init__(self, snapshot, size):
+        self._snapshot = snapshot
+        self._dealers = snapshot.query(f'SELECT DISTINCT dealer_code FROM {TABLE} WHERE {snapshot.active()} '
+                                       'ORDER BY dealer_code', snapshot.frozen_params)['dealer_code'].tolist()
+        self._known = set(self._dealers)
+        self._cache = MemoryBackend(size)
+
+    def __contains__(self, dealer):
+        return dealer in self._known
+
+    def __getitem__(self, dealer):
+        """Rows of ``dealer`` in calendar order."""
+        if dealer not in self._known:
+            raise KeyError(dealer)
+        return self.series([dealer])
+
+    def series(self, dealers):
+        """Rows of the known ``dealers``, dealer by dealer in the order given, each in calendar order."""
+        columns = ['dealer_code', 'warranty', 'year', 'month', *self._snapshot.dealer_columns]
+        dealers = [dealer for dealer in dealers if dealer in self._known]
+        if not dealers:
+            return with_period_labels(empty_frame()[columns])
+        frames = {dealer: self._cache.get(dealer) for dealer in dealers}
+        missing = [dealer for dealer, frame in frames.items() if frame is None]
+        if missing:
+            snapshot = self._snapshot
+            rows = snapshot.query(f'SELECT {", ".join(columns)} FROM {TABLE} '
+                                  f'WHERE dealer_code IN ({", ".join("?" * len(missing))}) '
+                                  f'AND {snapshot.active()} ORDER BY dealer_code, period',
+                                  (*missing, *snapshot.frozen_params))
+            rows = with_period_labels(apply_schema(rows)[columns])
+            codes = rows['dealer_code'].astype(str).to_numpy()
+            for dealer in missing:
+                frames[dealer] = rows[codes == dealer].reset_index(drop=True)
+                self._cache.set(dealer, frames[dealer])
+        return pd.concat([frames[dealer] for dealer in dealers], ignore_index=True)
+
+    def dealers(self):
+        return list(self._dealers)
+
+
+class QueriedGroupAverages(GroupAverages):
+    """Support group averages, queried on first use."""
+
+    def __init__(self, query):
+        self._query = query
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    super().__init__(self._query())
+                    self._loaded = True
+
+    def series(self, groups):
+        self._load()
+        return super().series(groups)
+
+
+class QuerySnapshot:
+    def __init__(self, source, manifest, dealer_columns, cache_size=None):
+        cache_size = cache_size or int(os.environ.get('DWES_QUERY_CACHE_SIZE', 64))
+        self.source = source
+        self.version = manifest['sha256']
+        self.fingerprints = manifest['sheets']
+        self.dealer_columns = dealer_columns
+        self.periods = [int(period) for period in manifest['sheets']]
+        self.freeze_rs = self.query(f"SELECT DISTINCT mobis_code FROM {TABLE} "
+                                    "WHERE instr(dealer_name, 'Freeze') > 0")['mobis_code'].tolist()
+        self.frozen_params = tuple(self.freeze_rs)
+        keys = [(period // 12, MONTHS[period % 12]) for period in self.periods]
+        self.month_aggregates = _Lookups(keys, self._month, cache_size)
+        self.ytd_aggregates = _Lookups(keys, self._year_to_date, cache_size)
+        self.comparisons = _Lookups(keys, self._comparison, cache_size)
+        self.alerts = _Lookups(keys, self._alerts, cache_size)
+        self.dealer_index = DealerSeries(self, cache_size)
+        self.group_averages = QueriedGroupAverages(self._group_averages)
+        self._dealers = self.query(f'SELECT DISTINCT dealer_code FROM {TABLE} WHERE dealer_code IS NOT NULL '
+                                   'ORDER BY dealer_code')['dealer_code'].tolist()
+
+    def query(self, sql, params=()):
+        return self.source.query(sql, params)
+
+    def active(self, table=''):
+        """Condition leaving out the freeze dealers."""
+        if not self.freeze_rs:
+            return '1'
+        return f'{table}mobis_code NOT IN ({", ".join("?" * len(self.freeze_rs))})'
+
+    def years(self):
+        return sorted({period // 12 for period in self.periods})
+
+    def months(self):
+        return [MONTHS[index] for index in sorted({period % 12 for period in self.periods})]
+
+    def dealers(self):
+        return list(self._dealers)
+
+    def latest(self):
+        """(year, month) of the most recent month loaded."""
+        return latest_period(self.month_aggregates)
+
+    def _month_rows(self, period, columns):
+        rows = self.query(f'SELECT {", ".join(columns)} FROM {TABLE} WHERE period = ? AND {self.active()} {_RANKED}',
+                          (period, *self.frozen_params))
+        return apply_schema(rows)[columns]
+
+    def _month(self, year, month):
+        period = period_id(year, month)
+        params = (period, *self.frozen_params)
+        summary = self.query(
+            'SELECT TOTAL(uio) AS uio, TOTAL(novs) AS novs, TOTAL(total_cost) AS total, '
+            'TOTAL(claim_qty) AS qty, TOTAL(m2_cost) AS m2, TOTAL(m2_qty) AS m2_qty, AVG(campaign) AS camp '
+            f'FROM {TABLE} WHERE period = ? AND {self.active()}', params)
+        support = self.query(
+            f'SELECT warranty, AVG(total_points) AS total_points FROM {TABLE} '
+            f'WHERE period = ? AND {self.active()} GROUP BY warranty ORDER BY warranty', params)
+        points_columns = POINTS_COLUMNS[2:]
+        top = self.query(f'SELECT {", ".join(points_columns)} FROM {TABLE} WHERE period = ? AND {self.active()} '
+                         f'{_RANKED} LIMIT {TOP_DEALERS}', params)
+        return MonthAggregate(summary=summary_record(next(summary.astype('float64').itertuples())),
+                              top_dealers=apply_schema(top)[points_columns],
+                              support=support,
+                              points=QueriedRows(lambda: self._month_rows(period, points_columns)),
+                              data=QueriedRows(lambda: self._month_rows(period, DATA_COLUMNS[2:-1])))
+
+    def _year_to_date(self, year, month):
+        sums = ', '.join(f'SUM({column}) AS {column}' for column in YEAR_SUMS)
+        inputs = self.query(
+            f'SELECT totals.dealer_code, {", ".join("totals." + column for column in YEAR_SUMS)}, '
+            f'{", ".join("latest." + column for column in YEAR_LAST)} '
+            f'FROM (SELECT dealer_code, {sums}, MAX(period) AS last_period, MIN(rowid) AS first_row '
+            f'      FROM {TABLE} WHERE period BETWEEN ? AND ? GROUP BY dealer_code) AS totals '
+            f'JOIN {TABLE} AS latest ON latest.dealer_code = totals.dealer_code '
+            'AND latest.period = totals.last_period ORDER BY first_row',
+            (period_id(year, MONTHS[0]), period_id(year, month)))
+        ytd = year_to_date_rows(inputs, year, month)
+        points, data = derive_frames(ytd, self.freeze_rs)
+        return build_month_aggregates(ytd, self.freeze_rs, points, data)[(year, month)]
+
+    def _comparison(self, year, month):
+        agg = self.month_aggregates[(year, month)]
+        previous_points = previous_support = None
+        if (year - 1, month) in self.month_aggregates:
+            codes = agg.top_dealers['dealer_code'].astype(str).tolist()
+            last_year = self.query(
+                f'SELECT dealer_code, total_points FROM {TABLE} WHERE period = ? '
+                f'AND dealer_code IN ({", ".join("?" * len(codes))})', (period_id(year - 1, month), *codes))
+            previous_points = pd.Series(last_year['total_points'].to_numpy(), index=last_year['dealer_code'])
+            support = self.month_aggregates[(year - 1, month)].support
+            previous_support = pd.Series(support['total_points'].to_numpy(), index=support['warranty'])
+        top_yoy, support_yoy = year_over_year(agg, previous_points, previous_support)
+        current = period_id(year, month)
+        rolling = self.query(
+            'SELECT cur.dealer_name, cur.dealer_code, cur.warranty, TOTAL(past.total_points) AS points '
+            f'FROM {TABLE} AS cur JOIN {TABLE} AS past ON past.dealer_code = cur.dealer_code '
+            f'AND past.period > ? AND past.period <= ? AND {self.active("past.")} '
+            f'WHERE cur.period = ? AND {self.active("cur.")} '
+            'GROUP BY cur.rowid ORDER BY cur.total_points DESC, cur.rowid',
+            (current - ROLLING_WINDOW, current, *self.frozen_params, current, *self.frozen_params))
+        top_rolling, support_rolling = rank_rolling(rolling, rolling['points'].to_numpy())
+        return Comparison(top_yoy, support_yoy, top_rolling, support_rolling)
+
+    def _group_averages(self):
+        columns = self.dealer_columns
+        averages = self.query(
+            f'SELECT warranty, year, month, {", ".join(f"AVG({column}) AS {column}" for column in columns)} '
+            f'FROM {TABLE} WHERE warranty IS NOT NULL AND {self.active()} GROUP BY warranty, period '
+            'ORDER BY warranty, period', self.frozen_params)
+        return with_period_labels(apply_schema(averages)[['warranty', 'year', 'month']].join(
+            averages[columns].astype('float64')))
+
+    def _alerts(self, year, month):
+        current = period_id(year, month)
+        rows = self.query(f'SELECT {", ".join(ROW_COLUMNS)} FROM {TABLE} WHERE period BETWEEN ? AND ? '
+                          f'AND {self.active()} ORDER BY period, rowid',
+                          (current - HISTORY_WINDOW, current, *self.frozen_params))
+        return build_alerts(apply_schema(rows), [], [(year, month)])[(year, month)]
+
+    def export_rows(self, tab=None, year=None, month=None, dealer=None, view=None, chunk_size=5000):
+        """``(columns, row count, chunks)`` of the rows behind ``tab`` matching the filters."""
+        if view == 'ytd' and tab in ('tab_1', 'tab_2'):
+            # One month of dealers, summed per dealer by the year-to-date lookup.
+            return year_to_date_export_rows(self, tab, year, month, dealer, chunk_size)
+        if tab == 'tab_4':
+            # The alerts of the month, scored by the alerts lookup.
+            return alert_export_rows(self, year, month, dealer, chunk_size)
+        columns = {'tab_1': POINTS_COLUMNS, 'tab_2': DATA_COLUMNS}.get(tab, list(SCHEMA))
+        conditions, params = [self.active()] if tab in ('tab_1', 'tab_2') else ['1'], []
+        if tab in ('tab_1', 'tab_2'):
+            params.extend(self.frozen_params)
+        if year is not None:
+            conditions.append('year = ?')
+            params.append(year)
+        if month:
+            conditions.append('month = ?')
+            params.append(month)
+        if dealer:
+            dealers = [dealer] if isinstance(dealer, str) else list(dealer)
+            conditions.append(f'dealer_code IN ({", ".join("?" * len(dealers))})')
+            params.extend(dealers)
+        where = ' AND '.join(conditions)
+        count = int(self.query(f'SELECT COUNT(*) AS n FROM {TABLE} WHERE {where}', params)['n'].iloc[0])
+        chunks = self.source.chunks(f'SELECT {", ".join(columns)} FROM {TABLE} WHERE {where} ORDER BY period, rowid',
+                                    params, chunk_size)
+        return columns, count, chunks
@@ -0,0 +1,122 @@
+"""Server side pages for AgGrid's infinite row model.
+
+The grids only ask for the block of rows they are about to show. Rows are
+kept pre-sorted by ``total_points`` (the default order of the tables), so an
+unsorted, unfiltered page is a positional slice; other orders are computed
+once per column and direction and reused.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+_TEXT_TESTS = {
+    'contains': lambda values, text: values.str.contains(text, regex=False),
+    'notContains': lambda values, text: ~values.str.contains(text, regex=False),
+    'equals': lambda values, text: values == text,
+    'notEqual': lambda values, text: values != text,
+    'startsWith': lambda values, text: values.str.startswith(text),
+    'endsWith': lambda values, text: values.str.endswith(text),
+}
+
+_NUMBER_TESTS = {
+    'equals': lambda values, a, b: values == a,
+    'notEqual': lambda values, a, b: values != a,
+    'lessThan': lambda values, a, b: values < a,
+    'lessThanOrEqual': lambda values, a, b: values <= a,
+    'greaterThan': lambda values, a, b: values > a,
+    'greaterThanOrEqual': lambda values, a, b: values >= a,
+    'inRange': lambda values, a, b: (values >= a) & (values <= b),
+}
+
+
+def _condition_mask(column, condition):
+    kind = condition.get('type')
+    if kind == 'blank':
+        return column.isna().to_numpy()
+    if kind == 'notBlank':
+        return column.notna().to_numpy()
+    if condition.get('filterType') == 'number':
+        test = _NUMBER_TESTS.get(kind)
+        if test is None or condition.get('filter') is None:
+            return np.ones(len(column), dtype=bool)
+        values = pd.to_numeric(column, errors='coerce')
+        return test(values, condition['filter'], condition.get('filterTo')).fillna(False).to_numpy(dtype=bool)
+    test = _TEXT_TESTS.get(kind)
+    if test is None or condition.get('filter') in (None, ''):
+        return np.ones(len(column), dtype=bool)
+    values = column.astype(str).str.lower()
+    return test(values, str(condition['filter']).lower()).fillna(False).to_numpy(dtype=bool)
+
+
+def _column_mask(column, model):
+    conditions = model.get('conditions')
+    if conditions is None and 'condition1' in model:
+        conditions = [model['condition1'], model['condition2']]
+    if conditions is None:
+        return _condition_mask(column, model)
+    masks = [_condition_mask(column, dict(condition, filterType=model.get('filterType')))
+             for condition in conditions]
+    return np.logical_or.reduce(masks) if model.get('operator') == 'OR' else np.logical_and.reduce(masks)
+
+
+def filter_mask(frame, filter_model):
+    mask = np.ones(len(frame), dtype=bool)
+    for field, model in (filter_model or {}).items():
+        if field in frame.columns:
+            mask &= _column_mask(frame[field], model)
+    return mask
+
+
+class RankedRows:
+    """Rows of one month, ordered by ``total_points`` descending."""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._orders = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def order(self, sort_model):
+        if not sort_model:
+            return np.arange(len(self.frame))
+        key = tuple((sort['colId'], sort['sort']) for sort in sort_model)
+        with self._lock:
+            order = self._orders.get(key)
+        if order is None:
+            columns = [column for column, _ in key if column in self.frame.columns]
+            ascending = [direction == 'asc' for column, direction in key if column in self.frame.columns]
+            if not columns:
+                return np.arange(len(self.frame))
+            ranked = self.frame.reset_index(drop=True).sort_values(columns, ascending=ascending, kind='stable')
+            order = ranked.index.to_numpy()
+            with self._lock:
+                self._orders[key] = order
+        return order
+
+    def page(self, request):
+        """Answer an AgGrid ``getRowsRequest`` with a column-oriented page.
+
+        ``{'fields', 'columns', 'rowCount'}`` holds one list of values per
+        field instead of one record per row, so field names are not repeated
+        on every row; the browser turns it back into ``rowData`` (see
+        ``assets/grid_pages.js``).
+        """
+        order = self.order(request.get('sortModel'))
+        if request.get('filterModel'):
+            order = order[filter_mask(self.frame, request['filterModel'])[order]]
+        start, end = request.get('startRow', 0), request.get('endRow', 100)
+        rows = self.frame.iloc[order[start:end]]
+        return {'fields': list(rows.columns),
+                'columns': [rows[field].tolist() for field in rows.columns],
+                'rowCount': len(order)}
+
+
+def number_filters(column_defs, frame):
+    """Use AgGrid's number filter for the numeric columns of ``frame``."""
+    return [dict(column, filter='agNumberColumnFilter')
+            if column['field'] in frame.columns and is_numeric_dtype(frame[column['field']]) else column
+            for column in column_defs]
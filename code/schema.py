@@ -0,0 +1,134 @@
+"""Declared in-memory schema of the dealer model.
+
+Only the columns the dashboard uses are kept. Codes and names are
+categoricals, the month is an ordered categorical (so charts and dropdowns
+follow the calendar, not the sheet order) and points, UIO and the counts are
+downcast. Money columns stay float64, their monthly sums reach 1e8 RUB, and
+so do the ratios and rates: float32 keeps 7 digits of them, and exports and
+the SQLite import would hand on 71.64869 for the workbook's 71.648689...
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+
+# 'Accumulative' is the year-to-date pseudo month of the total sheet.
+MONTH_DTYPE = pd.CategoricalDtype([*MONTHS, 'Accumulative'], ordered=True)
+
+CATEGORY_COLUMNS = ['dealer_name', 'mobis_code', 'dealer_code', 'region', 'warranty', 'dowt']
+
+MONEY_COLUMNS = ['m2_cost', 'parts_cost', 'total_cost', 'm2_cost_reg', 'parts_cost_reg', 'total_cost_reg']
+
+# Whole numbers with gaps: exact in float32.
+COUNT_COLUMNS = ['m2_qty', 'claim_qty', 'novs', 'sws']
+
+RATIO_COLUMNS = ['dm2pu', 'dcpu', 'cpc', 'rvs', 'dm2pu_reg', 'dcpu_reg', 'cpc_reg', 'rvs_reg',
+                 'campaign', 'campaign_reg', 'courtesy_car', 'sws_ratio', 'trp_2']
+
+POINT_COLUMNS = ['dm2pu_p', 'dcpu_p', 'cpc_p', 'rvs_p', 'campaign_p', 'courtesy_car_p',
+                 'trp_2_p', 'sws_p', 'dowt_p']
+
+SCHEMA = {
+    'year': 'int16',
+    'month': MONTH_DTYPE,
+    **{column: 'category' for column in CATEGORY_COLUMNS},
+    'uio': 'int32',
+    **{column: 'float64' for column in MONEY_COLUMNS},
+    **{column: 'float32' for column in COUNT_COLUMNS},
+    **{column: 'float64' for column in RATIO_COLUMNS},
+    **{column: 'int8' for column in POINT_COLUMNS},
+    'total_points': 'int16',
+}
+
+
+def _cast(values, dtype):
+    if isinstance(dtype, str) and dtype.startswith('int') and values.isna().any():
+        # Integer columns with gaps cannot use a numpy integer dtype.
+        return values.astype('float32')
+    return values.astype(dtype)
+
+
+def apply_schema(frame):
+    """Project ``frame`` on the declared columns and cast them."""
+    columns = [column for column in SCHEMA if column in frame.columns]
+    return pd.DataFrame({column: _cast(frame[column], SCHEMA[column]) for column in columns})
+
+
+def empty_frame():
+    """Frame without rows in the declared dtypes."""
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in SCHEMA.items()})
+
+
+def concat(frames):
+    """``pd.concat`` that keeps categorical columns categorical.
+
+    Frames read from different sheets carry different category sets, which
+    plain concatenation would silently turn back into object columns.
+    """
+    frames = list(frames)
+    result = pd.concat(frames, ignore_index=True)
+    for column in CATEGORY_COLUMNS:
+        if column in result.columns:
+            result[column] = union_categoricals([frame[column] for frame in frames])
+    return result
+
+
+def memory_usage(frames):
+    return int(np.sum([frame.memory_usage(index=True, deep=True).sum() for frame in frames]))
+
+
+def _root(array):
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def _arrays(frame):
+    for _, values in frame.items():
+        values = values.array
+        if isinstance(values, pd.Categorical):
+            yield values.codes
+            yield np.asarray(values.categories)
+        else:
+            yield np.asarray(values)
+    if not isinstance(frame.index, pd.RangeIndex):
+        yield np.asarray(frame.index)
+
+
+def footprint(value, seen=None):
+    """Bytes of the distinct numpy buffers reachable from ``value``.
+
+    Unlike ``memory_usage``, a buffer shared by several frames (a column
+    projection under copy-on-write, a slice) counts once. Frames, arrays,
+    tuples, lists, dicts and the attributes of other objects are followed;
+    the objects of object arrays (strings) count with their own size.
+    ``seen`` carries what was counted already from one call to the next.
+    """
+    seen = {} if seen is None else seen
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if isinstance(value, pd.DataFrame):
+        return sum(footprint(array, seen) for array in _arrays(value))
+    if isinstance(value, np.ndarray):
+        root = _root(value)
+        if id(root) in seen:
+            return 0
+        seen[id(root)] = root
+        objects = sum(sys.getsizeof(item) for item in root.ravel()) if root.dtype == object else 0
+        return root.nbytes + objects
+    if isinstance(value, (str, bytes)) or id(value) in seen:
+        return 0
+    if isinstance(value, dict):
+        seen[id(value)] = value
+        return sum(footprint(item, seen) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        seen[id(value)] = value
+        return sum(footprint(item, seen) for item in value)
+    if hasattr(value, '__dict__') and not callable(value):
+        seen[id(value)] = value
+        return sum(footprint(item, seen) for item in vars(value).values())
+    return 0
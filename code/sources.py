@@ -0,0 +1,247 @@
+"""Where the dealer rows come from.
+
+``DataStore`` reads its rows through a source:
+
+* ``ExcelSource`` - the master workbook, through the Feather cache of ``ingest``
+* ``ParquetSource`` - a directory with one Parquet file per month
+  (``2024-01.parquet`` ...), read through a memory map
+* ``SQLiteSource`` - a SQLite database with one row per dealer and month.
+  It is ``queryable``: instead of loading every row, the store runs the
+  filters and aggregates of the callbacks as indexed queries (see
+  ``query_snapshot``), so memory does not grow with the history.
+
+``open_source(location)`` picks one from a workbook path, a directory or a
+``sqlite:///path`` URL. The file sources have sheets (one per month in the
+workbook, one per file in the directory) and a manifest fingerprinting each,
+so a reload only reads what changed.
+
+Fill or update a database from a workbook or a Parquet directory with
+``python sources.py <workbook|directory> <database>``; months already in the
+database are replaced.
+
+Configuration (environment):
+
+* ``DWES_SQL_POOL_SIZE`` - connections per worker, 4 by default
+"""
+import contextlib
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+from ingest import cache_dir_for, ensure_cache, read_sheet
+from schema import MONTHS, SCHEMA, apply_schema
+
+SQLITE_PREFIX = 'sqlite:///'
+
+TABLE = 'dealer_months'
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ExcelSource:
+    queryable = False
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.cache_dir = cache_dir_for(workbook)
+
+    def __str__(self):
+        return self.workbook
+
+    def stat(self):
+        return _stat(self.workbook)
+
+    def manifest(self):
+        return ensure_cache(self.workbook, self.cache_dir)
+
+    def read(self, name):
+        return read_sheet(self.cache_dir, name)
+
+
+class ParquetSource:
+    queryable = False
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cache_dir = os.path.join(directory, 'cache')
+
+    def __str__(self):
+        return self.directory
+
+    def _files(self):
+        with os.scandir(self.directory) as it:
+            return sorted(entry.name for entry in it if entry.name.endswith('.parquet'))
+
+    def stat(self):
+        return tuple((name, _stat(os.path.join(self.directory, name))) for name in self._files())
+
+    def manifest(self):
+        # Names sort in calendar order (2024-01 ...), so a new month is appended last.
+        sheets = {}
+        for name in self._files():
+            mtime_ns, size = _stat(os.path.join(self.directory, name)) or (None, None)
+            sheets[name[:-len('.parquet')]] = {'mtime_ns': mtime_ns, 'size': size}
+        digest = hashlib.sha256(json.dumps(sheets, sort_keys=True).encode()).hexdigest()
+        return {'sha256': digest, 'sheets': sheets}
+
+    def read(self, name):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(os.path.join(self.directory, f'{name}.parquet'), memory_map=True)
+        return table.to_pandas(split_blocks=True)
+
+
+class ConnectionPool:
+    """Read-only SQLite connections shared by the threads of a worker."""
+
+    def __init__(self, path, size=4):
+        self.path = path
+        self.size = size
+        self._reset()
+        # Connections must not cross a fork (gunicorn --preload).
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _connect(self):
+        connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+        connection.execute('PRAGMA query_only = 1')
+        connection.execute('PRAGMA mmap_size = 268435456')
+        return connection
+
+    @contextlib.contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            finally:
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+
+def _columns_sql():
+    types = {column: 'TEXT' if dtype == 'category' or column == 'month'
+             else 'INTEGER' if str(dtype).startswith('int') else 'REAL'
+             for column, dtype in SCHEMA.items()}
+    return ', '.join(f'{column} {kind}' for column, kind in types.items())
+
+
+class SQLiteSource:
+    queryable = True
+
+    def __init__(self, path, pool_size=None):
+        self.path = path
+        self.cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), 'cache')
+        self.pool = ConnectionPool(path, pool_size or int(os.environ.get('DWES_SQL_POOL_SIZE', 4)))
+
+    def __str__(self):
+        return SQLITE_PREFIX + self.path
+
+    def stat(self):
+        return _stat(self.path), _stat(f'{self.path}-wal')
+
+    def query(self, sql, params=()):
+        """Run ``sql`` and return the result as a DataFrame."""
+        with self.pool.connection() as connection:
+            cursor = connection.execute(sql, params)
+            columns = [description[0] for description in cursor.description]
+            return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+
+    def chunks(self, sql, params=(), chunk_size=5000):
+        """Yield the result of ``sql`` as DataFrames of ``chunk_size`` rows."""
+        with self.pool.connection() as connection:
+            cursor = connection.execute(sql, params)
+            columns = [description[0] for description in cursor.description]
+            while True:
+                records = cursor.fetchmany(chunk_size)
+                if not records:
+                    return
+                yield pd.DataFrame.from_records(records, columns=columns)
+
+    def manifest(self):
+        loads = self.query('SELECT period, fingerprint FROM loads ORDER BY period')
+        sheets = dict(zip(loads['period'].astype(str), loads['fingerprint']))
+        digest = hashlib.sha256(json.dumps(sheets).encode()).hexdigest()
+        return {'sha256': digest, 'sheets': sheets}
+
+    @staticmethod
+    def create(path):
+        with contextlib.closing(sqlite3.connect(path)) as connection, connection:
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute(f'CREATE TABLE IF NOT EXISTS {TABLE} (period INTEGER NOT NULL, {_columns_sql()})')
+            # Months are read ranked by points; dealer series by dealer and period.
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_period ON {TABLE} (period, total_points DESC)')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_dealer ON {TABLE} (dealer_code, period)')
+            connection.execute('CREATE TABLE IF NOT EXISTS loads (period INTEGER PRIMARY KEY, year INTEGER, '
+                               'month TEXT, rows INTEGER, fingerprint TEXT)')
+
+    @staticmethod
+    def write(path, frame):
+        """Store the months of ``frame`` (scored rows), replacing those already stored."""
+        frame = apply_schema(frame)
+        periods = frame['year'].to_numpy(dtype='int64') * 12 + pd.Categorical(
+            frame['month'], categories=MONTHS).codes
+        columns = [column for column in SCHEMA if column in frame.columns]
+        records = frame[columns].astype(object).where(frame[columns].notna(), None)
+        with contextlib.closing(sqlite3.connect(path)) as connection, connection:
+            for period in np.unique(periods):
+                rows = records[periods == period]
+                fingerprint = hashlib.sha256(pd.util.hash_pandas_object(rows, index=False).to_numpy()).hexdigest()
+                connection.execute(f'DELETE FROM {TABLE} WHERE period = ?', (int(period),))
+                connection.executemany(
+                    f'INSERT INTO {TABLE} (period, {", ".join(columns)}) '
+                    f'VALUES (?, {", ".join("?" * len(columns))})',
+                    ((int(period), *row) for row in rows.itertuples(index=False, name=None)))
+                connection.execute('INSERT OR REPLACE INTO loads VALUES (?, ?, ?, ?, ?)',
+                                   (int(period), int(period) // 12, MONTHS[int(period) % 12], len(rows),
+                                    fingerprint))
+
+
+def open_source(location):
+    """Source for a workbook path, a Parquet directory or a ``sqlite:///`` URL."""
+    if location.startswith(SQLITE_PREFIX):
+        return SQLiteSource(location[len(SQLITE_PREFIX):])
+    if os.path.isdir(location):
+        return ParquetSource(location)
+    return ExcelSource(location)
+
+
+def import_source(source, path):
+    """Copy the monthly rows of a file ``source`` into the database at ``path``."""
+    from history import is_total_sheet
+    from kpi_engine import compute_kpis, needs_kpis
+
+    SQLiteSource.create(path)
+    for name in source.manifest()['sheets']:
+        rows = source.read(name)
+        if needs_kpis(rows):
+            rows = compute_kpis(rows)
+        if not is_total_sheet(rows):
+            SQLiteSource.write(path, rows)
+
+
+if __name__ == '__main__':
+    source, database = open_source(sys.argv[1]), sys.argv[2]
+    import_source(source, database)
+    print(f'imported {source} into {database}')
@@ -0,0 +1,41 @@
+"""Shared fixtures: a small synthetic master workbook and its snapshots.
+
+The modules of the app are imported from the code directory, like
+``app_test`` does when it is run from there.
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
+
+from benchmarks.synthetic import write_workbook  # noqa: E402
+from data_store import DataStore  # noqa: E402
+from sources import import_source, open_source  # noqa: E402
+
+# Like app_test: derived frames share the buffers of dash_tab.
+pd.set_option('mode.copy_on_write', True)
+
+SHIPPED_WORKBOOK = os.path.join(CODE_DIR, '..', 'data', 'dwcc_master_git_model.xlsx')
+DEALER_COLUMNS = ['total_points', 'rvs', 'rvs_reg', 'uio']
+
+
+@pytest.fixture(scope='session')
+def workbook(tmp_path_factory):
+    """60 dealers over 2022 and 2023: a sheet per month and a total sheet per year."""
+    return write_workbook(str(tmp_path_factory.mktemp('workbook') / 'model.xlsx'), dealers=60, years=2)
+
+
+@pytest.fixture(scope='session')
+def snapshot(workbook):
+    return DataStore(open_source(workbook), DEALER_COLUMNS).load()
+
+
+@pytest.fixture(scope='session')
+def query_snapshot(workbook, tmp_path_factory):
+    database = str(tmp_path_factory.mktemp('sqlite') / 'model.db')
+    import_source(open_source(workbook), database)
+    return DataStore(open_source('sqlite:///' + database), DEALER_COLUMNS).load()
@@ -0,0 +1,75 @@
+"""Requests against the app, run on the synthetic workbook."""
+import importlib
+import os
+import time
+
+import pytest
+
+from benchmarks.bench_app import update_payload
+
+
+@pytest.fixture(scope='module')
+def app_test(workbook, tmp_path_factory):
+    directory = tmp_path_factory.mktemp('app')
+    environ = {'DWES_DATA_SOURCE': workbook, 'DWES_RELOAD_INTERVAL': '0',
+               'DWES_EXPORT_DIR': str(directory / 'exports'), 'DWES_JOBS_DIR': str(directory / 'jobs')}
+    saved = {name: os.environ.get(name) for name in environ}
+    os.environ.update(environ)
+    try:
+        yield importlib.import_module('app_test')
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def export(app_test, client, clicks, fmt='csv'):
+    """Click Export (the points of May 2023) and wait for the link."""
+    body = update_payload(app_test.app, 'prepare_export', [clicks],
+                          [2023, 'May', 'tab_1', None, [], fmt, 'month'])
+    started = client.post('/_dash-update-component', json=body).json
+    for _ in range(300):
+        polled = client.post(f"/_dash-update-component?cacheKey={started['cacheKey']}&job={started['job']}",
+                             json=body).json
+        if 'response' in polled:
+            return started['job'], polled['response']['export_link']['href']
+        time.sleep(0.1)
+    raise TimeoutError('the export job did not finish')
+
+
+def test_export_again_after_the_file_was_pruned(app_test):
+    client = app_test.server.test_client()
+    job, href = export(app_test, client, 1)
+    assert job and client.get(href).status_code == 200
+    # A repeated click is answered from the stored result, without a job.
+    assert export(app_test, client, 2) == (0, href)
+
+    max_files, app_test.exporter.max_files = app_test.exporter.max_files, 0
+    app_test.exporter._prune()
+    app_test.exporter.max_files = max_files
+    assert client.get(href).status_code == 404
+    # The stored result links to the pruned file: the export runs again.
+    job, again = export(app_test, client, 3)
+    assert job and again == href
+    assert client.get(href).status_code == 200
+
+
+def test_export_job_timings_reach_the_metrics(app_test):
+    from prometheus_client import REGISTRY
+
+    samples = {'dwes_callback_seconds_count': {'callback': 'prepare_export', 'outcome': 'ok'},
+               'dwes_callback_stage_seconds_count': {'callback': 'prepare_export', 'stage': 'write'}}
+
+    def counts():
+        client.get('/metrics')
+        return {name: REGISTRY.get_sample_value(name, labels) or 0 for name, labels in samples.items()}
+
+    client = app_test.server.test_client()
+    before = counts()
+    job, href = export(app_test, client, 1, fmt='parquet')
+    assert job
+    # The job ran in its own process; /metrics replays its timings once.
+    assert counts() == {name: count + 1 for name, count in before.items()}
+    assert counts() == {name: count + 1 for name, count in before.items()}
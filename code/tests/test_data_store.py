@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_store
+from anomalies import ALERT_COLUMNS
+from conftest import DEALER_COLUMNS
+from data_store import DataStore, append_sheets, build_snapshot
+from sources import open_source
+
+MANIFEST = {'sha256': 'test', 'sheets': {}}
+
+
+def assert_rows_equal(actual, expected):
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def assert_same_snapshot(actual, expected):
+    assert sorted(actual.month_aggregates) == sorted(expected.month_aggregates)
+    for key, agg in expected.month_aggregates.items():
+        assert actual.month_aggregates[key].summary == pytest.approx(agg.summary, nan_ok=True)
+        assert_rows_equal(actual.month_aggregates[key].top_dealers, agg.top_dealers)
+        assert_rows_equal(actual.month_aggregates[key].support, agg.support)
+        assert_rows_equal(actual.month_aggregates[key].points.frame, agg.points.frame)
+        assert_rows_equal(actual.month_aggregates[key].data.frame, agg.data.frame)
+    np.testing.assert_array_equal(actual.history.period_ids, expected.history.period_ids)
+    np.testing.assert_allclose(actual.history.cumulative, expected.history.cumulative)
+    for key, comparison in expected.comparisons.items():
+        for field in comparison._fields:
+            assert_rows_equal(getattr(actual.comparisons[key], field), getattr(comparison, field))
+    assert sorted(actual.ytd_aggregates) == sorted(expected.ytd_aggregates)
+    for key, agg in expected.ytd_aggregates.items():
+        assert actual.ytd_aggregates[key].summary == pytest.approx(agg.summary, nan_ok=True)
+        assert_rows_equal(actual.ytd_aggregates[key].top_dealers, agg.top_dealers)
+    assert sorted(actual.alerts) == sorted(expected.alerts)
+    for key, alerts in expected.alerts.items():
+        assert_rows_equal(actual.alerts[key].frame, alerts.frame)
+    assert_rows_equal(actual.dealer_index.frame, expected.dealer_index.frame)
+    assert_rows_equal(actual.group_averages.frame, expected.group_averages.frame)
+
+
+@pytest.fixture(scope='module')
+def sheets(workbook):
+    store = DataStore(open_source(workbook), DEALER_COLUMNS)
+    return {name: store._read(name)[1] for name in store.source.manifest()['sheets']}
+
+
+def test_append_matches_full_build(sheets):
+    full = build_snapshot(MANIFEST, sheets, DEALER_COLUMNS)
+    previous = build_snapshot(MANIFEST, {name: sheet for name, sheet in sheets.items() if name != 'dec_2023'},
+                              DEALER_COLUMNS)
+    appended = append_sheets(previous, MANIFEST, {'dec_2023': sheets['dec_2023']}, DEALER_COLUMNS)
+    assert_same_snapshot(appended, full)
+    assert appended.month_names == full.month_names
+
+
+def test_append_refuses_an_older_month(sheets):
+    # An older month changes the running totals of the later ones.
+    previous = build_snapshot(MANIFEST, {name: sheet for name, sheet in sheets.items() if name != 'mar_2022'},
+                              DEALER_COLUMNS)
+    assert append_sheets(previous, MANIFEST, {'mar_2022': sheets['mar_2022']}, DEALER_COLUMNS) is None
+
+
+def test_total_sheets_are_not_loaded(snapshot):
+    assert (snapshot.dash_tab['month'] != 'Accumulative').all()
+    assert len(snapshot.month_aggregates) == 24
+
+
+def _write_workbook(path, sheets):
+    with pd.ExcelWriter(path) as writer:
+        for name, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=name, index=False)
+
+
+def test_refresh_appends_a_month_inserted_before_the_totals(workbook, tmp_path, monkeypatch):
+    sheets = pd.read_excel(workbook, sheet_name=None)
+    path = str(tmp_path / 'model.xlsx')
+    _write_workbook(path, {name: sheet for name, sheet in sheets.items() if name != 'dec_2023'})
+    store = DataStore(open_source(path), DEALER_COLUMNS)
+    store.load()
+
+    # The month goes in before the totals, and the total of its year is saved again.
+    updated = {}
+    for name, sheet in sheets.items():
+        if name == 'dec_2023':
+            continue
+        if name == 'total_2022':
+            updated['dec_2023'] = sheets['dec_2023']
+        updated[name] = sheet.assign(uio=sheet['uio'] + 1) if name == 'total_2023' else sheet
+    os.utime(path, (time.time() + 1, time.time() + 1))
+    _write_workbook(path, updated)
+    calls = []
+    monkeypatch.setattr(data_store, 'build_snapshot', lambda *args: calls.append('build'))
+    assert store.refresh()
+    assert calls == []
+    assert store.current.latest() == (2023, 'December')
+    monkeypatch.undo()
+    full = DataStore(open_source(path), DEALER_COLUMNS).load()
+    assert_rows_equal(store.current.month_aggregates[(2023, 'December')].top_dealers,
+                      full.month_aggregates[(2023, 'December')].top_dealers)
+
+
+def test_refresh_waits_for_the_first_load(workbook):
+    store = DataStore(open_source(workbook), DEALER_COLUMNS)
+    assert not store.refresh()
+    assert not store.loaded
+
+
+def test_refresh_rebuilds_after_an_edited_month(workbook, tmp_path):
+    sheets = pd.read_excel(workbook, sheet_name=None)
+    path = str(tmp_path / 'model.xlsx')
+    _write_workbook(path, sheets)
+    store = DataStore(open_source(path), DEALER_COLUMNS)
+    store.load()
+    sheets['feb_2022'] = sheets['feb_2022'].assign(uio=sheets['feb_2022']['uio'] * 2)
+    _write_workbook(path, sheets)
+    assert store.refresh()
+    assert_same_snapshot(store.current, DataStore(open_source(path), DEALER_COLUMNS).load())
+
+
+def test_exports_keep_the_workbook_values(workbook, snapshot):
+    expected = pd.read_excel(workbook, sheet_name='may_2023').set_index('dealer_code')
+    columns, count, chunks = snapshot.export_rows('tab_2', 2023, 'May')
+    actual = pd.concat(list(chunks)).set_index('dealer_code')
+    for column in ['campaign', 'dm2pu', 'cpc', 'rvs', 'courtesy_car']:
+        np.testing.assert_array_equal(actual[column].to_numpy(), expected.loc[actual.index, column].to_numpy())
+
+
+def test_year_to_date_export_names_its_period(snapshot):
+    columns, count, chunks = snapshot.export_rows('tab_1', 2023, 'May', view='ytd')
+    rows = pd.concat(list(chunks))
+    assert columns[:2] == ['year', 'month'] and count == len(snapshot.ytd_aggregates[(2023, 'May')].points)
+    assert (rows['year'] == 2023).all() and (rows['month'] == 'May').all()
+    assert_rows_equal(rows.drop(columns=['year', 'month']), snapshot.ytd_aggregates[(2023, 'May')].points.frame)
+
+
+def test_alert_export_lists_the_alerts_of_the_month(snapshot):
+    alerts = snapshot.alerts[(2023, 'December')].frame
+    assert len(alerts)
+    columns, count, chunks = snapshot.export_rows('tab_4', 2023, 'December')
+    rows = pd.concat(list(chunks))
+    assert columns == ['year', 'month', *ALERT_COLUMNS] and count == len(alerts)
+    assert (rows['year'] == 2023).all() and (rows['month'] == 'December').all()
+    assert_rows_equal(rows[ALERT_COLUMNS], alerts)
+    dealer = alerts['dealer_code'].iloc[0]
+    columns, count, chunks = snapshot.export_rows('tab_4', 2023, 'December', dealer=dealer)
+    assert count == (alerts['dealer_code'] == dealer).sum()
+
+
+def test_watcher_retries_a_failed_refresh(workbook, monkeypatch):
+    store = DataStore(open_source(workbook), DEALER_COLUMNS)
+    calls = []
+
+    def refresh():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise ValueError('half written')
+        return True
+
+    monkeypatch.setattr(store, 'refresh', refresh)
+    threading.Thread(target=store._watch, args=(0.01,), daemon=True).start()
+    deadline = time.monotonic() + 5
+    while len(calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    # Retried although the file did not change again, then left alone.
+    assert len(calls) == 2
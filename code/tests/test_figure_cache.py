@@ -0,0 +1,145 @@
+"""Eviction and memoisation of the figure cache."""
+import os
+
+import pytest
+from dash.exceptions import PreventUpdate
+
+import figure_cache
+from conftest import DEALER_COLUMNS
+from data_store import DataStore
+from figure_cache import FigureCache, FileSystemBackend, MemoryBackend
+from sources import open_source
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(figure_cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(maxsize=2)
+    backend.set('a', '1')
+    backend.set('b', '2')
+    assert backend.get('a') == '1'
+    backend.set('c', '3')
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == ('1', None, '3')
+    assert len(backend) == 2
+
+
+def test_memory_backend_expires_entries(clock):
+    backend = MemoryBackend(maxsize=2, ttl=10)
+    backend.set('a', '1')
+    clock.now += 10
+    assert backend.get('a') == '1'
+    clock.now += 1
+    assert backend.get('a') is None
+    assert len(backend) == 0
+
+
+def _age(backend, key, seconds):
+    path = backend._path(key)
+    mtime = os.path.getmtime(path) - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_file_system_backend_prunes_least_recently_used(tmp_path):
+    backend = FileSystemBackend(str(tmp_path), maxsize=2)
+    backend.set('a', '1')
+    backend.set('b', '2')
+    _age(backend, 'a', 20)
+    _age(backend, 'b', 10)
+    assert backend.get('a') == '1'
+    backend.set('c', '3')
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == ('1', None, '3')
+    assert len(backend) == 2
+
+
+def test_file_system_backend_expires_entries(tmp_path):
+    backend = FileSystemBackend(str(tmp_path), maxsize=2, ttl=60)
+    backend.set('a', '1')
+    assert backend.get('a') == '1'
+    _age(backend, 'a', 61)
+    assert backend.get('a') is None
+    assert len(backend) == 0
+
+
+def test_memoize(tmp_path):
+    version = ['loaded']
+    cache = FigureCache(maxsize=4, directory=str(tmp_path), version=lambda: version[0])
+    calls = []
+
+    @cache.memoize('figure')
+    def figure(year, month):
+        calls.append((year, month))
+        return {'data': [], 'layout': {'title': f'{month} {year}'}}
+
+    assert figure(2023, 'May') == figure(2023, 'May') == {'data': [], 'layout': {'title': 'May 2023'}}
+    assert calls == [(2023, 'May')]
+    figure(2023, 'June')
+    assert len(calls) == 2
+    # Another worker finds the entry in the shared directory.
+    cache.local.clear()
+    figure(2023, 'May')
+    assert len(calls) == 2 and cache.shared_hits == 1
+    # New data: the same inputs are computed again.
+    version[0] = 'reloaded'
+    figure(2023, 'May')
+    assert len(calls) == 3
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_keys_carry_the_version_of_lazily_loaded_data(workbook, tmp_path):
+    store = DataStore(open_source(workbook), DEALER_COLUMNS)
+    cache = FigureCache(maxsize=4, directory=str(tmp_path), version=lambda: store.current.version)
+
+    @cache.memoize('figure')
+    def figure(year):
+        return {'year': year, 'rows': len(store.current.dash_tab)}
+
+    assert not store.loaded
+    figure(2023)
+    assert store.loaded and cache.stats()['version'] == store.current.version
+    assert os.listdir(tmp_path) == [cache.key('figure', (2023,)) + '.json']
+    # A worker that has not loaded, or a restart on another workbook, misses the entry.
+    for version in ('', 'another workbook'):
+        other = FigureCache(maxsize=4, directory=str(tmp_path), version=lambda: version)
+        assert other.get(other.key('figure', (2023,))) is None
+
+
+def test_memoize_does_not_cache_errors():
+    cache = FigureCache(maxsize=4)
+    calls = []
+
+    @cache.memoize('figure')
+    def figure(year):
+        calls.append(year)
+        raise PreventUpdate
+
+    for _ in range(2):
+        with pytest.raises(PreventUpdate):
+            figure(2023)
+    assert calls == [2023, 2023] and len(cache.local) == 0
+
+
+def test_disabled_cache():
+    cache = FigureCache(maxsize=0, directory='unused')
+    calls = []
+
+    @cache.memoize('figure')
+    def figure(year):
+        calls.append(year)
+        return {'year': year}
+
+    figure(2023)
+    figure(2023)
+    assert calls == [2023, 2023] and cache.shared is None and len(cache.local) == 0
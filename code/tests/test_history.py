@@ -0,0 +1,53 @@
+"""Running totals give the same rolling sums as adding up the months."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from history import History, period_id
+from schema import MONTHS
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(1)
+    rows = [(year, month, f'D{dealer}', float(rng.integers(0, 60)))
+            for year in (2021, 2022, 2023) for month in MONTHS for dealer in range(5)
+            # Dealers come and go: D4 only appears from 2022 on, D3 skips some months.
+            if not (dealer == 4 and year == 2021) and not (dealer == 3 and rng.random() < 0.3)]
+    return pd.DataFrame(rows, columns=['year', 'month', 'dealer_code', 'total_points'])
+
+
+def brute_force(points, year, month, code, window):
+    ids = points['year'] * 12 + points['month'].map(MONTHS.index)
+    current = period_id(year, month)
+    rows = points[(points['dealer_code'] == code) & (ids > current - window) & (ids <= current)]
+    return rows['total_points'].sum()
+
+
+@pytest.mark.parametrize('window', [1, 3, 12])
+def test_rolling_sums(points, window):
+    history = History.build(points)
+    codes = ['D0', 'D3', 'D4']
+    for year, month in [(2021, 'January'), (2021, 'December'), (2022, 'May'), (2023, 'December')]:
+        expected = [brute_force(points, year, month, code, window) for code in codes]
+        np.testing.assert_allclose(history.rolling(year, month, codes, window=window), expected)
+
+
+def test_extend_matches_build(points):
+    ids = points['year'] * 12 + points['month'].map(MONTHS.index)
+    # Months one at a time and several at once, as appended sheets arrive.
+    bounds = [period_id(2022, 'July'), period_id(2022, 'August'), period_id(2023, 'January'), ids.max() + 1]
+    history = History.build(points[ids < bounds[0]])
+    for start, end in zip(bounds, bounds[1:]):
+        history = history.extend(points[(ids >= start) & (ids < end)])
+        built = History.build(points[ids < end])
+        np.testing.assert_array_equal(history.period_ids, built.period_ids)
+        year, month = divmod(int(end) - 1, 12)
+        np.testing.assert_allclose(history.rolling(year, MONTHS[month], built.codes),
+                                   built.rolling(year, MONTHS[month], built.codes))
+
+
+def test_extend_refuses_earlier_months(points):
+    history = History.build(points[points['year'] == 2022])
+    assert history.extend(points[points['year'] == 2021]) is None
+    assert history.extend(points[(points['year'] == 2022) & (points['month'] == 'December')]) is None
@@ -0,0 +1,30 @@
+"""The KPI engine reproduces the computed columns of the master workbook."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import SHIPPED_WORKBOOK
+from kpi_engine import _round2, compute_kpis, needs_kpis, validate_kpis
+
+SHEETS = pd.read_excel(SHIPPED_WORKBOOK, sheet_name=None)
+
+
+@pytest.mark.parametrize('name', sorted(SHEETS))
+def test_shipped_sheets_are_reproduced(name):
+    assert validate_kpis(SHEETS[name]) == []
+
+
+def test_round2_rounds_like_python():
+    values = np.array([43 / 40, 1.005, 2.675, 0.125, np.nan])
+    expected = [round(value, 2) for value in values[:-1].tolist()]
+    np.testing.assert_array_equal(_round2(values)[:-1], expected)
+    assert _round2(values)[0] == 1.07
+    assert np.isnan(_round2(values)[-1])
+
+
+def test_raw_sheets_are_scored():
+    sheet = SHEETS['mar']
+    raw = sheet.drop(columns=[column for column in sheet.columns if column.endswith(('_p', '_reg'))]
+                     + ['dm2pu', 'dcpu', 'cpc', 'rvs', 'sws_ratio', 'total_points'])
+    assert needs_kpis(raw) and not needs_kpis(sheet)
+    np.testing.assert_allclose(compute_kpis(raw)['total_points'], sheet['total_points'])
@@ -0,0 +1,73 @@
+"""The SQLite snapshot answers every lookup like the in-memory one."""
+import pandas as pd
+import pytest
+
+KEYS = [(2022, 'March'), (2023, 'January'), (2023, 'December')]
+
+
+def plain(frame):
+    # SQLite hands back text where the in-memory frames hold categoricals.
+    frame = frame.reset_index(drop=True)
+    return frame.astype({column: str for column in frame.columns if frame[column].dtype == 'category'})
+
+
+def assert_rows_equal(actual, expected):
+    pd.testing.assert_frame_equal(plain(actual), plain(expected), check_dtype=False, atol=1e-6)
+
+
+def test_catalogue(snapshot, query_snapshot):
+    assert query_snapshot.latest() == snapshot.latest()
+    assert query_snapshot.years() == snapshot.years()
+    assert query_snapshot.months() == snapshot.months()
+    assert query_snapshot.dealers() == snapshot.dealers()
+    assert sorted(query_snapshot.month_aggregates) == sorted(snapshot.month_aggregates)
+
+
+@pytest.mark.parametrize('key', KEYS)
+def test_month_aggregates(snapshot, query_snapshot, key):
+    expected, actual = snapshot.month_aggregates[key], query_snapshot.month_aggregates[key]
+    assert actual.summary == pytest.approx(expected.summary, nan_ok=True)
+    assert_rows_equal(actual.top_dealers, expected.top_dealers)
+    assert_rows_equal(actual.support, expected.support)
+    assert_rows_equal(actual.points.frame, expected.points.frame)
+    assert_rows_equal(actual.data.frame, expected.data.frame)
+
+
+@pytest.mark.parametrize('key', KEYS)
+def test_year_to_date_and_comparisons(snapshot, query_snapshot, key):
+    expected, actual = snapshot.ytd_aggregates[key], query_snapshot.ytd_aggregates[key]
+    assert actual.summary == pytest.approx(expected.summary, nan_ok=True)
+    assert_rows_equal(actual.top_dealers, expected.top_dealers)
+    assert_rows_equal(actual.points.frame, expected.points.frame)
+    for field in snapshot.comparisons[key]._fields:
+        assert_rows_equal(getattr(query_snapshot.comparisons[key], field), getattr(snapshot.comparisons[key], field))
+
+
+@pytest.mark.parametrize('key', KEYS)
+def test_alerts(snapshot, query_snapshot, key):
+    assert_rows_equal(query_snapshot.alerts[key].frame, snapshot.alerts[key].frame)
+
+
+def test_dealer_series_and_group_averages(snapshot, query_snapshot):
+    dealer = snapshot.dealers()[5]
+    assert_rows_equal(query_snapshot.dealer_index[dealer], snapshot.dealer_index[dealer])
+    dealers = snapshot.dealers()[3:7]
+    series = snapshot.dealer_index.series(dealers)
+    assert_rows_equal(query_snapshot.dealer_index.series(dealers), series)
+    groups = series['warranty'].astype(str).unique().tolist()
+    assert_rows_equal(query_snapshot.group_averages.series(groups), snapshot.group_averages.series(groups))
+
+
+@pytest.mark.parametrize('tab, view', [('tab_1', None), ('tab_2', None), ('tab_4', None), (None, None), ('tab_1', 'ytd')])
+def test_export_rows(snapshot, query_snapshot, tab, view):
+    dealers = snapshot.dealers()[:3]
+    for filters in ({'year': 2023, 'month': 'May'}, {'dealer': dealers},
+                    {'year': 2023, 'month': 'May', 'dealer': dealers[0]}):
+        expected_columns, expected_count, expected = snapshot.export_rows(tab, view=view, **filters)
+        columns, count, chunks = query_snapshot.export_rows(tab, view=view, **filters)
+        assert (columns, count) == (expected_columns, expected_count)
+        if count:
+            # The same rows; the in-memory grids of a month are ranked, the queried rows in table order.
+            actual, expected = plain(pd.concat(list(chunks))), plain(pd.concat(list(expected)))
+            order = [column for column in ('year', 'month', 'dealer_code', 'kpi') if column in columns]
+            assert_rows_equal(actual.sort_values(order), expected.sort_values(order))
@@ -0,0 +1,81 @@
+"""Pages of the infinite row model: AgGrid's filter and sort models."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from row_model import RankedRows, filter_mask
+
+FRAME = pd.DataFrame({
+    'dealer_name': pd.Categorical(['Alpha Motors', 'beta auto', 'Gamma', 'Delta Motors', None]),
+    'total_points': [40.0, 25.0, np.nan, 10.0, 5.0],
+})
+
+
+def matches(filter_model):
+    return FRAME.index[filter_mask(FRAME, filter_model)].tolist()
+
+
+def text(kind, value=None):
+    return {'filterType': 'text', 'type': kind, 'filter': value}
+
+
+def number(kind, value=None, to=None):
+    return {'filterType': 'number', 'type': kind, 'filter': value, 'filterTo': to}
+
+
+@pytest.mark.parametrize('condition, expected', [
+    (text('contains', 'MOTORS'), [0, 3]),
+    (text('notContains', 'motors'), [1, 2, 4]),
+    (text('equals', 'Gamma'), [2]),
+    (text('notEqual', 'gamma'), [0, 1, 3, 4]),
+    (text('startsWith', 'BETA'), [1]),
+    (text('endsWith', 'a'), [2]),
+    (text('contains', ''), [0, 1, 2, 3, 4]),
+    (text('blank'), [4]),
+    (text('notBlank'), [0, 1, 2, 3]),
+])
+def test_text_filters(condition, expected):
+    assert matches({'dealer_name': condition}) == expected
+
+
+@pytest.mark.parametrize('condition, expected', [
+    (number('equals', 25), [1]),
+    (number('notEqual', 25), [0, 2, 3, 4]),
+    (number('lessThan', 25), [3, 4]),
+    (number('lessThanOrEqual', 25), [1, 3, 4]),
+    (number('greaterThan', 25), [0]),
+    (number('greaterThanOrEqual', 25), [0, 1]),
+    (number('inRange', 5, 25), [1, 3, 4]),
+    (number('greaterThan'), [0, 1, 2, 3, 4]),
+    (number('blank'), [2]),
+    (number('notBlank'), [0, 1, 3, 4]),
+])
+def test_number_filters(condition, expected):
+    assert matches({'total_points': condition}) == expected
+
+
+def test_combined_conditions():
+    conditions = [number('lessThan', 8), number('greaterThan', 30)]
+    assert matches({'total_points': {'filterType': 'number', 'operator': 'OR', 'conditions': conditions}}) == [0, 4]
+    assert matches({'total_points': {'filterType': 'number', 'operator': 'AND', 'conditions': conditions}}) == []
+    # Older AgGrid versions send two numbered conditions.
+    legacy = {'filterType': 'text', 'operator': 'AND',
+              'condition1': text('contains', 'motors'), 'condition2': text('startsWith', 'd')}
+    assert matches({'dealer_name': legacy}) == [3]
+
+
+def test_filters_on_several_and_unknown_columns():
+    assert matches({'dealer_name': text('contains', 'a'), 'total_points': number('greaterThan', 20),
+                    'region': text('equals', 'south')}) == [0, 1]
+    assert matches(None) == [0, 1, 2, 3, 4]
+
+
+def test_page():
+    rows = RankedRows(FRAME)
+    page = rows.page({'startRow': 1, 'endRow': 3, 'sortModel': [{'colId': 'total_points', 'sort': 'asc'}],
+                      'filterModel': {'total_points': number('notBlank')}})
+    assert page['fields'] == ['dealer_name', 'total_points']
+    assert page['columns'] == [['Delta Motors', 'beta auto'], [10.0, 25.0]]
+    assert page['rowCount'] == 4
+    assert rows.page({'startRow': 3, 'endRow': 100})['columns'][1][0] == 10.0
+    assert rows.page({'filterModel': {'dealer_name': text('equals', 'nobody')}})['rowCount'] == 0
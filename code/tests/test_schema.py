@@ -0,0 +1,27 @@
+"""The declared schema keeps the values the dashboard shows and exports."""
+import numpy as np
+import pandas as pd
+
+from schema import COUNT_COLUMNS, RATIO_COLUMNS, apply_schema, footprint
+
+
+def test_ratios_keep_their_digits():
+    frame = pd.DataFrame({column: [71.64868902927581, np.nan] for column in RATIO_COLUMNS})
+    np.testing.assert_array_equal(apply_schema(frame)[RATIO_COLUMNS].to_numpy(), frame.to_numpy())
+
+
+def test_counts_are_exact():
+    frame = pd.DataFrame({column: [374.0, np.nan, 16_000_000.0] for column in COUNT_COLUMNS})
+    np.testing.assert_array_equal(apply_schema(frame)[COUNT_COLUMNS].to_numpy(dtype='float64'), frame.to_numpy())
+
+
+def test_footprint_counts_shared_buffers_once():
+    frame = pd.DataFrame({'a': np.arange(1000, dtype='float64'), 'b': np.arange(1000, dtype='float64')})
+    size = footprint(frame)
+    assert size >= 16_000
+    with pd.option_context('mode.copy_on_write', True):
+        projection = frame[['a']]
+        seen = {}
+        assert footprint(frame, seen) == size and footprint(projection, seen) == 0
+        assert footprint({'frames': [frame, projection, frame.iloc[:10]]}) == size
+    assert footprint([frame, frame.copy()]) == 2 * size